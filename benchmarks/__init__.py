@@ -0,0 +1,4 @@
+from .synthetic import generate, generate_scale
+from .suite import run_suite, compare
+from .importtime import check_imports
+from .standin import StandInServer
\ No newline at end of file
@@ -0,0 +1,86 @@
+import argparse
+import os
+import sys
+
+from .suite import run_suite, compare, benchmarks
+from .importtime import check_imports, entry_points
+from .loadtest import loadtest
+
+parser = argparse.ArgumentParser(
+    prog='python -m benchmarks',
+    description='Benchmarks the film margin pipeline on synthetic data'
+)
+commands = parser.add_subparsers(dest='command', required=True)
+## run ##
+run = commands.add_parser('run', help='run the benchmarks')
+run.add_argument(
+    '--scale', type=float, action='append',
+    help='multiple of the real history to generate (repeatable, default 1)'
+)
+run.add_argument(
+    '--only', action='append', choices=list(benchmarks.keys()),
+    help='benchmark to run (repeatable, default all)'
+)
+run.add_argument('--seed', type=int, default=0)
+run.add_argument('--repeat', type=int, default=3)
+run.add_argument('--output', default='bench_results.json')
+## compare ##
+comp = commands.add_parser('compare', help='flag regressions against a baseline')
+comp.add_argument('results')
+comp.add_argument('baseline', nargs='?', default='benchmarks/baseline.json')
+comp.add_argument(
+    '--threshold', type=float, default=0.1,
+    help='relative increase that counts as a regression (default 0.1)'
+)
+## importtime ##
+imports = commands.add_parser(
+    'importtime', help='guard the cold start import time of each entry point'
+)
+imports.add_argument(
+    '--only', action='append', choices=list(entry_points.keys()),
+    help='entry point to check (repeatable, default all)'
+)
+imports.add_argument('--repeat', type=int, default=5)
+imports.add_argument(
+    '--budget', type=float, default=None,
+    help='fail entry points that take longer than this many ms to import'
+)
+## loadtest ##
+load = commands.add_parser('loadtest', help='measure the latency of the margin service')
+load.add_argument(
+    '--url', default=None,
+    help='service to test (default a local one on synthetic grades)'
+)
+load.add_argument('--requests', type=int, default=5000)
+load.add_argument('--concurrency', type=int, default=8)
+load.add_argument('--scale', type=float, default=1)
+load.add_argument('--seed', type=int, default=0)
+load.add_argument('--cache-size', type=int, default=4096)
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    if args.command == 'run':
+        run_suite(
+            scales=args.scale or [1], names=args.only, seed=args.seed,
+            repeat=args.repeat, output=args.output
+        )
+    elif args.command == 'importtime':
+        results = check_imports(
+            names=args.only, repeat=args.repeat, budget_ms=args.budget
+        )
+        if any(result['failed'] for result in results):
+            sys.exit(1)
+    elif args.command == 'loadtest':
+        loadtest(
+            url=args.url, total=args.requests, concurrency=args.concurrency,
+            scale=args.scale, seed=args.seed, cache_size=args.cache_size
+        )
+    else:
+        for path in [args.results, args.baseline]:
+            if not os.path.exists(path):
+                print('{0} not found. Write results with python -m benchmarks run --output {0}'.format(path))
+                sys.exit(2)
+        regressions = compare(args.results, args.baseline, threshold=args.threshold)
+        if len(regressions) > 0:
+            print('{0} regressions or failures found'.format(len(regressions)))
+            sys.exit(1)
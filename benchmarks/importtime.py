@@ -0,0 +1,105 @@
+import os
+import subprocess
+import sys
+
+## modules slow enough to import that entry points should only load
+## them when they use them ##
+heavy_modules = ['statsmodels', 'scipy', 'supabase', 'nfelodcm', 'dotenv']
+
+## what each entry point imports, and the heavy modules it may load ##
+entry_points = {
+    'package' : {
+        'code' : 'import filmmargin',
+        'allowed' : []
+    },
+    'run' : {
+        'code' : 'from filmmargin.filmmargin import update_margins',
+        'allowed' : []
+    },
+    'score' : {
+        'code' : 'from filmmargin.scoring import score_grades',
+        'allowed' : []
+    },
+    'develop' : {
+        'code' : 'from filmmargin.development import run_development_regressions',
+        'allowed' : []
+    },
+    'serve' : {
+        'code' : 'from filmmargin.serving import serve_margins',
+        'allowed' : []
+    },
+}
+
+def parse_importtime(stderr):
+    '''
+    Parses the output of python -X importtime into the cumulative import
+    time in microseconds and the nesting depth of each module
+    '''
+    modules = {}
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        self_us, cumulative_us, module = line[len('import time:'):].split('|')
+        depth = len(module) - len(module.lstrip())
+        modules[module.strip()] = (int(cumulative_us), depth)
+    return modules
+
+def run_importtime(code):
+    '''
+    Runs code in a fresh interpreter with -X importtime and returns the
+    modules it imported
+    '''
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', code],
+        capture_output=True, text=True, env=os.environ.copy()
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1])
+    return parse_importtime(result.stderr)
+
+def measure_import(code, repeat=5):
+    '''
+    Returns the best time in ms over repeat fresh interpreters that code
+    spends importing, beyond what the interpreter imports at startup, and
+    the modules it imported
+    '''
+    startup = run_importtime('pass')
+    best = None
+    modules = {}
+    for index in range(0, repeat):
+        modules = run_importtime(code)
+        top = min(depth for us, depth in modules.values())
+        total = sum(
+            us for module, (us, depth) in modules.items()
+            if depth == top and module not in startup
+        ) / 1000
+        best = total if best is None else min(best, total)
+    return best, modules
+
+def check_imports(names=None, repeat=5, budget_ms=None):
+    '''
+    Measures the import time of each entry point and returns its results,
+    flagging entry points that load a heavy module they don't allow or
+    take longer than the budget
+    '''
+    results = []
+    for name in names or list(entry_points.keys()):
+        entry = entry_points[name]
+        total, modules = measure_import(entry['code'], repeat)
+        loaded = [
+            module for module in heavy_modules
+            if module in modules and module not in entry['allowed']
+        ]
+        failed = len(loaded) > 0 or (budget_ms is not None and total > budget_ms)
+        print('{0:<10} {1:>9.1f}ms{2}{3}'.format(
+            name, total,
+            '  loads {0}'.format(', '.join(loaded)) if len(loaded) > 0 else '',
+            '  FAILED' if failed else ''
+        ))
+        results.append({
+            'name' : name,
+            'import_ms' : total,
+            'heavy_modules' : loaded,
+            'failed' : failed
+        })
+    return results
@@ -0,0 +1,154 @@
+import numpy
+import http.client
+import json
+import multiprocessing
+import pathlib
+import threading
+import time
+from urllib.parse import urlparse, urlencode
+
+## share of requests of each kind ##
+query_mix = {'game' : 0.6, 'team' : 0.3, 'score' : 0.1}
+
+def get_json(url, path):
+    '''
+    Returns the json response of a GET request
+    '''
+    parsed = urlparse(url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=30)
+    conn.request('GET', path)
+    payload = json.loads(conn.getresponse().read())
+    conn.close()
+    return payload
+
+def fetch_keys(url):
+    '''
+    Returns the game_ids and (team, season) pairs a service can answer,
+    and the fields its models score
+    '''
+    keys = get_json(url, '/keys')
+    keys['fields'] = get_json(url, '/health')['fields']
+    return keys
+
+def build_requests(keys, n, seed=0, fields=()):
+    '''
+    Returns n (method, path, body) requests drawn from the keys in the
+    query_mix. Ids are drawn with a skew towards a few of them, so repeat
+    queries (and the cache) show up as they would in use
+    '''
+    rng = numpy.random.default_rng(seed)
+    kinds = rng.choice(list(query_mix.keys()), size=n, p=list(query_mix.values()))
+    requests = []
+    for kind in kinds:
+        if kind == 'game':
+            index = min(int(rng.zipf(1.2)) - 1, len(keys['game_ids']) - 1)
+            requests.append(('GET', '/margins?' + urlencode(
+                {'game_id' : keys['game_ids'][index]}
+            ), None))
+        elif kind == 'team':
+            index = min(int(rng.zipf(1.2)) - 1, len(keys['team_seasons']) - 1)
+            team, season = keys['team_seasons'][index]
+            requests.append(('GET', '/margins?' + urlencode(
+                {'team' : team, 'season' : season}
+            ), None))
+        else:
+            requests.append(('POST', '/score', json.dumps([
+                {field : round(float(rng.uniform(40, 90)), 1) for field in fields}
+            ]).encode('utf-8')))
+    return requests
+
+def run_client(url, requests, latencies, errors):
+    '''
+    Sends requests over one kept alive connection, recording the latency
+    of each
+    '''
+    parsed = urlparse(url)
+    conn = http.client.HTTPConnection(parsed.hostname, parsed.port, timeout=30)
+    for method, path, body in requests:
+        start = time.perf_counter()
+        headers = {} if body is None else {'Content-Type' : 'application/json'}
+        conn.request(method, path, body=body, headers=headers)
+        response = conn.getresponse()
+        response.read()
+        latencies.append(time.perf_counter() - start)
+        if response.status != 200:
+            errors.append(response.status)
+    conn.close()
+
+def run_loadtest(url, total=5000, concurrency=8, seed=0):
+    '''
+    Sends total requests to a margin service from concurrency clients and
+    returns the requests per second and p50 / p99 latency in ms
+    '''
+    keys = fetch_keys(url)
+    requests = build_requests(keys, total, seed, keys['fields'])
+    latencies = []
+    errors = []
+    threads = [
+        threading.Thread(
+            target=run_client,
+            args=(url, requests[index::concurrency], latencies, errors)
+        )
+        for index in range(0, concurrency)
+    ]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - start
+    latencies = numpy.array(latencies) * 1000
+    return {
+        'requests' : total,
+        'concurrency' : concurrency,
+        'errors' : len(errors),
+        'requests_per_s' : total / wall,
+        'p50_ms' : float(numpy.percentile(latencies, 50)),
+        'p99_ms' : float(numpy.percentile(latencies, 99)),
+    }
+
+def serve_synthetic(scale, seed, cache_size, queue):
+    '''
+    Serves the margins of synthetic grades, putting the url on the queue
+    once the service is up
+    '''
+    import logging
+    logging.disable(logging.INFO)
+    from .synthetic import generate_scale
+    from .suite import prepare_loader
+    from filmmargin.Service import MarginService
+    game_grades, games = generate_scale(scale, seed)
+    loader = prepare_loader(game_grades, games, steps=3)
+    service = MarginService(
+        loader.flat_game_grades,
+        pathlib.Path(__file__).parent.parent / 'config.json',
+        port=0, cache_size=cache_size
+    )
+    queue.put(service.url)
+    service.serve_forever()
+
+def loadtest(url=None, total=5000, concurrency=8, scale=1, seed=0, cache_size=4096):
+    '''
+    Load tests the service at url, or if none is passed, a service started
+    in its own process on synthetic grades, and prints the results
+    '''
+    process = None
+    if url is None:
+        queue = multiprocessing.get_context('spawn').Queue()
+        process = multiprocessing.get_context('spawn').Process(
+            target=serve_synthetic, args=(scale, seed, cache_size, queue),
+            daemon=True
+        )
+        process.start()
+        url = queue.get(timeout=600)
+    try:
+        result = run_loadtest(url, total=total, concurrency=concurrency, seed=seed)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.join()
+    print('{0} requests from {1} clients: {2:,.0f} req/s, p50 {3:.2f}ms, p99 {4:.2f}ms, {5} errors'.format(
+        result['requests'], result['concurrency'], result['requests_per_s'],
+        result['p50_ms'], result['p99_ms'], result['errors']
+    ))
+    return result
@@ -0,0 +1,211 @@
+import pandas as pd
+import numpy
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+## postgrest comparison operators ##
+operators = {
+    'eq' : lambda col, val: col == val,
+    'neq' : lambda col, val: col != val,
+    'gt' : lambda col, val: col > val,
+    'gte' : lambda col, val: col >= val,
+    'lt' : lambda col, val: col < val,
+    'lte' : lambda col, val: col <= val,
+}
+
+def split_top_level(expr):
+    '''
+    Splits a postgrest logic expression on commas that are not nested
+    in parentheses
+    '''
+    parts = []
+    depth = 0
+    current = ''
+    for char in expr:
+        if char == ',' and depth == 0:
+            parts.append(current)
+            current = ''
+            continue
+        if char == '(':
+            depth += 1
+        elif char == ')':
+            depth -= 1
+        current += char
+    parts.append(current)
+    return parts
+
+class StandInServer():
+    '''
+    Local stand in for the Supabase REST (PostgREST) endpoint of a single
+    table, served from a DataFrame, so SupabaseClient can be exercised
+    offline
+
+    Supports the parts of the API the client uses -- select, exact counts
+    on HEAD requests, eq/neq/gt/gte/lt/lte filters, or/and logic, order,
+    offset, and limit. max_rows caps rows per response like the server
+    setting, latency adds a delay to every request, and fail_every fails
+    every nth request with fail_status to exercise retries. It defaults to
+    a 500, since postgrest retries 503s itself before the client sees them
+
+    Use as a context manager, or call start() and stop()
+    '''
+    def __init__(
+        self, df, table='game_grades', max_rows=1000, latency=0,
+        fail_every=0, fail_status=500, host='127.0.0.1', port=0
+    ):
+        self.df = df.reset_index(drop=True)
+        self.table = table
+        self.max_rows = max_rows
+        self.latency = latency
+        self.fail_every = fail_every
+        self.fail_status = fail_status
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        '''
+        Base url to pass to create_client
+        '''
+        host, port = self.server.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    def start(self):
+        '''
+        Serves requests from a background thread
+        '''
+        self.thread = threading.Thread(
+            target=self.server.serve_forever, daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def stop(self):
+        '''
+        Shuts the server down
+        '''
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def condition(self, expr):
+        '''
+        Returns a row mask for a postgrest condition (col.op.value) or a
+        nested and(...)/or(...) expression
+        '''
+        for logic in ['and', 'or']:
+            if expr.startswith(logic + '('):
+                return self.logic(logic, expr[len(logic) + 1:-1])
+        col, op, val = expr.split('.', 2)
+        return self.compare(col, op, val)
+
+    def logic(self, kind, expr):
+        '''
+        Combines the conditions of an and/or expression
+        '''
+        masks = [self.condition(part) for part in split_top_level(expr)]
+        if kind == 'and':
+            return numpy.logical_and.reduce(masks)
+        return numpy.logical_or.reduce(masks)
+
+    def compare(self, col, op, val):
+        '''
+        Applies a comparison operator to a column
+        '''
+        values = self.df[col]
+        if pd.api.types.is_numeric_dtype(values):
+            val = float(val)
+        return operators[op](values, val).to_numpy()
+
+    def query(self, params):
+        '''
+        Returns the rows matching the query params and the total matches
+        '''
+        mask = numpy.ones(len(self.df), dtype=bool)
+        order = None
+        offset = 0
+        limit = None
+        for name, value in params:
+            if name == 'select':
+                continue
+            elif name == 'order':
+                order = value
+            elif name == 'offset':
+                offset = int(value)
+            elif name == 'limit':
+                limit = int(value)
+            elif name in ['or', 'and']:
+                mask &= self.logic(name, value[1:-1])
+            else:
+                op, val = value.split('.', 1)
+                mask &= self.compare(name, op, val)
+        rows = self.df[mask]
+        if order is not None:
+            cols = [part.split('.') for part in order.split(',')]
+            rows = rows.sort_values(
+                by=[col[0] for col in cols],
+                ascending=[len(col) < 2 or col[1] != 'desc' for col in cols],
+                kind='stable'
+            )
+        total = len(rows)
+        if limit is None:
+            limit = total
+        limit = min(limit, self.max_rows) if self.max_rows else limit
+        return rows.iloc[offset:offset + limit], offset, total
+
+    def handler(self):
+        '''
+        Builds the request handler class bound to this server
+        '''
+        standin = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def respond(self, body):
+                with standin.lock:
+                    standin.requests += 1
+                    request_num = standin.requests
+                if standin.latency:
+                    time.sleep(standin.latency)
+                parsed = urlparse(self.path)
+                if parsed.path.rstrip('/') != '/rest/v1/{0}'.format(standin.table):
+                    self.send_error(404)
+                    return
+                if standin.fail_every and request_num % standin.fail_every == 0:
+                    self.send_error(standin.fail_status)
+                    return
+                rows, offset, total = standin.query(parse_qsl(parsed.query))
+                payload = rows.to_json(orient='records').encode('utf-8')
+                count = (
+                    str(total) if 'count=exact' in self.headers.get('Prefer', '')
+                    else '*'
+                )
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.send_header('Content-Range', '{0}/{1}'.format(
+                    '{0}-{1}'.format(offset, offset + len(rows) - 1)
+                    if len(rows) > 0 else '*',
+                    count
+                ))
+                self.end_headers()
+                if body:
+                    self.wfile.write(payload)
+
+            def do_GET(self):
+                self.respond(body=True)
+
+            def do_HEAD(self):
+                self.respond(body=False)
+        return Handler
@@ -0,0 +1,335 @@
+import pandas as pd
+import numpy
+import contextlib
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import tempfile
+import time
+
+from .synthetic import generate_scale
+from .standin import StandInServer
+
+## fake anon key, only used against the stand in server ##
+standin_key = 'eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.standin'
+
+## fields used by the regression benchmarks ##
+predictive_fields = [
+    'overall_grade', 'opponent_overall_grade',
+    'pass_grade', 'run_defense_grade'
+]
+
+## steps DataLoader runs after its data is fetched ##
+loader_steps = ['add_game_id', 'flatten_game_grades', 'add_seasonal_margin']
+
+def reset_peak_rss():
+    '''
+    Resets the process's peak RSS where the OS allows it (Linux)
+    '''
+    try:
+        with open('/proc/self/clear_refs', 'w') as fp:
+            fp.write('5')
+    except OSError:
+        pass
+
+def status_mb(field):
+    '''
+    Returns a memory field (ie VmRSS) of /proc/self/status in MB, or None
+    off Linux
+    '''
+    try:
+        with open('/proc/self/status', 'r') as fp:
+            for line in fp:
+                if line.startswith('{0}:'.format(field)):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+def peak_rss_mb():
+    '''
+    Returns the process's peak RSS in MB
+    '''
+    peak = status_mb('VmHWM')
+    if peak is not None:
+        return peak
+    ## ru_maxrss is KB on linux and bytes on mac ##
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / 1024 ** 2 if platform.system() == 'Darwin' else peak / 1024
+
+def prepare_loader(game_grades, games, steps=0):
+    '''
+    Builds a DataLoader around already fetched frames, running the first
+    steps of its processing
+    '''
+    from filmmargin.DataLoader import DataLoader, GameIndex
+    loader = object.__new__(DataLoader)
+    loader.cached = {}
+    loader.game_grades = game_grades.copy()
+    loader.games = games
+    loader.game_index = GameIndex.from_games(games)
+    for step in loader_steps[:steps]:
+        getattr(loader, step)()
+    return loader
+
+def prepare_regression(game_grades, games, train=False):
+    '''
+    Builds a seeded regression over the flat grades
+    '''
+    from filmmargin.Regression import Regression
+    loader = prepare_loader(game_grades, games, steps=3)
+    reg = Regression(
+        df=loader.flat_game_grades,
+        fields=predictive_fields,
+        dependent='seasonal_margin',
+        windowing_fields=['season', 'team'],
+        seed=0
+    )
+    if train:
+        reg.train()
+    return {'loader' : loader, 'reg' : reg}
+
+class StandInEnvironment():
+    '''
+    Points the package's env vars at a stand in Supabase server serving the
+    synthetic grades, and at a temp cache holding the synthetic games, so
+    end to end runs need no network
+    '''
+    def __init__(self, game_grades, games):
+        from filmmargin.Cache import SnapshotCache
+        self.directory = tempfile.mkdtemp(prefix='filmmargin-bench-')
+        SnapshotCache(self.directory).put('games', 'synthetic', games)
+        self.server = StandInServer(game_grades).start()
+        self.env = {
+            'SUPABASE_URL' : self.server.url,
+            'SUPABASE_KEY' : standin_key,
+            'SUPABASE_TABLE' : self.server.table,
+            'FILMMARGIN_CACHE_DIR' : self.directory
+        }
+        self.previous = {k : os.environ.get(k) for k in self.env}
+        os.environ.update(self.env)
+        self.rows = len(game_grades)
+
+    def close(self):
+        self.server.stop()
+        for k, v in self.previous.items():
+            if v is None:
+                os.environ.pop(k, None)
+            else:
+                os.environ[k] = v
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+def run_update_margins(env):
+    from filmmargin import update_margins
+    update_margins(output_path='{0}/film_margins.csv'.format(env.directory))
+    return env.rows
+
+def run_development(env):
+    from filmmargin import run_development_regressions
+    run_development_regressions(total_rounds=10, seed=0)
+    return env.rows * 2 * 10
+
+def run_window(state):
+    reg = state['reg']
+    ## the split is drawn again, so it is timed along with the slicing ##
+    reg.train_rows, reg.test_rows = reg.split_rows()
+    reg.window()
+    return len(reg.df)
+
+## each benchmark's setup (from the synthetic frames) and timed run,
+## which returns the rows it processed ##
+benchmarks = {
+    'add_game_id' : {
+        'setup' : lambda gg, g: prepare_loader(gg, g, steps=0),
+        'run' : lambda loader: loader.add_game_id() or len(loader.game_grades)
+    },
+    'flatten_game_grades' : {
+        'setup' : lambda gg, g: prepare_loader(gg, g, steps=1),
+        'run' : lambda loader: (
+            loader.flatten_game_grades() or len(loader.flat_game_grades)
+        )
+    },
+    'add_seasonal_margin' : {
+        'setup' : lambda gg, g: prepare_loader(gg, g, steps=2),
+        'run' : lambda loader: (
+            loader.add_seasonal_margin() or len(loader.flat_game_grades)
+        )
+    },
+    'regression_window' : {
+        'setup' : lambda gg, g: prepare_regression(gg, g),
+        'run' : run_window
+    },
+    'regression_train' : {
+        'setup' : lambda gg, g: prepare_regression(gg, g),
+        'run' : lambda state: (
+            state['reg'].train() or len(state['reg'].train_df)
+        )
+    },
+    'regression_score' : {
+        'setup' : lambda gg, g: prepare_regression(gg, g, train=True),
+        'run' : lambda state: (
+            state['reg'].score() or len(state['reg'].df)
+        )
+    },
+    'run_development_regressions' : {
+        'setup' : StandInEnvironment,
+        'run' : run_development,
+        'teardown' : lambda env: env.close()
+    },
+    'update_margins' : {
+        'setup' : StandInEnvironment,
+        'run' : run_update_margins,
+        'teardown' : lambda env: env.close()
+    },
+}
+
+def run_benchmark(name, scale, seed, repeat, queue):
+    '''
+    Runs a single benchmark in its own process so its peak RSS is its own.
+    Puts the best wall time of the repeats, the peak RSS, and how far the
+    peak rose over the RSS before the run on the queue
+    '''
+    try:
+        queue.put(time_benchmark(name, scale, seed, repeat))
+    except Exception as e:
+        queue.put({'name' : name, 'scale' : scale, 'error' : repr(e)})
+
+def time_benchmark(name, scale, seed, repeat):
+    '''
+    Times a benchmark's repeats and returns its result
+    '''
+    bench = benchmarks[name]
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        game_grades, games = generate_scale(scale, seed)
+        times = []
+        peaks = []
+        growths = []
+        for index in range(0, repeat):
+            state = bench['setup'](game_grades, games)
+            try:
+                gc.collect()
+                reset_peak_rss()
+                before = status_mb('VmRSS')
+                start = time.perf_counter()
+                rows = bench['run'](state)
+                times.append(time.perf_counter() - start)
+                peaks.append(peak_rss_mb())
+                if before is not None:
+                    growths.append(peaks[-1] - before)
+            finally:
+                if 'teardown' in bench:
+                    bench['teardown'](state)
+    return {
+        'name' : name,
+        'scale' : scale,
+        'rows' : int(rows),
+        'wall_s' : min(times),
+        'peak_rss_mb' : max(peaks),
+        'rss_growth_mb' : max(growths) if len(growths) > 0 else None,
+        'rows_per_s' : rows / min(times) if min(times) > 0 else None
+    }
+
+def run_suite(scales=(1,), names=None, seed=0, repeat=3, output=None):
+    '''
+    Runs the benchmarks at each scale (a multiple of the real history) and
+    returns the results, writing them to output as json if passed
+    '''
+    names = names or list(benchmarks.keys())
+    unknown = [name for name in names if name not in benchmarks]
+    if len(unknown) > 0:
+        raise ValueError('Unknown benchmarks: {0}'.format(', '.join(unknown)))
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for scale in scales:
+        for name in names:
+            queue = context.Queue()
+            process = context.Process(
+                target=run_benchmark, args=(name, scale, seed, repeat, queue)
+            )
+            process.start()
+            result = queue.get()
+            process.join()
+            results.append(result)
+            if 'error' in result:
+                print('{0:<30} scale {1:<6} failed: {2}'.format(
+                    name, scale, result['error']
+                ))
+                continue
+            print('{0:<30} scale {1:<6} {2:>10.4f}s {3:>9.1f}MB {4:>14,.0f} rows/s'.format(
+                name, scale, result['wall_s'], result['peak_rss_mb'],
+                result['rows_per_s'] or 0
+            ))
+    report = {
+        'meta' : {
+            'created' : time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python' : platform.python_version(),
+            'platform' : platform.platform(),
+            'numpy' : numpy.__version__,
+            'pandas' : pd.__version__,
+            'seed' : seed,
+            'repeat' : repeat
+        },
+        'results' : results
+    }
+    if output is not None:
+        with open(output, 'w') as fp:
+            json.dump(report, fp, indent=4)
+    return report
+
+def compare(results, baseline, threshold=0.1, metrics=('wall_s', 'peak_rss_mb')):
+    '''
+    Compares results to a baseline (reports or paths to them) and returns
+    the benchmarks whose metrics grew by more than the threshold, along with
+    any that errored or that the baseline has no result for
+
+    Times are absolute, so a baseline is only meaningful on the machine it
+    was run on. A baseline from another platform is flagged, and should be
+    regenerated there (see run_suite) before comparing
+    '''
+    reports = []
+    metas = []
+    for report in [results, baseline]:
+        if not isinstance(report, dict):
+            with open(report, 'r') as fp:
+                report = json.load(fp)
+        metas.append(report.get('meta', {}))
+        reports.append({
+            (result['name'], result['scale']) : result
+            for result in report['results']
+        })
+    results, baseline = reports
+    if metas[0].get('platform') != metas[1].get('platform'):
+        print('Warning - the baseline was run on {0}, not {1}. Times are machine local, so regenerate it here'.format(
+            metas[1].get('platform'), metas[0].get('platform')
+        ))
+    regressions = []
+    for key, result in results.items():
+        ## a benchmark that can't be compared fails rather than passing ##
+        if 'error' in result or key not in baseline:
+            reason = result['error'] if 'error' in result else 'not in the baseline'
+            print('{0:<30} scale {1:<6} FAILED ({2})'.format(key[0], key[1], reason))
+            regressions.append({
+                'name' : key[0], 'scale' : key[1], 'metric' : None,
+                'error' : reason
+            })
+            continue
+        for metric in metrics:
+            base = baseline[key].get(metric)
+            if not base or result.get(metric) is None:
+                continue
+            change = result[metric] / base - 1
+            flag = change > threshold
+            print('{0:<30} scale {1:<6} {2:<12} {3:>10.4f} -> {4:>10.4f} {5:>+8.1%}{6}'.format(
+                key[0], key[1], metric, base, result[metric], change,
+                '  REGRESSION' if flag else ''
+            ))
+            if flag:
+                regressions.append({
+                    'name' : key[0], 'scale' : key[1], 'metric' : metric,
+                    'baseline' : base, 'result' : result[metric], 'change' : change
+                })
+    return regressions
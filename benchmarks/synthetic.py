@@ -0,0 +1,105 @@
+import pandas as pd
+import numpy
+
+## team abbreviations as they appear in nfelodcm and the grades table ##
+teams = [
+    'ARI', 'ATL', 'BAL', 'BUF', 'CAR', 'CHI', 'CIN', 'CLE',
+    'DAL', 'DEN', 'DET', 'GB', 'HOU', 'IND', 'JAX', 'KC',
+    'LA', 'LAC', 'LV', 'MIA', 'MIN', 'NE', 'NO', 'NYG',
+    'NYJ', 'PHI', 'PIT', 'SEA', 'SF', 'TB', 'TEN', 'WAS'
+]
+
+## PFF team grades, in the order of the grades table ##
+grades = [
+    'overall_grade', 'offense_grade', 'pass_grade', 'pass_block_grade',
+    'pass_route_grade', 'run_grade', 'run_block_grade', 'defense_grade',
+    'coverage_defense_grade', 'pass_rush_defense_grade',
+    'run_defense_grade', 'tackle_grade', 'misc_st_grade'
+]
+
+## seasons of real history, which scales are multiples of ##
+history_seasons = 17
+
+def generate(seasons=1, seed=0, weeks=18, start_season=2009, missing_rate=0.0, unplayed_weeks=1):
+    '''
+    Generates a synthetic (game_grades, games) pair in the schema DataLoader
+    expects from Supabase and nfelodcm
+
+    Each week pairs all 32 teams into 16 games. Every team has a strength per
+    season and a performance per game that drives both its grades and the
+    score, so grades are predictive of margin the way the real ones are.
+    missing_rate blanks that share of the grades, and unplayed_weeks adds
+    games without a result to the games table only, as nfelodcm has for
+    upcoming weeks
+    '''
+    rng = numpy.random.default_rng(seed)
+    n_weeks = seasons * weeks + unplayed_weeks
+    ## pair teams each week ##
+    order = rng.permuted(
+        numpy.tile(numpy.arange(len(teams)), (n_weeks, 1)), axis=1
+    )
+    home = order[:, 0::2].ravel()
+    away = order[:, 1::2].ravel()
+    games_per_week = len(teams) // 2
+    week_index = numpy.repeat(numpy.arange(n_weeks), games_per_week)
+    season = start_season + week_index // weeks
+    week = week_index % weeks + 1
+    ## performance ##
+    strength = rng.normal(0, 4, (seasons + 1, len(teams)))
+    home_perf = strength[season - start_season, home] + rng.normal(0, 6, len(home))
+    away_perf = strength[season - start_season, away] + rng.normal(0, 6, len(home))
+    home_score = numpy.clip(
+        numpy.round(22 + 0.6 * (home_perf - away_perf) + rng.normal(0, 7, len(home))), 0, None
+    ).astype(numpy.int64)
+    away_score = numpy.clip(
+        numpy.round(20 + 0.6 * (away_perf - home_perf) + rng.normal(0, 7, len(home))), 0, None
+    ).astype(numpy.int64)
+    ## nfelodcm games ##
+    home_team = numpy.array(teams, dtype=object)[home]
+    away_team = numpy.array(teams, dtype=object)[away]
+    played = week_index < seasons * weeks
+    games = pd.DataFrame({
+        'game_id' : (
+            pd.Series(season).astype(str) + '_' +
+            pd.Series(week).astype(str).str.zfill(2) + '_' +
+            pd.Series(away_team) + '_' + pd.Series(home_team)
+        ),
+        'season' : season,
+        'week' : week,
+        'home_team' : home_team,
+        'away_team' : away_team,
+        'home_score' : numpy.where(played, home_score, numpy.nan),
+        'away_score' : numpy.where(played, away_score, numpy.nan),
+        'result' : numpy.where(played, home_score - away_score, numpy.nan)
+    })
+    ## supabase grades, for played games only ##
+    n = played.sum()
+    columns = {
+        'game_id' : numpy.arange(n) + 100000,
+        'season' : season[played],
+        'week' : week[played],
+        'home_team' : home_team[played],
+        'away_team' : away_team[played],
+        'home_score' : home_score[played],
+        'away_score' : away_score[played],
+    }
+    for side, perf in [('home', home_perf[played]), ('away', away_perf[played])]:
+        for index, grade in enumerate(grades):
+            loading = 1.5 if index == 0 else rng.uniform(0.3, 1.2)
+            values = numpy.round(
+                numpy.clip(65 + loading * perf + rng.normal(0, 6, n), 25, 95), 1
+            )
+            if missing_rate > 0:
+                values[rng.random(n) < missing_rate] = numpy.nan
+            columns['{0}_{1}'.format(side, grade)] = values
+    game_grades = pd.DataFrame(columns)
+    return game_grades, games
+
+def generate_scale(scale=1.0, seed=0, **kwargs):
+    '''
+    Generates data for a multiple of the real history (scale=1 is about
+    17 seasons). Scales below one round to at least one season
+    '''
+    return generate(
+        seasons=max(1, int(round(scale * history_seasons))), seed=seed, **kwargs
+    )
@@ -0,0 +1 @@
+from .cache import SnapshotCache
\ No newline at end of file
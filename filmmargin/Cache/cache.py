@@ -0,0 +1,115 @@
+import pandas as pd
+import os
+import re
+import threading
+import time
+import pathlib
+
+from ..Profiler import profiler, logger
+
+## set top level pacakage directory ##
+package_dir = pathlib.Path(__file__).parent.parent.parent.resolve()
+
+class SnapshotCache():
+    '''
+    On disk cache of table snapshots, stored as parquet files named by the
+    table and a fingerprint of its contents (ie row count and max game_id)
+
+    Snapshots older than ttl seconds are treated as stale, and once the
+    directory holds more than max_bytes the least recently used snapshots
+    are evicted. The directory defaults to FILMMARGIN_CACHE_DIR, falling
+    back to .cache in the package directory. Writes are serialized, so
+    tables can be loaded into the same cache from parallel threads
+    '''
+    def __init__(self, directory=None, ttl=24 * 60 * 60, max_bytes=500 * 1024 ** 2):
+        self.directory = pathlib.Path(
+            directory or os.getenv('FILMMARGIN_CACHE_DIR') or
+            '{0}/.cache'.format(package_dir)
+        )
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def clean(self, value):
+        '''
+        Makes a table name or fingerprint safe to use in a file name
+        '''
+        return re.sub(r'[^A-Za-z0-9.-]+', '_', str(value))
+
+    def snapshots(self, table):
+        '''
+        Returns the snapshot files of a table, newest first
+        '''
+        return sorted(
+            self.directory.glob('{0}__*.parquet'.format(self.clean(table))),
+            key=lambda path: path.stat().st_mtime,
+            reverse=True
+        )
+
+    def is_fresh(self, path):
+        '''
+        Whether a snapshot was written within the ttl
+        '''
+        return self.ttl is None or time.time() - path.stat().st_mtime < self.ttl
+
+    @profiler.timed('cache_get')
+    def get(self, table, fingerprint=None, fresh=True):
+        '''
+        Returns the newest snapshot of a table and its fingerprint, or
+        (None, None) if there is not one. A fingerprint limits the lookup to
+        that exact snapshot, and fresh=False allows snapshots past the ttl
+        '''
+        for path in self.snapshots(table):
+            if fingerprint is not None and path.stem != '{0}__{1}'.format(
+                self.clean(table), self.clean(fingerprint)
+            ):
+                continue
+            if fresh and not self.is_fresh(path):
+                continue
+            ## mark as used for eviction ##
+            os.utime(path, (time.time(), path.stat().st_mtime))
+            return pd.read_parquet(path), path.stem.split('__', 1)[1]
+        return None, None
+
+    @profiler.timed('cache_put')
+    def put(self, table, fingerprint, df):
+        '''
+        Writes a snapshot atomically, replacing older snapshots of the table
+        Tables that cannot be written as parquet are not cached
+        '''
+        path = self.directory / '{0}__{1}.parquet'.format(
+            self.clean(table), self.clean(fingerprint)
+        )
+        temp = path.with_suffix('.tmp')
+        try:
+            df.to_parquet(temp, index=False)
+        except Exception as e:
+            logger.warning('     Warning - could not cache {0} ({1})'.format(table, e))
+            if temp.exists():
+                temp.unlink()
+            return
+        with self.lock:
+            os.replace(temp, path)
+            for old in self.snapshots(table):
+                if old != path:
+                    old.unlink()
+            self.evict()
+
+    def evict(self):
+        '''
+        Removes least recently used snapshots until the directory is under
+        max_bytes
+        '''
+        if self.max_bytes is None:
+            return
+        paths = sorted(
+            self.directory.glob('*.parquet'),
+            key=lambda path: path.stat().st_atime
+        )
+        total = sum(path.stat().st_size for path in paths)
+        for path in paths[:-1]:
+            if total <= self.max_bytes:
+                break
+            total -= path.stat().st_size
+            path.unlink()
@@ -1 +1,3 @@
-from .dataloader import DataLoader
\ No newline at end of file
+from .dataloader import DataLoader, load_credentials
+from .targets import TargetBuilder, parse_target
+from .gameindex import GameIndex, encode_keys
\ No newline at end of file
@@ -1,172 +1,416 @@
 import pandas as pd
 import numpy
+import os
 import pathlib
+import threading
+from concurrent.futures import Future, wait, FIRST_EXCEPTION
 
-import nfelodcm
-
-from dotenv import load_dotenv
 from ..Supabase import SupabaseClient
+from ..Cache import SnapshotCache
+from ..Regression import FieldMatrix
+from .targets import TargetBuilder, parse_target
+from .gameindex import GameIndex
+from ..Profiler import profiler, logger
 
 ## set top level pacakage directory ##
 package_dir = pathlib.Path(__file__).parent.parent.parent.resolve()
 
-## load the dot env ##
+## dot env with the Supabase credentials ##
 env_path = '{0}/.env'.format(package_dir)
-load_dotenv(env_path)
+
+def run_in_daemon(func, *args):
+    '''
+    Calls func on a daemon thread and returns a Future of its result. Its
+    stages are profiled under the caller's current stage
+    '''
+    future = Future()
+    parent = profiler.current()
+    def run():
+        future.set_running_or_notify_cancel()
+        try:
+            with profiler.within(parent):
+                future.set_result(func(*args))
+        except BaseException as e:
+            future.set_exception(e)
+    threading.Thread(target=run, daemon=True).start()
+    return future
+
+def load_credentials():
+    '''
+    Returns the Supabase url, key, and table. The dot env is only loaded
+    when credentials are requested, and does not override the env
+    '''
+    from dotenv import load_dotenv
+    load_dotenv(env_path)
+    return (
+        os.getenv('SUPABASE_URL'),
+        os.getenv('SUPABASE_KEY'),
+        os.getenv('SUPABASE_TABLE')
+    )
 
 class DataLoader():
     '''
     Loads all data necessary for package
+    Passing since=(season, week) only loads grades from that week on,
+    in which case seasonal margins only reflect the weeks loaded
+
+    The games and the game grades are fetched in parallel, and a
+    TimeoutError is raised if both haven't loaded within timeout seconds.
+    Everything derived from them (game ids, the flat game grades, targets,
+    and the field matrix) is built the first time it is used
+
+    Source tables are cached as local snapshots. With refresh='auto' the
+    grades snapshot is used if its fingerprint matches the table's, and
+    only rows past its last game_id are fetched when new games were added.
+    The games snapshot is used until its ttl runs out. refresh='force'
+    always reloads both sources and refresh='never' uses any snapshot
+    on disk, regardless of age. Grades are matched to nflfastr game ids
+    through a GameIndex of the completed games, which is saved to the
+    cache and only has newly completed games added to it
+
+    targets are added to the flat game grades when they are built. By
+    default that's the seasonal_margin, and other targets average a value
+    over other games in each team's season (ie margin_season_others,
+    margin_next_3, see TargetBuilder), any of which can be used as a
+    regression's dependent. Runs that only score (ie update_margins) can
+    pass targets=[]
+
+    The numeric columns of the flat game grades are indexed in
+    field_matrix, which regressions gather their rows from
     '''
-    def __init__(self, url, key, table):
-        self.db = nfelodcm.load(['games'])
-        self.games = self.db['games']
-        self.sb_client = SupabaseClient(url, key, table)
-        self.game_grades = self.sb_client.get_data()
-        self.flat_game_grades = None
-        self.add_game_id()
-        self.flatten_game_grades()
-        self.add_seasonal_margin()
+    def __init__(
+        self, url, key, table, since=None, refresh='auto', cache_dir=None,
+        targets=('seasonal_margin',), timeout=600
+    ):
+        if refresh not in ['auto', 'force', 'never']:
+            raise ValueError('Unknown refresh mode: {0}'.format(refresh))
+        self.refresh = refresh
+        self.cache = SnapshotCache(cache_dir)
+        self.table = table
+        self.targets = list(targets)
+        ## frames derived from the sources, built on first use ##
+        self.cached = {}
+        self.sb_client = None
+        self.game_index = None
+        self.games_fingerprint = None
+        self.unmatched_game_grades = None
+        self.games, self.loaded_game_grades = self.fetch(url, key, since, timeout)
+
+    def fetch(self, url, key, since=None, timeout=None):
+        '''
+        Loads the games and game grades at the same time, since neither
+        depends on the other, and returns them once both have loaded.
+        A failure in either is raised as soon as it happens
+
+        Each source loads on a daemon thread, so a source that times out
+        is abandoned rather than holding the interpreter open at exit
+        '''
+        games = run_in_daemon(self.fetch_games)
+        grades = run_in_daemon(self.fetch_game_grades, url, key, since)
+        done, pending = wait(
+            [games, grades], timeout=timeout, return_when=FIRST_EXCEPTION
+        )
+        for future in done:
+            if future.exception() is not None:
+                raise future.exception()
+        if len(pending) > 0:
+            raise TimeoutError('{0} did not load within {1}s'.format(
+                ' and '.join(
+                    name for name, future in [('games', games), ('game grades', grades)]
+                    if future in pending
+                ), timeout
+            ))
+        return games.result(), grades.result()
+
+    def fetch_games(self):
+        '''
+        Loads the games as a stage of its own
+        '''
+        with profiler.stage('load_games'):
+            return self.load_games()
+
+    def fetch_game_grades(self, url, key, since=None):
+        '''
+        Connects to Supabase and loads the game grades as a stage of its own
+        '''
+        with profiler.stage('load_game_grades'):
+            self.sb_client = SupabaseClient(url, key, self.table)
+            return self.load_game_grades(since)
+
+    @property
+    def game_grades(self):
+        '''
+        The game grades with nflfastr game ids, which are added the first
+        time they are used
+        '''
+        if 'game_grades' not in self.cached:
+            self.cached['game_grades'] = self.loaded_game_grades
+            if len(self.loaded_game_grades) > 0:
+                self.add_game_id()
+        return self.cached['game_grades']
+
+    @game_grades.setter
+    def game_grades(self, df):
+        ## new grades replace everything derived from the old ones ##
+        self.cached = {'game_grades' : df}
+
+    @property
+    def flat_game_grades(self):
+        '''
+        The game grades flattened by team and week, with the targets,
+        built the first time they are used
+        '''
+        if 'flat_game_grades' not in self.cached:
+            if len(self.game_grades) == 0:
+                self.cached['flat_game_grades'] = pd.DataFrame()
+            else:
+                self.flatten_game_grades()
+                self.add_targets(self.targets)
+        return self.cached['flat_game_grades']
+
+    @flat_game_grades.setter
+    def flat_game_grades(self, df):
+        self.cached['flat_game_grades'] = df
+        self.cached.pop('field_matrix', None)
+
+    @property
+    def field_matrix(self):
+        '''
+        FieldMatrix of the flat game grades' numeric columns, built the
+        first time it is used, or None if there are no grades
+        '''
+        if 'field_matrix' not in self.cached:
+            if len(self.flat_game_grades) == 0:
+                return None
+            with profiler.stage('field_matrix'):
+                self.cached['field_matrix'] = FieldMatrix(self.flat_game_grades)
+        return self.cached['field_matrix']
+
+    def load_games(self):
+        '''
+        Loads the nfelodcm games, from the cache when it allows
+        '''
+        if self.refresh != 'force':
+            games, fingerprint = self.cache.get(
+                'games', fresh=self.refresh == 'auto'
+            )
+            if games is not None:
+                self.db = {'games' : games}
+                self.games_fingerprint = fingerprint
+                return games
+        import nfelodcm
+        with profiler.stage('nfelodcm_load'):
+            self.db = nfelodcm.load(['games'])
+        games = self.db['games']
+        fingerprint = '{0}-{1}'.format(
+            len(games), games[~pd.isnull(games['result'])]['game_id'].max()
+        )
+        self.cache.put('games', fingerprint, games)
+        self.games_fingerprint = self.cache.clean(fingerprint)
+        return games
+
+    @profiler.timed('load_game_index')
+    def load_game_index(self):
+        '''
+        Loads the game index from the cache. If it was saved from other
+        games than the ones loaded, the games that completed since are
+        added to it and it is saved again
+        '''
+        frame, fingerprint = self.cache.get('game_index', fresh=False)
+        index = GameIndex() if frame is None else GameIndex.from_frame(frame)
+        if frame is None or fingerprint != self.games_fingerprint:
+            added = index.add(self.games)
+            if frame is None or added > 0:
+                self.cache.put('game_index', self.games_fingerprint, index.to_frame())
+        return index
 
+    def patch_game_grades(self, grades, fingerprint):
+        '''
+        Adds grades for games added since a snapshot was taken. Returns None
+        if the table changed in any other way, since the snapshot can't be
+        patched in that case
+        '''
+        new_grades = self.sb_client.get_data(after=grades['game_id'].max())
+        grades = pd.concat([grades, new_grades]).reset_index(drop=True)
+        if '{0}-{1}'.format(len(grades), grades['game_id'].max()) != fingerprint:
+            return None
+        self.cache.put(self.table, fingerprint, grades)
+        return grades
+
+    def load_game_grades(self, since=None):
+        '''
+        Loads the game grades, from the cache when it allows, and limits
+        them to weeks on or after since. Without a usable snapshot, only the
+        weeks on or after since are downloaded, and since they aren't the
+        whole table they aren't cached
+        '''
+        grades = None
+        fingerprint = None
+        if self.refresh == 'never':
+            grades, cached_fingerprint = self.cache.get(self.table, fresh=False)
+        elif self.refresh == 'auto':
+            fingerprint = self.sb_client.get_fingerprint()
+            grades, cached_fingerprint = self.cache.get(self.table)
+            if grades is not None and cached_fingerprint != self.cache.clean(fingerprint):
+                grades = self.patch_game_grades(grades, fingerprint)
+        if grades is None:
+            if since is not None:
+                return self.sb_client.get_data(since=since)
+            if fingerprint is None:
+                fingerprint = self.sb_client.get_fingerprint()
+            grades = self.sb_client.get_data()
+            if len(grades) > 0:
+                self.cache.put(self.table, fingerprint, grades)
+        ## limit to the requested weeks ##
+        if since is not None and len(grades) > 0:
+            grades = grades[
+                (grades['season'] > since[0]) |
+                (
+                    (grades['season'] == since[0]) &
+                    (grades['week'] >= since[1])
+                )
+            ].reset_index(drop=True)
+        return grades
+
+    @profiler.timed('add_game_id')
     def add_game_id(self):
         '''
         Replaces game grade ids with nflfastr ids
+        Grades without a completed game keep a NA id, and are listed
+        in unmatched_game_grades
         '''
-        ## drop ids ##
-        self.game_grades = self.game_grades.drop(columns=['game_id'])
-        ## merge #
-        self.game_grades = pd.merge(
-            self.game_grades,
-            self.games[
-                ~pd.isnull(self.games['result'])
-            ][[
-                'game_id', 'season', 'week',
-                'home_team', 'away_team'
-            ]].copy(),
-            on=['season', 'week', 'home_team', 'away_team'],
-            how='left'
+        if self.game_index is None:
+            self.game_index = self.load_game_index()
+        grades = self.game_grades
+        game_ids, matched = self.game_index.lookup(
+            grades['season'], grades['week'],
+            grades['home_team'], grades['away_team']
         )
+        ## replace ids, without copying the other columns ##
+        grades = grades.copy(deep=False)
+        grades['game_id'] = game_ids
+        self.unmatched_game_grades = self.game_index.unmatched(grades, matched)
+        if len(self.unmatched_game_grades) > 0:
+            logger.warning('     Warning - {0} game grades did not match a completed game'.format(
+                int((~matched).sum())
+            ))
+        self.game_grades = grades
     
+    def grade_names(self):
+        '''
+        Returns the grades (ie overall_grade) with both a home and away
+        column in the game grades, in the order they appear
+        '''
+        return [
+            col[len('home_'):] for col in self.game_grades.columns
+            if col.startswith('home_') and col.endswith('_grade') and
+            'away_{0}'.format(col[len('home_'):]) in self.game_grades.columns
+        ]
+
+    def interleave(self, home, away):
+        '''
+        Returns an array with each game's home value followed by its
+        away value
+        '''
+        values = numpy.empty((2 * len(home),) + home.shape[1:], dtype=home.dtype)
+        values[0::2] = home
+        values[1::2] = away
+        return values
+
+    @profiler.timed('flatten_game_grades', profile=True)
     def flatten_game_grades(self):
         '''
         Flattens the game grades file by team and week ##
+        Each game becomes a home row followed by an away row, with the
+        team's grades and then the opponent's. Grades are read from the
+        home_/away_ columns, so new grade columns flow through
         '''
+        grades = self.grade_names()
+        home = self.game_grades[
+            ['home_{0}'.format(grade) for grade in grades]
+        ].to_numpy(dtype=numpy.float32)
+        away = self.game_grades[
+            ['away_{0}'.format(grade) for grade in grades]
+        ].to_numpy(dtype=numpy.float32)
+        ## team grades then opponent grades, column major so the
+        ## frame can take the block without copying it ##
+        block = numpy.empty(
+            (2 * len(home), 2 * len(grades)), dtype=numpy.float32, order='F'
+        )
+        block[:, :len(grades)] = self.interleave(home, away)
+        block[:, len(grades):] = self.interleave(away, home)
+        ## teams are coded once and shared by team and opponent ##
+        team_codes, teams = pd.factorize(pd.concat([
+            self.game_grades['home_team'], self.game_grades['away_team']
+        ]), sort=True)
+        home_team = team_codes[:len(home)]
+        away_team = team_codes[len(home):]
+        ## scores ##
+        scores = self.game_grades[['home_score', 'away_score']]
+        score_type = (
+            numpy.int16 if scores.notnull().all().all() else numpy.float32
+        )
+        home_score = scores['home_score'].to_numpy(dtype=score_type)
+        away_score = scores['away_score'].to_numpy(dtype=score_type)
+        ## build ##
+        meta = pd.DataFrame({
+            col : self.game_grades[col].repeat(2).reset_index(drop=True)
+            for col in ['game_id', 'season', 'week']
+        })
+        meta['team'] = pd.Categorical.from_codes(
+            self.interleave(home_team, away_team), categories=teams
+        )
+        meta['opponent'] = pd.Categorical.from_codes(
+            self.interleave(away_team, home_team), categories=teams
+        )
+        meta['pf'] = self.interleave(home_score, away_score)
+        meta['pa'] = self.interleave(away_score, home_score)
         self.flat_game_grades = pd.concat([
-            self.game_grades[[
-                'game_id', 'season', 'week',
-                'home_team', 'away_team', 'home_score', 'away_score',
-                ## home grades ##
-                'home_overall_grade', 'home_offense_grade',
-                'home_pass_grade', 'home_pass_block_grade',
-                'home_pass_route_grade', 'home_run_grade',
-                'home_run_block_grade', 'home_defense_grade',
-                'home_coverage_defense_grade', 'home_pass_rush_defense_grade',
-                'home_run_defense_grade', 'home_tackle_grade',
-                'home_misc_st_grade',
-                ## away grades ##
-                'away_overall_grade', 'away_offense_grade',
-                'away_pass_grade', 'away_pass_block_grade',
-                'away_pass_route_grade', 'away_run_grade',
-                'away_run_block_grade', 'away_defense_grade',
-                'away_coverage_defense_grade', 'away_pass_rush_defense_grade',
-                'away_run_defense_grade', 'away_tackle_grade',
-                'away_misc_st_grade'
-            ]].rename(columns={
-                'home_team' : 'team',
-                'away_team' : 'opponent',
-                'home_score' : 'pf',
-                'away_score' : 'pa',
-                'home_overall_grade' : 'overall_grade',
-                'home_offense_grade' : 'offense_grade',
-                'home_pass_grade' : 'pass_grade',
-                'home_pass_block_grade' : 'pass_block_grade',
-                'home_pass_route_grade' : 'pass_route_grade',
-                'home_run_grade' : 'run_grade',
-                'home_run_block_grade' : 'run_block_grade',
-                'home_defense_grade' : 'defense_grade',
-                'home_coverage_defense_grade' : 'coverage_defense_grade',
-                'home_pass_rush_defense_grade' : 'pass_rush_defense_grade',
-                'home_run_defense_grade' : 'run_defense_grade',
-                'home_tackle_grade' : 'tackle_grade',
-                'home_misc_st_grade' : 'misc_st_grade',
-                'away_overall_grade' : 'opponent_overall_grade',
-                'away_offense_grade' : 'opponent_offense_grade',
-                'away_pass_grade' : 'opponent_pass_grade',
-                'away_pass_block_grade' : 'opponent_pass_block_grade',
-                'away_pass_route_grade' : 'opponent_pass_route_grade',
-                'away_run_grade' : 'opponent_run_grade',
-                'away_run_block_grade' : 'opponent_run_block_grade',
-                'away_defense_grade' : 'opponent_defense_grade',
-                'away_coverage_defense_grade' : 'opponent_coverage_defense_grade',
-                'away_pass_rush_defense_grade' : 'opponent_pass_rush_defense_grade',
-                'away_run_defense_grade' : 'opponent_run_defense_grade',
-                'away_tackle_grade' : 'opponent_tackle_grade',
-                'away_misc_st_grade' : 'opponent_misc_st_grade',
-            }),
-            self.game_grades[[
-                'game_id', 'season', 'week',
-                'away_team', 'home_team', 'away_score', 'home_score',
-                ## away grades ##
-                'away_overall_grade', 'away_offense_grade',
-                'away_pass_grade', 'away_pass_block_grade',
-                'away_pass_route_grade', 'away_run_grade',
-                'away_run_block_grade', 'away_defense_grade',
-                'away_coverage_defense_grade', 'away_pass_rush_defense_grade',
-                'away_run_defense_grade', 'away_tackle_grade',
-                'away_misc_st_grade',
-                ## home grades ##
-                'home_overall_grade', 'home_offense_grade',
-                'home_pass_grade', 'home_pass_block_grade',
-                'home_pass_route_grade', 'home_run_grade',
-                'home_run_block_grade', 'home_defense_grade',
-                'home_coverage_defense_grade', 'home_pass_rush_defense_grade',
-                'home_run_defense_grade', 'home_tackle_grade',
-                'home_misc_st_grade'
-            ]].rename(columns={
-                'home_team' : 'opponent',
-                'away_team' : 'team',
-                'home_score' : 'pa',
-                'away_score' : 'pf',
-                'home_overall_grade' : 'opponent_overall_grade',
-                'home_offense_grade' : 'opponent_offense_grade',
-                'home_pass_grade' : 'opponent_pass_grade',
-                'home_pass_block_grade' : 'opponent_pass_block_grade',
-                'home_pass_route_grade' : 'opponent_pass_route_grade',
-                'home_run_grade' : 'opponent_run_grade',
-                'home_run_block_grade' : 'opponent_run_block_grade',
-                'home_defense_grade' : 'opponent_defense_grade',
-                'home_coverage_defense_grade' : 'opponent_coverage_defense_grade',
-                'home_pass_rush_defense_grade' : 'opponent_pass_rush_defense_grade',
-                'home_run_defense_grade' : 'opponent_run_defense_grade',
-                'home_tackle_grade' : 'opponent_tackle_grade',
-                'home_misc_st_grade' : 'opponent_misc_st_grade',
-                'away_overall_grade' : 'overall_grade',
-                'away_offense_grade' : 'offense_grade',
-                'away_pass_grade' : 'pass_grade',
-                'away_pass_block_grade' : 'pass_block_grade',
-                'away_pass_route_grade' : 'pass_route_grade',
-                'away_run_grade' : 'run_grade',
-                'away_run_block_grade' : 'run_block_grade',
-                'away_defense_grade' : 'defense_grade',
-                'away_coverage_defense_grade' : 'coverage_defense_grade',
-                'away_pass_rush_defense_grade' : 'pass_rush_defense_grade',
-                'away_run_defense_grade' : 'run_defense_grade',
-                'away_tackle_grade' : 'tackle_grade',
-                'away_misc_st_grade' : 'misc_st_grade',
-            })
-        ])
-        self.flat_game_grades.sort_values(
-            by=['team', 'season', 'week'],
-            ascending=[True, True, True]
-        ).reset_index(drop=True)
+            meta,
+            pd.DataFrame(
+                block,
+                columns=grades + ['opponent_{0}'.format(grade) for grade in grades],
+                copy=False
+            )
+        ], axis=1)
 
+    def add_margin(self):
+        '''
+        Adds the teams margin
+        '''
+        self.flat_game_grades['margin'] = self.flat_game_grades['pf'] - self.flat_game_grades['pa']
+
+    @profiler.timed('add_seasonal_margin')
     def add_seasonal_margin(self):
         '''
         Adds the teams margin across all other games in the season
         '''
-        self.flat_game_grades['margin'] = self.flat_game_grades['pf'] - self.flat_game_grades['pa']
+        self.add_margin()
         self.flat_game_grades['seasonal_margin'] = self.flat_game_grades.groupby([
             'team', 'season'
-        ])['margin'].transform('mean')
-
+        ], observed=True)['margin'].transform('mean')
 
+    @profiler.timed('add_targets')
+    def add_targets(self, names):
+        '''
+        Adds target columns to the flat game grades. Names that are already
+        columns are left as they are
+        '''
+        if 'margin' not in self.flat_game_grades.columns:
+            self.add_margin()
+        if 'seasonal_margin' in names and 'seasonal_margin' not in self.flat_game_grades.columns:
+            self.add_seasonal_margin()
+        names = [
+            name for name in dict.fromkeys(names)
+            if name not in self.flat_game_grades.columns
+        ]
+        for name in names:
+            if parse_target(name) is None:
+                raise ValueError('Unknown target: {0}'.format(name))
+        if len(names) == 0:
+            return
+        targets = TargetBuilder(self.flat_game_grades).build(names)
+        for name in names:
+            self.flat_game_grades[name] = targets[name]
+        ## the field matrix is rebuilt with them ##
+        self.cached.pop('field_matrix', None)
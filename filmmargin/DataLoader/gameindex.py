@@ -0,0 +1,197 @@
+import pandas as pd
+import numpy
+
+## bits of each part of a packed key, from the lowest. Team abbreviations
+## (ie KC, LAC) are packed as up to 3 letters of 5 bits each ##
+team_bits = 15
+week_bits = 6
+season_bits = 12
+season_base = 1900
+
+def encode_team(team):
+    '''
+    Returns the code of a team abbreviation, packing each letter into 5 bits,
+    or -1 if it isn't 1 to 3 letters
+    '''
+    team = str(team).upper()
+    if not (0 < len(team) <= 3 and team.isascii() and team.isalpha()):
+        return -1
+    return sum(
+        (ord(char) - ord('A') + 1) << (5 * position)
+        for position, char in enumerate(team)
+    )
+
+## codes of the teams seen so far, which are the same in every index ##
+team_codes = {}
+
+def encode_teams(teams):
+    '''
+    Returns an int64 code of each team abbreviation, or -1 if it isn't
+    1 to 3 letters. Each distinct team is encoded once
+    '''
+    codes, uniques = pd.Series(teams).array.factorize()
+    encoded = numpy.full(len(uniques) + 1, -1, dtype=numpy.int64)
+    for index, team in enumerate(uniques):
+        if team not in team_codes:
+            team_codes[team] = encode_team(team)
+        encoded[index] = team_codes[team]
+    ## codes of -1 (missing teams) take the last, invalid, code ##
+    return encoded[codes]
+
+def as_float(values):
+    '''
+    Returns numbers as a float array, with NaN for anything that isn't one
+    '''
+    values = pd.Series(values)
+    if not pd.api.types.is_numeric_dtype(values):
+        values = pd.to_numeric(values, errors='coerce')
+    return values.to_numpy(dtype=numpy.float64, na_value=numpy.nan)
+
+def encode_keys(season, week, home_team, away_team):
+    '''
+    Packs seasons, weeks, and home and away teams into int64 keys, which
+    are -1 for any row that can't be packed (ie a missing team)
+    '''
+    season = as_float(season) - season_base
+    week = as_float(week)
+    home = encode_teams(home_team)
+    away = encode_teams(away_team)
+    valid = (
+        (season >= 0) & (season < 2 ** season_bits) &
+        (week >= 0) & (week < 2 ** week_bits) &
+        (home >= 0) & (away >= 0)
+    )
+    season = numpy.where(valid, season, 0).astype(numpy.int64)
+    week = numpy.where(valid, week, 0).astype(numpy.int64)
+    keys = (
+        (season << (week_bits + 2 * team_bits)) |
+        (week << (2 * team_bits)) |
+        (home << team_bits) |
+        away
+    )
+    return numpy.where(valid, keys, -1)
+
+
+class GameIndex():
+    '''
+    Maps each completed game's season, week, home team, and away team to its
+    nflfastr game_id
+
+    The four fields are packed into a single int64 key, and keys are kept
+    sorted next to the game_ids, so looking up any number of rows is one
+    numpy.searchsorted. Games that finish after the index was built are
+    added to it with add(), and the index is saved as a two column frame
+    (key, game_id) so it can be persisted and reloaded as is
+    '''
+    def __init__(self, keys=None, game_ids=None):
+        self.keys = numpy.empty(0, dtype=numpy.int64)
+        ## game_ids keep the dtype of the games they came from ##
+        self.game_ids = None
+        if keys is not None:
+            self.insert(
+                numpy.asarray(keys, dtype=numpy.int64),
+                pd.Series(game_ids).reset_index(drop=True)
+            )
+
+    @classmethod
+    def from_games(cls, games):
+        '''
+        Builds an index of the completed games of an nfelodcm games table
+        '''
+        index = cls()
+        index.add(games)
+        return index
+
+    @classmethod
+    def from_frame(cls, df):
+        '''
+        Rebuilds an index saved with to_frame()
+        '''
+        return cls(df['key'].to_numpy(dtype=numpy.int64), df['game_id'])
+
+    def to_frame(self):
+        '''
+        Returns the index as a frame of keys and game_ids
+        '''
+        return pd.DataFrame({
+            'key' : self.keys,
+            'game_id' : self.game_ids
+        })
+
+    def insert(self, keys, game_ids):
+        '''
+        Merges keys and their game_ids into the index. A key that is
+        already in it takes its new game_id
+        '''
+        game_ids = game_ids[keys >= 0]
+        keys = keys[keys >= 0]
+        if len(keys) == 0:
+            return
+        keys = numpy.concatenate([self.keys, keys])
+        if self.game_ids is not None:
+            game_ids = pd.concat([self.game_ids, game_ids], ignore_index=True)
+        order = numpy.argsort(keys, kind='stable')
+        keys = keys[order]
+        ## keep the last of each key, which is the newest ##
+        last = numpy.ones(len(keys), dtype=bool)
+        last[:-1] = keys[1:] != keys[:-1]
+        self.keys = keys[last]
+        self.game_ids = game_ids.take(order[last]).reset_index(drop=True)
+
+    def add(self, games):
+        '''
+        Adds completed games (with a result) that aren't in the index yet
+        Returns the number of games added
+        '''
+        games = games[~pd.isnull(games['result'])]
+        keys = encode_keys(
+            games['season'], games['week'], games['home_team'], games['away_team']
+        )
+        game_ids = games['game_id'].reset_index(drop=True)
+        positions = self.positions(keys)
+        new = keys >= 0
+        ## games already indexed under another id are updated ##
+        known = positions >= 0
+        if known.any():
+            new[known] = (
+                self.game_ids.to_numpy()[positions[known]] != game_ids.to_numpy()[known]
+            )
+        self.insert(keys[new], game_ids[new].reset_index(drop=True))
+        return int(new.sum())
+
+    def positions(self, keys):
+        '''
+        Returns the position of each key in the index, or -1 if it isn't
+        in it
+        '''
+        if len(self.keys) == 0:
+            return numpy.full(len(keys), -1, dtype=numpy.int64)
+        positions = numpy.minimum(
+            numpy.searchsorted(self.keys, keys), len(self.keys) - 1
+        )
+        ## invalid keys (-1) are below every key in the index ##
+        return numpy.where(self.keys[positions] == keys, positions, -1)
+
+    def lookup(self, season, week, home_team, away_team):
+        '''
+        Returns the game_id of each game (NA where there is none) and a
+        boolean mask of the games that were matched
+        '''
+        positions = self.positions(encode_keys(season, week, home_team, away_team))
+        matched = positions >= 0
+        if self.game_ids is None:
+            return pd.Series(numpy.full(len(positions), numpy.nan)).array, matched
+        game_ids = self.game_ids.array.take(positions, allow_fill=True)
+        return game_ids, matched
+
+    def unmatched(self, df, matched):
+        '''
+        Returns the games of df that weren't matched, with the number of
+        rows of each
+        '''
+        fields = ['season', 'week', 'home_team', 'away_team']
+        if matched.all():
+            return pd.DataFrame({field : [] for field in fields + ['rows']})
+        return df.loc[~matched, fields].groupby(
+            fields, dropna=False
+        ).size().reset_index(name='rows')
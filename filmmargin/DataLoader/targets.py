@@ -0,0 +1,142 @@
+import pandas as pd
+import numpy
+import re
+
+## targets are named by the column they average and the games they
+## average it over, ie margin_next_3 or margin_season_others ##
+target_pattern = re.compile(
+    r'^(?P<value>.+?)_(?:(?P<window>next|previous)_(?P<games>[0-9]+)|'
+    r'(?P<span>season|season_others|rest_of_season|season_to_date))$'
+)
+
+def parse_target(name):
+    '''
+    Returns the (value, horizon, games) of a target name, or None if it
+    isn't one. games is only set for the next and previous horizons
+    '''
+    match = target_pattern.match(name)
+    if match is None:
+        return None
+    if match.group('window') is not None:
+        return match.group('value'), match.group('window'), int(match.group('games'))
+    return match.group('value'), match.group('span'), None
+
+
+class TargetBuilder():
+    '''
+    Builds targets that average a column (ie margin) over other games in a
+    team's season:
+    * season -- every game, which is the seasonal_margin
+    * season_others -- every game but this one
+    * rest_of_season -- every game after this one
+    * season_to_date -- every game before this one
+    * next_N / previous_N -- the N games after or before this one
+
+    Rows are sorted by group (team, season) and week once. Each column is
+    then reduced to a cumulative sum and count of its values over the sorted
+    rows, so every target is a difference of two cumulative sums at offsets
+    clipped to the group's bounds, and any number of horizons cost a pass
+    of array arithmetic each rather than a groupby or rolling call
+
+    Horizons count games (rows), and average the values among them that
+    aren't NA (ie games not yet played). Targets with no values, and rows
+    missing a group field, are NA
+    '''
+    def __init__(self, df, groups=('team', 'season'), order=('week',)):
+        self.df = df
+        n = len(df)
+        codes = numpy.column_stack(
+            [pd.factorize(df[col])[0] for col in groups]
+        ) if n > 0 else numpy.empty((0, len(groups)), dtype=numpy.int64)
+        ## lexsort sorts by its last key first ##
+        self.order = numpy.lexsort(
+            [df[col].to_numpy() for col in reversed(order)] +
+            [codes[:, index] for index in range(len(groups) - 1, -1, -1)]
+        )
+        codes = codes[self.order]
+        ## bounds of each sorted row's group ##
+        new_group = numpy.ones(n, dtype=bool)
+        new_group[1:] = (codes[1:] != codes[:-1]).any(axis=1)
+        starts = numpy.flatnonzero(new_group)
+        group_index = numpy.cumsum(new_group) - 1
+        self.position = numpy.arange(0, n)
+        self.start = starts[group_index]
+        self.stop = numpy.append(starts[1:], n)[group_index]
+        self.grouped = (codes >= 0).all(axis=1)
+        self.sums = {}
+
+    def cumulative(self, value):
+        '''
+        Returns the sorted values of a column and the cumulative sums and
+        counts of its values, each with a leading 0
+        '''
+        if value not in self.sums:
+            values = self.df[value].to_numpy(
+                dtype=numpy.float64, na_value=numpy.nan
+            )[self.order]
+            valid = ~numpy.isnan(values)
+            self.sums[value] = (
+                values,
+                numpy.concatenate([[0.0], numpy.cumsum(numpy.where(valid, values, 0.0))]),
+                numpy.concatenate([[0], numpy.cumsum(valid)])
+            )
+        return self.sums[value]
+
+    def bounds(self, horizon, games=None):
+        '''
+        Returns the first and past last sorted row each row's target
+        averages over
+        '''
+        if horizon == 'next':
+            return self.position + 1, numpy.minimum(self.position + 1 + games, self.stop)
+        if horizon == 'previous':
+            return numpy.maximum(self.position - games, self.start), self.position
+        if horizon == 'rest_of_season':
+            return self.position + 1, self.stop
+        if horizon == 'season_to_date':
+            return self.start, self.position
+        if horizon in ['season', 'season_others']:
+            return self.start, self.stop
+        raise ValueError('Unknown horizon: {0}'.format(horizon))
+
+    def sorted_target(self, name):
+        '''
+        Returns a target's values in the sorted order of the rows
+        '''
+        parsed = parse_target(name)
+        if parsed is None:
+            raise ValueError('Unknown target: {0}'.format(name))
+        value, horizon, games = parsed
+        values, sums, counts = self.cumulative(value)
+        low, high = self.bounds(horizon, games)
+        total = sums[high] - sums[low]
+        count = counts[high] - counts[low]
+        if horizon == 'season_others':
+            own = ~numpy.isnan(values)
+            total = total - numpy.where(own, values, 0.0)
+            count = count - own
+        ## rows missing a group field, and targets with no values, are 0 / 0 ##
+        total = numpy.where(self.grouped, total, 0.0)
+        count = numpy.where(self.grouped, count, 0)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return total / count
+
+    def target(self, name):
+        '''
+        Returns a target's values in the order of the frame's rows
+        '''
+        target = numpy.empty(len(self.order), dtype=numpy.float64)
+        target[self.order] = self.sorted_target(name)
+        return target
+
+    def build(self, names):
+        '''
+        Returns a frame of targets, indexed like the frame. Targets are
+        built side by side and put back in the frame's order together
+        '''
+        block = numpy.empty((len(self.order), len(names)), dtype=numpy.float64)
+        for index, name in enumerate(names):
+            block[:, index] = self.sorted_target(name)
+        targets = numpy.empty(block.shape, dtype=numpy.float64, order='F')
+        targets[self.order] = block
+        return pd.DataFrame(targets, columns=names, index=self.df.index, copy=False)
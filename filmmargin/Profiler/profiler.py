@@ -0,0 +1,285 @@
+import collections
+import contextlib
+import cProfile
+import functools
+import json
+import logging
+import os
+import pathlib
+import threading
+import time
+import tracemalloc
+
+## set top level pacakage directory ##
+package_dir = pathlib.Path(__file__).parent.parent.parent.resolve()
+
+## package logger, which progress and stage events are sent through ##
+logger = logging.getLogger('filmmargin')
+
+def env_flag(name):
+    '''
+    Whether an env var is set to a truthy value
+    '''
+    return os.getenv(name, '').lower() in ['1', 'true', 'yes']
+
+class Profiler():
+    '''
+    Times named stages of a run and reports where the time went
+
+    Stages are timed with the stage() context manager or the timed()
+    decorator, and each is logged as a debug event with its fields in
+    record.profile. With trace_memory (or FILMMARGIN_TRACE_MEMORY=1),
+    tracemalloc records the peak memory each stage allocated. When
+    FILMMARGIN_PROFILE=1, stages passed profile=True (the hot paths) are
+    run under cProfile, with each stage's calls accumulated into one
+    .prof file in the profile directory
+
+    run() wraps a whole entry point, like update_margins, and at its end
+    logs a text summary by stage and writes a json report if a report
+    path is set (FILMMARGIN_PROFILE_REPORT, or the profile directory when
+    profiling). Stages in worker processes are not collected
+
+    The summary is kept as running totals of each stage, and only the last
+    max_events events are kept for the report, so a long lived process (ie
+    the margin service) timing every request doesn't grow without bound
+
+    Each event records its parent stage. Stages opened on another thread
+    only have one if the thread is started within() the caller's current()
+    stage (see run_in_daemon). tracemalloc's peak is process wide, so it is
+    only reset when no stage is open on another thread. The peak of a stage
+    that overlaps stages on other threads includes their allocations, and
+    is an upper bound on its own
+    '''
+    def __init__(
+        self, trace_memory=None, profile=None, profile_dir=None, report_path=None,
+        max_events=10000
+    ):
+        self.trace_memory = (
+            env_flag('FILMMARGIN_TRACE_MEMORY') if trace_memory is None else trace_memory
+        )
+        self.profile = env_flag('FILMMARGIN_PROFILE') if profile is None else profile
+        self.profile_dir = pathlib.Path(
+            profile_dir or os.getenv('FILMMARGIN_PROFILE_DIR') or
+            '{0}/.profiles'.format(package_dir)
+        )
+        self.report_path = report_path or os.getenv('FILMMARGIN_PROFILE_REPORT')
+        self.events = collections.deque(maxlen=max_events)
+        self.stages = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        ## stages each thread has open, to tell when they overlap ##
+        self.open = collections.Counter()
+        self.profiles = {}
+        self.profiling = False
+
+    def stack(self):
+        '''
+        Stages open in the current thread
+        '''
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def current(self):
+        '''
+        The innermost stage open in the current thread, or None
+        '''
+        stack = self.stack()
+        return stack[-1] if len(stack) > 0 else None
+
+    @contextlib.contextmanager
+    def within(self, parent):
+        '''
+        Makes parent (a stage from current(), usually of another thread)
+        the parent of the stages opened in this thread within the block
+        '''
+        if parent is None:
+            yield
+            return
+        stack = self.stack()
+        stack.append(parent)
+        try:
+            yield
+        finally:
+            stack.pop()
+
+    @contextlib.contextmanager
+    def stage(self, name, profile=False, **fields):
+        '''
+        Times the block as a stage. Extra fields are kept with the event
+        '''
+        stack = self.stack()
+        parent = stack[-1] if len(stack) > 0 else None
+        frame = {
+            'stage' : name, 'peak' : 0,
+            'depth' : 0 if parent is None else parent['depth'] + 1
+        }
+        stack.append(frame)
+        thread = threading.get_ident()
+        with self.lock:
+            overlapping = any(
+                count > 0 for ident, count in self.open.items() if ident != thread
+            )
+            self.open[thread] += 1
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            start_memory = tracemalloc.get_traced_memory()[0]
+            ## other threads' stages are measuring against the peak ##
+            if not overlapping:
+                tracemalloc.reset_peak()
+        ## only one profiled stage can run cProfile at a time ##
+        profiler = None
+        if profile and self.profile and not self.profiling:
+            self.profiling = True
+            profiler = self.profiles.setdefault(name, cProfile.Profile())
+            profiler.enable()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            if profiler is not None:
+                profiler.disable()
+                self.profiling = False
+            stack.pop()
+            with self.lock:
+                self.open[thread] -= 1
+                if self.open[thread] == 0:
+                    del self.open[thread]
+            event = {
+                'stage' : name,
+                'seconds' : seconds,
+                'started' : time.time() - seconds,
+                'depth' : frame['depth'],
+                'parent' : None if parent is None else parent['stage']
+            } | fields
+            if tracing:
+                ## a nested stage resets the peak, so take the larger of
+                ## this stage's own peak and its children's ##
+                peak = max(
+                    tracemalloc.get_traced_memory()[1] - start_memory,
+                    frame['peak']
+                )
+                event['peak_mb'] = peak / 1024 ** 2
+                if parent is not None:
+                    parent['peak'] = max(parent['peak'], peak)
+            with self.lock:
+                self.events.append(event)
+                self.add_to_summary(event)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    '{0} took {1:.4f}s'.format(name, seconds),
+                    extra={'profile' : event}
+                )
+
+    def timed(self, name=None, profile=False):
+        '''
+        Decorator that times each call of a function as a stage
+        '''
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.stage(name or func.__qualname__, profile=profile):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def dump_profiles(self, prefix=None):
+        '''
+        Writes the cProfile stats of each profiled stage to the profile
+        directory, which can be read with pstats or snakeviz
+        '''
+        if len(self.profiles) == 0:
+            return
+        self.profile_dir.mkdir(parents=True, exist_ok=True)
+        stamp = time.strftime('%Y%m%d-%H%M%S')
+        for name, profiler in self.profiles.items():
+            path = self.profile_dir / '{0}{1}-{2}.prof'.format(
+                '{0}-'.format(prefix) if prefix else '', name, stamp
+            )
+            profiler.dump_stats(path)
+            logger.info('     Profile of {0} written to {1}'.format(name, path))
+        self.profiles = {}
+
+    @contextlib.contextmanager
+    def run(self, name):
+        '''
+        Profiles a whole run, reporting on its stages when it ends
+        '''
+        with self.lock:
+            self.events.clear()
+            self.stages = {}
+        self.profiles = {}
+        started_tracing = self.trace_memory and not tracemalloc.is_tracing()
+        if started_tracing:
+            tracemalloc.start()
+        try:
+            with self.stage(name):
+                yield
+        finally:
+            if started_tracing:
+                tracemalloc.stop()
+            self.dump_profiles(prefix=name)
+            logger.info(self.text_summary())
+            report_path = self.report_path or (
+                self.profile_dir / '{0}.json'.format(name) if self.profile else None
+            )
+            if report_path is not None:
+                self.write_report(report_path)
+
+    def add_to_summary(self, event):
+        '''
+        Adds an event to the running totals of its stage
+        '''
+        stage = self.stages.setdefault(event['stage'], {
+            'stage' : event['stage'], 'count' : 0, 'total_seconds' : 0,
+            'max_seconds' : 0, 'depth' : event['depth'],
+            'started' : event['started']
+        })
+        stage['count'] += 1
+        stage['total_seconds'] += event['seconds']
+        stage['max_seconds'] = max(stage['max_seconds'], event['seconds'])
+        stage['depth'] = min(stage['depth'], event['depth'])
+        stage['started'] = min(stage['started'], event['started'])
+        if 'peak_mb' in event:
+            stage['peak_mb'] = max(stage.get('peak_mb', 0), event['peak_mb'])
+
+    def summary(self):
+        '''
+        Returns the stages' count, total, mean, and max seconds (and peak
+        memory when traced), in the order they first started
+        '''
+        with self.lock:
+            stages = [dict(stage) for stage in self.stages.values()]
+        for stage in stages:
+            stage['mean_seconds'] = stage['total_seconds'] / stage['count']
+        return sorted(stages, key=lambda stage: stage['started'])
+
+    def text_summary(self):
+        '''
+        Returns the summary as a text table
+        '''
+        lines = ['     Stage timings:']
+        for stage in self.summary():
+            lines.append('          {0:<32} {1:>6} x {2:>10.4f}s = {3:>10.4f}s{4}'.format(
+                '  ' * stage['depth'] + stage['stage'], stage['count'],
+                stage['mean_seconds'], stage['total_seconds'],
+                '  peak {0:.1f}MB'.format(stage['peak_mb']) if 'peak_mb' in stage else ''
+            ))
+        return '\n'.join(lines)
+
+    def write_report(self, path):
+        '''
+        Writes the summary and the events kept to a json report
+        '''
+        path = pathlib.Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, 'w') as fp:
+            json.dump({
+                'summary' : self.summary(),
+                'events' : list(self.events)
+            }, fp, indent=4, default=str)
+        logger.info('     Profile report written to {0}'.format(path))
+
+## profiler shared across the package ##
+profiler = Profiler()
@@ -1 +1,8 @@
-from .regression import Regression
\ No newline at end of file
+from .regression import Regression
+from .splits import SplitGenerator
+from .fieldmatrix import FieldMatrix
+from .subsets import SubsetSearch, search_subsets, score_subsets
+from .bootstrap import cluster_bootstrap, bootstrap_regression
+from .backtest import WalkForward
+from .paths import RegularizationPath, penalty_grid
+from .results import ResultStore
\ No newline at end of file
@@ -0,0 +1,156 @@
+import pandas as pd
+import numpy
+
+from .regression import solve_normal_equations, group_grams
+from ..Profiler import profiler
+
+
+class WalkForward():
+    '''
+    Walks forward through the data in (season, week) order, scoring each
+    week with models trained on every week before it, the way production
+    scores week N + 1 with a model trained through week N
+
+    Each week's rows are reduced to their cross products once, and the
+    model's X'X and X'y are updated by adding them (a rank k update per
+    week) rather than refitting from the rows. forgetting below 1 decays
+    the weight of past weeks by that factor each week, which is recursive
+    least squares with exponential forgetting. Every week's model is then
+    solved in one batched solve
+
+    Dependents share the fields. Rows missing a field or dependent are not
+    trained on, and rows missing a field are not scored
+
+    A target that averages over other games is only known once those games
+    are played, which a walk forward doesn't wait for. Training rows from
+    the weeks just before a scored week can have margin_next_3 targets that
+    include games in or after it, and every row of the season has a
+    seasonal_margin (or margin_season_others, margin_rest_of_season) that
+    includes them. Scores of those targets are optimistic, seasonal ones by
+    the most, so the defaults are the game's margin and the next 3 games
+    '''
+    def __init__(
+        self, df, fields, dependents=('margin', 'margin_next_3'), forgetting=1.0
+    ):
+        if not 0 < forgetting <= 1:
+            raise ValueError('forgetting must be in (0, 1]')
+        self.df = df
+        self.fields = list(fields)
+        self.dependents = list(dependents)
+        self.forgetting = forgetting
+        ## order weeks ##
+        weeks = pd.MultiIndex.from_frame(df[['season', 'week']])
+        self.weeks = weeks.unique().sort_values()
+        self.week_codes = self.weeks.get_indexer(weeks)
+        self.x = df[self.fields].to_numpy(dtype=numpy.float64)
+        self.y = df[self.dependents].to_numpy(dtype=numpy.float64)
+        self.coefs = None
+        self.consts = None
+        self.predictions = None
+
+    def week_grams(self):
+        '''
+        Returns the augmented gram [fields, intercept, dependents] of each
+        week's complete rows (weeks, p, p), shifted by the means of the
+        rows, and the shifts. Shifting only conditions the normal equations
+        and has no effect on the fits
+        '''
+        valid = ~numpy.isnan(self.x).any(axis=1) & ~numpy.isnan(self.y).any(axis=1)
+        x = self.x[valid]
+        y = self.y[valid]
+        codes = self.week_codes[valid]
+        x_shift = x.mean(axis=0)
+        y_shift = y.mean(axis=0)
+        z = numpy.column_stack([x - x_shift, numpy.ones(len(x)), y - y_shift])
+        return group_grams(z, codes, len(self.weeks)), x_shift, y_shift
+
+    @profiler.timed('walk_forward_fit')
+    def fit(self):
+        '''
+        Solves the model trained through each week. Returns the coefs
+        (weeks, fields, dependents) and constants (weeks, dependents)
+        '''
+        grams, x_shift, y_shift = self.week_grams()
+        k = len(self.fields)
+        if self.forgetting == 1:
+            totals = numpy.cumsum(grams, axis=0)
+        else:
+            totals = numpy.empty(grams.shape, dtype=numpy.float64)
+            running = numpy.zeros(grams.shape[1:], dtype=numpy.float64)
+            for index in range(0, len(grams)):
+                running = self.forgetting * running + grams[index]
+                totals[index] = running
+        ## weeks before any complete rows have no model ##
+        trained = totals[:, k, k] > 0
+        betas = numpy.full((len(grams), k + 1, len(self.dependents)), numpy.nan)
+        betas[trained] = solve_normal_equations(
+            totals[trained, :k + 1, :k + 1], totals[trained, :k + 1, k + 1:]
+        )
+        self.coefs = betas[:, :k]
+        self.consts = (
+            y_shift + betas[:, k] -
+            numpy.einsum('wkd,k->wd', self.coefs, x_shift)
+        )
+        return self.coefs, self.consts
+
+    @profiler.timed('walk_forward_predict')
+    def predict(self):
+        '''
+        Scores each row with the model trained through the week before its
+        own. Returns a (rows, dependents) array, which is NaN for the first
+        week and rows missing a field
+        '''
+        if self.coefs is None:
+            self.fit()
+        previous = self.week_codes - 1
+        scored = previous >= 0
+        self.predictions = numpy.full(self.y.shape, numpy.nan)
+        self.predictions[scored] = numpy.einsum(
+            'rk,rkd->rd', self.x[scored], self.coefs[previous[scored]]
+        ) + self.consts[previous[scored]]
+        return self.predictions
+
+    def summarize(self, by):
+        '''
+        Returns the rsq and rmse of the out of sample predictions of each
+        dependent within groups of rows (ie season), as a frame with a row
+        per group and dependent. rsq is capped the same way
+        Regression.calc_rsq is
+        '''
+        if self.predictions is None:
+            self.predict()
+        groups = pd.MultiIndex.from_frame(self.df[by])
+        uniques = groups.unique().sort_values()
+        codes = uniques.get_indexer(groups)
+        frames = []
+        for index, dependent in enumerate(self.dependents):
+            y = self.y[:, index]
+            prediction = self.predictions[:, index]
+            valid = ~numpy.isnan(y) & ~numpy.isnan(prediction)
+            group = codes[valid]
+            y = y[valid]
+            sums = lambda values: numpy.bincount(
+                group, weights=values, minlength=len(uniques)
+            )
+            rows = sums(numpy.ones(len(y)))
+            rss = sums((y - prediction[valid]) ** 2)
+            tss = sums(y ** 2) - sums(y) ** 2 / numpy.maximum(rows, 1)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                rsq = 1 - numpy.minimum(1, rss / tss)
+                rmse = numpy.sqrt(rss / rows)
+            frame = uniques.to_frame(index=False)
+            frame['dependent'] = dependent
+            frame['rows'] = rows.astype(numpy.int64)
+            frame['rsq'] = rsq
+            frame['rmse'] = rmse
+            frames.append(frame[frame['rows'] > 0])
+        return pd.concat(frames).reset_index(drop=True)
+
+    def run(self):
+        '''
+        Walks forward through every week and returns the weekly and
+        seasonal out of sample rsq and rmse of each dependent
+        '''
+        self.fit()
+        self.predict()
+        return self.summarize(['season', 'week']), self.summarize(['season'])
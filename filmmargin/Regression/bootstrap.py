@@ -0,0 +1,121 @@
+import numpy
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .regression import solve_normal_equations, group_grams
+from .splits import SplitGenerator
+from ..Profiler import profiler
+
+
+def cluster_grams(x, y, clusters):
+    '''
+    Returns the augmented gram [x, intercept, y]'[x, intercept, y] of each
+    cluster (n_clusters, k + 2, k + 2) over the complete rows, with x and y
+    shifted by their means, along with the shifts. clusters are integer
+    codes, and rows with a negative code are in no cluster
+    '''
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    clusters = numpy.asarray(clusters, dtype=numpy.int64)
+    valid = ~numpy.isnan(x).any(axis=1) & ~numpy.isnan(y) & (clusters >= 0)
+    x = x[valid]
+    y = y[valid]
+    codes = clusters[valid]
+    x_shift = x.mean(axis=0)
+    y_shift = y.mean()
+    z = numpy.empty((len(x), x.shape[1] + 2), dtype=numpy.float64)
+    z[:, :-2] = x - x_shift
+    z[:, -2] = 1.0
+    z[:, -1] = y - y_shift
+    ## sum each row's cross products by cluster ##
+    n_clusters = int(clusters.max()) + 1 if len(clusters) > 0 else 0
+    return group_grams(z, codes, n_clusters), x_shift, y_shift
+
+
+def solve_replicates(grams, counts, x_shift, y_shift):
+    '''
+    Solves the model of each replicate, given how many times it drew each
+    cluster (replicates, n_clusters). Every replicate's gram is the count
+    weighted sum of the cluster grams, so all of them come from a single
+    matrix product. Returns the coefs (replicates, k) and constants
+    '''
+    n_clusters, p, p = grams.shape
+    k = p - 2
+    totals = (counts @ grams.reshape(n_clusters, p * p)).reshape(len(counts), p, p)
+    betas = solve_normal_equations(
+        totals[:, :-1, :-1], totals[:, :-1, -1:]
+    )[:, :, 0]
+    coefs = betas[:, :k]
+    consts = y_shift + betas[:, k] - coefs @ x_shift
+    return coefs, consts
+
+
+def cluster_bootstrap(
+    x, y, clusters, replicates=10000, seed=None, workers=None, chunk_size=1000
+):
+    '''
+    Refits the OLS of y on x plus an intercept on replicates that resample
+    whole clusters (ie season, team) with replacement, and returns the
+    coefs (replicates, k) and constants of each
+
+    Replicates are drawn and solved in chunks, each from its own stream of
+    the seed, so results don't depend on the workers. Chunks are spread
+    over a thread pool (numpy releases the GIL for the products and
+    solves), with workers defaulting to the cores available
+    '''
+    grams, x_shift, y_shift = cluster_grams(x, y, clusters)
+    ## only clusters with rows are resampled ##
+    grams = grams[grams[:, -2, -2] > 0]
+    n_clusters = len(grams)
+    n_chunks = -(-replicates // chunk_size)
+    streams = numpy.random.SeedSequence(seed).spawn(n_chunks)
+    def run_chunk(index):
+        rng = numpy.random.default_rng(streams[index])
+        size = min(chunk_size, replicates - index * chunk_size)
+        counts = rng.multinomial(
+            n_clusters, numpy.full(n_clusters, 1 / n_clusters), size=size
+        ).astype(numpy.float64)
+        return solve_replicates(grams, counts, x_shift, y_shift)
+    workers = min(workers or os.cpu_count() or 1, n_chunks)
+    if workers > 1:
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(run_chunk, range(0, n_chunks)))
+    else:
+        results = [run_chunk(index) for index in range(0, n_chunks)]
+    return (
+        numpy.concatenate([coefs for coefs, consts in results]),
+        numpy.concatenate([consts for coefs, consts in results])
+    )
+
+
+def summarize_replicates(fields, coefs, consts, level=0.95):
+    '''
+    Returns the standard error and percentile interval of each field's
+    coef and the intercept across replicates
+    '''
+    values = numpy.column_stack([coefs, consts])
+    tail = (1 - level) / 2
+    lower, upper = numpy.quantile(values, [tail, 1 - tail], axis=0)
+    se = values.std(axis=0, ddof=1)
+    return {
+        field : {
+            'se' : float(se[index]),
+            'lower' : float(lower[index]),
+            'upper' : float(upper[index])
+        } for index, field in enumerate(list(fields) + ['intercept'])
+    }
+
+
+@profiler.timed('bootstrap_regression', profile=True)
+def bootstrap_regression(reg, replicates=10000, level=0.95, seed=None, workers=None):
+    '''
+    Bootstraps a Regression's model over the rows it trains on, resampling
+    its windowing groups, and returns the standard error and percentile
+    interval of each coef and the intercept
+    '''
+    clusters = SplitGenerator(reg.train_df, reg.windowing_fields).group_codes
+    coefs, consts = cluster_bootstrap(
+        reg.train_df[reg.fields], reg.train_df[reg.dependent], clusters,
+        replicates=replicates, seed=seed, workers=workers
+    )
+    return summarize_replicates(reg.fields, coefs, consts, level)
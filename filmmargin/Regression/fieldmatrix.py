@@ -0,0 +1,76 @@
+import pandas as pd
+import numpy
+
+
+class FieldMatrix():
+    '''
+    The numeric columns of a frame as a single column major float block,
+    with a packed bitmask of the rows each column has a value in
+
+    It is built once when the data is loaded. The rows any set of fields
+    can use are then a bitwise and of their bits, and a model's design is
+    gathered straight from the block, only for the rows and fields it uses,
+    rather than slicing the frame and dropping NAs from a copy on every fit.
+    A single column, or a run of adjacent columns over every row, is a view
+    '''
+    def __init__(self, df, columns=None):
+        if columns is None:
+            columns = [
+                col for col in df.columns
+                if pd.api.types.is_numeric_dtype(df[col])
+            ]
+        self.columns = list(dict.fromkeys(columns))
+        self.positions = {col : index for index, col in enumerate(self.columns)}
+        self.n_rows = len(df)
+        self.values = numpy.empty(
+            (len(df), len(self.columns)), dtype=numpy.float64, order='F'
+        )
+        for index, col in enumerate(self.columns):
+            self.values[:, index] = df[col].to_numpy(
+                dtype=numpy.float64, na_value=numpy.nan
+            )
+        ## a row of bits per column, set where the row has a value ##
+        self.bits = numpy.packbits(~numpy.isnan(self.values).T, axis=1)
+
+    def __contains__(self, col):
+        return col in self.positions
+
+    def index(self, fields):
+        '''
+        Returns the positions of fields in the block
+        '''
+        return numpy.array(
+            [self.positions[field] for field in fields], dtype=numpy.int64
+        )
+
+    def valid(self, fields):
+        '''
+        Returns a boolean mask of the rows that have every field
+        '''
+        if len(fields) == 0:
+            return numpy.ones(self.n_rows, dtype=bool)
+        bits = numpy.bitwise_and.reduce(self.bits[self.index(fields)], axis=0)
+        return numpy.unpackbits(bits, count=self.n_rows).view(bool)
+
+    def column(self, field):
+        '''
+        Returns a view of a single column
+        '''
+        return self.values[:, self.positions[field]]
+
+    def gather(self, fields, rows=None):
+        '''
+        Returns a (rows, fields) float array of fields for the rows, a
+        boolean mask or row positions. A run of adjacent fields over every
+        row is returned as a view of the block, and anything else is
+        gathered in a single copy
+        '''
+        index = self.index(fields)
+        if rows is None:
+            if len(index) > 0 and (numpy.diff(index) == 1).all():
+                return self.values[:, index[0]:index[-1] + 1]
+            return self.values[:, index]
+        rows = numpy.asarray(rows)
+        if rows.dtype == bool:
+            rows = numpy.flatnonzero(rows)
+        return self.values[numpy.ix_(rows, index)]
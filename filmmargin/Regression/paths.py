@@ -0,0 +1,284 @@
+import numpy
+
+## share of each method's penalty that is on the absolute coefs ##
+def l1_share(method, l1_ratio=0.5):
+    '''
+    Returns the share of a method's penalty that is l1
+    '''
+    if method == 'ridge':
+        return 0.0
+    if method == 'lasso':
+        return 1.0
+    if method == 'elastic_net':
+        return float(l1_ratio)
+    raise ValueError('Unknown regularization method: {0}'.format(method))
+
+
+def centered_gram(gram, k):
+    '''
+    Returns the row count, the means of the fields (k) and dependents (d)
+    relative to the gram's shift, and the centered cross products of the
+    fields (k, k), fields and dependents (k, d), and dependents (d) of an
+    augmented gram of [fields, intercept, dependents]
+    '''
+    gram = numpy.asarray(gram, dtype=numpy.float64)
+    n = gram[k, k]
+    x_sum = gram[:k, k]
+    y_sum = gram[k, k + 1:]
+    xx = gram[:k, :k] - numpy.outer(x_sum, x_sum) / n
+    xy = gram[:k, k + 1:] - numpy.outer(x_sum, y_sum) / n
+    yy = numpy.diag(gram[k + 1:, k + 1:]) - y_sum ** 2 / n
+    return n, x_sum / n, y_sum / n, xx, xy, yy
+
+
+def penalty_grid(gram, k, method='lasso', l1_ratio=0.5, n_penalties=50, min_ratio=1e-4):
+    '''
+    Returns a descending log grid of n_penalties from the smallest penalty
+    that zeroes every coef of every dependent (as in glmnet, using an l1
+    share of 0.001 for ridge) down to min_ratio of the lasso's, so ridge
+    grids also reach fits close to OLS
+    '''
+    n, x_mean, y_mean, xx, xy, yy = centered_gram(gram, k)
+    scale = numpy.sqrt(numpy.maximum(numpy.diag(xx), 0) / n)
+    scale[scale == 0] = 1.0
+    largest = numpy.abs(xy / n / scale[:, None]).max()
+    if largest <= 0:
+        largest = 1.0
+    return numpy.geomspace(
+        largest / max(l1_share(method, l1_ratio), 1e-3), largest * min_ratio,
+        n_penalties
+    )
+
+
+class RegularizationPath():
+    '''
+    Ridge, lasso, or elastic net fits of every field for each dependent over
+    a grid of penalties, from an augmented gram of [fields, intercept,
+    dependents] like GramSweep.gram
+
+    Penalties are on the coefs of the standardized fields, as in glmnet:
+    rss / 2n + penalty * (l1 * |b| + (1 - l1) / 2 * b^2), so one grid fits
+    fields of any scale. Ridge solves every penalty from one decomposition of
+    the standardized gram, which is the SVD of the centered design (its
+    right singular vectors and squared singular values), so each penalty is
+    a rescale of V'X'y. Lasso and elastic net run coordinate descent on the
+    gram (covariance updates), so no iteration goes back to the rows, and are
+    finished with exact active set steps (see lasso). Every penalty is fit
+    together, warm started from the ridge fit with the same l2 penalty, so a
+    pass over the fields updates the whole path
+
+    Coefs are kept relative to the gram's shift, so a test gram built with
+    the same shift (see Regression.gram_sweeps) scores them directly
+    '''
+    def __init__(
+        self, gram, k, method='lasso', penalties=None, l1_ratio=0.5,
+        tol=1e-7, max_iter=1000
+    ):
+        self.k = k
+        self.method = method
+        self.l1 = l1_share(method, l1_ratio)
+        self.penalties = numpy.asarray(
+            penalty_grid(gram, k, method, l1_ratio) if penalties is None else penalties,
+            dtype=numpy.float64
+        )
+        self.n, self.x_mean, self.y_mean, xx, xy, self.yy = centered_gram(gram, k)
+        ## standardize the fields, leaving constant fields unscaled ##
+        self.scale = numpy.sqrt(numpy.maximum(numpy.diag(xx), 0) / self.n)
+        self.constant = self.scale == 0
+        self.scale[self.constant] = 1.0
+        self.corr = xx / self.n / numpy.outer(self.scale, self.scale)
+        self.cov = xy / self.n / self.scale[:, None]
+        self.iterations = 0
+        self.std_coefs = self.ridge(self.penalties * (1 - self.l1))
+        if self.l1 > 0:
+            self.std_coefs = self.lasso(self.std_coefs, tol, max_iter)
+
+    def ridge(self, l2):
+        '''
+        Returns the standardized coefs (penalties, k, d) of ridge fits with
+        each l2 penalty, from one eigendecomposition of the gram
+        '''
+        eigenvalues, vectors = numpy.linalg.eigh(self.corr)
+        eigenvalues = numpy.maximum(eigenvalues, 0)
+        projected = vectors.T @ self.cov
+        ## directions with no variance are left out of every fit ##
+        with numpy.errstate(divide='ignore'):
+            shrink = numpy.where(
+                eigenvalues[None, :] + l2[:, None] > 1e-12 * max(eigenvalues.max(), 1),
+                1 / (eigenvalues[None, :] + l2[:, None]), 0.0
+            )
+        coefs = numpy.einsum('ij,lj,jd->lid', vectors, shrink, projected)
+        ## constant fields only pick up rounding from the other directions ##
+        coefs[:, self.constant] = 0.0
+        return coefs
+
+    def lasso(self, coefs, tol=1e-7, max_iter=1000):
+        '''
+        Returns the standardized coefs (penalties, k, d) of the fits with an
+        l1 penalty, starting from coefs
+
+        A couple of coordinate descent passes find roughly which fields each
+        fit uses, and active set steps then solve for them exactly, adding
+        or dropping a field at a time until the lasso's optimality conditions
+        hold. Correlated fields make descent alone crawl towards the solution,
+        while a step costs one batched solve. Any fit the steps don't settle
+        goes back to descent until no coef moves more than tol of its
+        dependent's standard deviation
+        '''
+        l1 = (self.penalties * self.l1)[:, None]
+        l2 = (self.penalties * (1 - self.l1))[:, None]
+        y_scale = numpy.sqrt(numpy.maximum(self.yy, 0) / self.n)
+        coefs = self.descend(coefs, l1, l2, tol * y_scale, passes=2)
+        coefs, optimal = self.active_steps(coefs, l1, l2, 1e-9 * y_scale, 4 * self.k)
+        if not optimal.all():
+            coefs = self.descend(coefs, l1, l2, tol * y_scale, passes=max_iter)
+        return coefs
+
+    def descend(self, coefs, l1, l2, tol, passes):
+        '''
+        Runs passes of cyclic coordinate descent on every penalty and
+        dependent at once, stopping early once no coef moves more than tol
+        '''
+        coefs = coefs.copy()
+        diagonal = numpy.diag(self.corr)
+        ## constant fields have no variance and stay at 0 ##
+        denoms = diagonal[:, None, None] + l2[None, :, :]
+        scales = numpy.where(denoms > 0, 1 / numpy.where(denoms > 0, denoms, 1), 0.0)
+        columns = self.corr.T[:, None, :, None]
+        ## gradient of the fit, X'y - X'Xb, of each penalty ##
+        residual = self.cov[None, :, :] - numpy.einsum('ij,ljd->lid', self.corr, coefs)
+        for iteration in range(0, passes):
+            start = coefs.copy()
+            for j in range(0, self.k):
+                z = residual[:, j] + diagonal[j] * coefs[:, j]
+                new = numpy.sign(z) * numpy.maximum(numpy.abs(z) - l1, 0) * scales[j]
+                delta = new - coefs[:, j]
+                coefs[:, j] = new
+                residual -= columns[j] * delta[:, None, :]
+            self.iterations += 1
+            if (numpy.abs(coefs - start) <= tol).all():
+                break
+        return coefs
+
+    def active_steps(self, coefs, l1, l2, slack, max_steps):
+        '''
+        Runs active set (feature sign) steps on every fit at once. Each step
+        solves a fit exactly on its fields and their signs and moves towards
+        that solution until a coef reaches 0, which drops it. A fit whose
+        solution keeps its signs adds the field whose gradient is furthest
+        over the l1 penalty, and is optimal once there is none. Only the
+        fits that aren't yet optimal are stepped
+
+        Returns the coefs and a mask (penalties, d) of the optimal fits
+        '''
+        n_penalties, k, d = coefs.shape
+        diagonal = numpy.arange(0, k)
+        ## one row per fit, of (penalties, d) ##
+        coefs = numpy.moveaxis(coefs, 2, 1).reshape(-1, k).copy()
+        l1 = numpy.repeat(l1[:, 0], d)[:, None]
+        l2 = numpy.repeat(l2[:, 0], d)[:, None]
+        slack = numpy.tile(slack, n_penalties)[:, None]
+        cov = numpy.tile(self.cov.T, (n_penalties, 1))
+        signs = numpy.sign(coefs)
+        optimal = numpy.zeros(len(coefs), dtype=bool)
+        for step in range(0, max_steps):
+            fits = numpy.flatnonzero(~optimal)
+            if len(fits) == 0:
+                break
+            b = coefs[fits]
+            sign = signs[fits]
+            active = sign != 0
+            ## inactive fields are pinned to 0 with an identity row, and a
+            ## field passed twice splits its coef rather than leaving the
+            ## system singular ##
+            system = numpy.where(
+                active[:, :, None] & active[:, None, :], self.corr, 0.0
+            )
+            system[:, diagonal, diagonal] += numpy.where(active, l2[fits] + 1e-10, 1.0)
+            try:
+                solved = numpy.linalg.solve(
+                    system, numpy.where(active, cov[fits] - l1[fits] * sign, 0.0)[..., None]
+                )[..., 0]
+            except numpy.linalg.LinAlgError:
+                break
+            ## move until the first coef crosses 0, which leaves at 0 ##
+            crossed = active & (b != 0) & (numpy.sign(solved) != sign)
+            with numpy.errstate(divide='ignore', invalid='ignore'):
+                share = numpy.where(crossed, b / (b - solved), numpy.inf)
+            first = numpy.argmin(share, axis=1)
+            share = numpy.minimum(share.min(axis=1), 1.0)
+            moved = b + share[:, None] * (solved - b)
+            stopped = numpy.flatnonzero(share < 1)
+            moved[stopped, first[stopped]] = 0.0
+            ## as do added fields that came out against their sign ##
+            leaving = active & (numpy.sign(moved) != sign)
+            moved[leaving] = 0.0
+            sign[leaving] = 0.0
+            ## fits at their solution add the worst violating field ##
+            gradient = cov[fits] - moved @ self.corr - l2[fits] * moved
+            violation = numpy.where(
+                sign == 0, numpy.abs(gradient) - l1[fits] - slack[fits], 0.0
+            )
+            worst = numpy.argmax(violation, axis=1)
+            rows = numpy.arange(0, len(fits))
+            settled = (share >= 1) & ~leaving.any(axis=1)
+            adding = settled & (violation[rows, worst] > 0)
+            sign[rows[adding], worst[adding]] = numpy.sign(gradient[rows[adding], worst[adding]])
+            coefs[fits] = moved
+            signs[fits] = sign
+            optimal[fits] = settled & ~adding
+            self.iterations += 1
+        return (
+            numpy.moveaxis(coefs.reshape(n_penalties, d, k), 1, 2),
+            optimal.reshape(n_penalties, d)
+        )
+
+    def betas(self):
+        '''
+        Returns the coefs plus intercept (penalties, k + 1, d) of each fit,
+        relative to the gram's shift
+        '''
+        coefs = self.std_coefs / self.scale[None, :, None]
+        betas = numpy.empty(
+            (len(self.penalties), self.k + 1, coefs.shape[2]), dtype=numpy.float64
+        )
+        betas[:, :self.k] = coefs
+        betas[:, self.k] = self.y_mean[None, :] - numpy.einsum('k,lkd->ld', self.x_mean, coefs)
+        return betas
+
+    def features(self):
+        '''
+        Returns the number of fields (penalties, d) each fit uses
+        '''
+        return (self.std_coefs != 0).sum(axis=1)
+
+    def rsq(self, gram=None, tss=None):
+        '''
+        Returns the rsq (penalties, d) of each fit on the rows of a gram with
+        the same shift, defaulting to the gram it was fit on, capped the same
+        way Regression.calc_rsq is. The total sum of squares defaults to the
+        one of the gram's rows, and can be passed to score against a wider
+        set of rows (ie GramSweep.tss, which uses every row with a dependent)
+        '''
+        if gram is None:
+            ## rss of the training rows from the centered products ##
+            coefs = self.std_coefs
+            cross = numpy.einsum('lkd,kd->ld', coefs, self.cov)
+            quad = numpy.einsum('lkd,kj,ljd->ld', coefs, self.corr, coefs)
+            rss = numpy.maximum(self.yy[None, :] - self.n * (2 * cross - quad), 0)
+            default_tss = self.yy
+        else:
+            gram = numpy.asarray(gram, dtype=numpy.float64)
+            betas = self.betas()
+            k = self.k
+            xx = gram[:k + 1, :k + 1]
+            xy = gram[:k + 1, k + 1:]
+            yy = numpy.diag(gram[k + 1:, k + 1:])
+            ## rss = y'y - 2b'X'y + b'X'Xb ##
+            cross = numpy.einsum('lkd,kd->ld', betas, xy)
+            quad = numpy.einsum('lkd,kj,ljd->ld', betas, xx, betas)
+            rss = numpy.maximum(yy[None, :] - 2 * cross + quad, 0)
+            default_tss = centered_gram(gram, k)[5]
+        tss = default_tss if tss is None else numpy.asarray(tss, dtype=numpy.float64)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return 1 - numpy.minimum(1, rss / tss[None, :])
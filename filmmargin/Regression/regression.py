@@ -1,6 +1,169 @@
 import pandas as pd
 import numpy
-import statsmodels.api as sm
+
+from .splits import SplitGenerator
+from .fieldmatrix import FieldMatrix
+from .paths import RegularizationPath, penalty_grid
+from ..Profiler import profiler, logger
+
+
+def solve_normal_equations(xtx, xty):
+    '''
+    Solves one or more stacked normal equations, (X'X)b = X'y, where
+    xtx is (..., k, k) and xty is (..., k, d). Rank deficient systems
+    (ie a field that is passed twice) fall back to the pseudo inverse,
+    which matches the minimum norm solution statsmodels returns
+    '''
+    xtx = numpy.asarray(xtx, dtype=numpy.float64)
+    xty = numpy.asarray(xty, dtype=numpy.float64)
+    full_rank = numpy.asarray(
+        numpy.linalg.matrix_rank(xtx, hermitian=True) == xtx.shape[-1]
+    )
+    if full_rank.all():
+        return numpy.linalg.solve(xtx, xty)
+    if xtx.ndim == 2:
+        return numpy.linalg.pinv(xtx, hermitian=True) @ xty
+    ## solve the full rank systems and pinv the rest ##
+    betas = numpy.empty(xty.shape, dtype=numpy.float64)
+    if full_rank.any():
+        betas[full_rank] = numpy.linalg.solve(xtx[full_rank], xty[full_rank])
+    betas[~full_rank] = numpy.linalg.pinv(
+        xtx[~full_rank], hermitian=True
+    ) @ xty[~full_rank]
+    return betas
+
+
+def group_grams(z, codes, n_groups):
+    '''
+    Returns the cross products z'z of the rows of each group (n_groups,
+    p, p), given each row's integer group code
+    '''
+    p = z.shape[1]
+    outer = (z[:, :, None] * z[:, None, :]).reshape(len(z), p * p)
+    grams = numpy.empty((n_groups, p * p), dtype=numpy.float64)
+    for index in range(0, p * p):
+        grams[:, index] = numpy.bincount(
+            codes, weights=outer[:, index], minlength=n_groups
+        )
+    return grams.reshape(n_groups, p, p)
+
+
+def ols(x, y):
+    '''
+    Closed form OLS of y on x plus an intercept. Data is centered before
+    the normal equations are formed to keep them well conditioned
+    Returns the coefs and the constant
+    '''
+    x = numpy.asarray(x, dtype=numpy.float64)
+    y = numpy.asarray(y, dtype=numpy.float64)
+    x_mean = x.mean(axis=0)
+    y_mean = y.mean()
+    design = numpy.empty((len(x), x.shape[1] + 1), dtype=numpy.float64)
+    design[:, :-1] = x - x_mean
+    design[:, -1] = 1.0
+    betas = solve_normal_equations(design.T @ design, design.T @ (y - y_mean))
+    coefs = betas[:-1]
+    const = y_mean + betas[-1] - coefs @ x_mean
+    return coefs, const
+
+
+class GramSweep():
+    '''
+    Cross products of a set of fields and one or more dependents, from which
+    every model that leaves a single field out can be solved and scored
+    without going back to the rows
+
+    Columns are shifted by a reference mean before the cross products are
+    taken, which keeps the normal equations well conditioned. A test set
+    should be built with the shifts of its training set so betas carry over.
+    NAs are handled the same way a dropna on the model's fields would --
+    complete rows count towards every model, rows missing a single field
+    count only towards the model that leaves that field out, and rows missing
+    more than one field are never used
+    '''
+    def __init__(self, x, y, x_shift=None, y_shift=None):
+        x = numpy.asarray(x, dtype=numpy.float64)
+        y = numpy.asarray(y, dtype=numpy.float64)
+        if y.ndim == 1:
+            y = y[:, None]
+        self.k = x.shape[1]
+        self.d = y.shape[1]
+        self.x_shift = (
+            numpy.nanmean(x, axis=0) if x_shift is None else
+            numpy.asarray(x_shift, dtype=numpy.float64)
+        )
+        self.y_shift = (
+            numpy.nanmean(y, axis=0) if y_shift is None else
+            numpy.asarray(y_shift, dtype=numpy.float64)
+        )
+        ## validity of each row ##
+        x_valid = ~numpy.isnan(x)
+        y_valid = ~numpy.isnan(y).any(axis=1)
+        missing = self.k - x_valid.sum(axis=1)
+        ## augmented design of [fields, intercept, dependents] ##
+        z = numpy.empty((len(x), self.k + 1 + self.d), dtype=numpy.float64)
+        z[:, :self.k] = x - self.x_shift
+        z[:, self.k] = 1.0
+        z[:, self.k + 1:] = y - self.y_shift
+        z[numpy.isnan(z)] = 0.0
+        ## cross products of complete rows, shared by every model ##
+        complete = z[(missing == 0) & y_valid]
+        self.gram = complete.T @ complete
+        ## each leave one out model also gets the rows only missing its field ##
+        self.loo_gram = numpy.repeat(self.gram[None, :, :], self.k, axis=0)
+        single = numpy.flatnonzero((missing == 1) & y_valid)
+        if len(single) > 0:
+            missing_field = numpy.argmin(x_valid[single], axis=1)
+            for field_index in numpy.unique(missing_field):
+                rows = z[single[missing_field == field_index]]
+                self.loo_gram[field_index] += rows.T @ rows
+        ## total sum of squares is over every row with a dependent ##
+        self.tss = numpy.nansum(
+            (y - numpy.nanmean(y, axis=0)) ** 2, axis=0
+        )
+
+    def leave_one_out_systems(self):
+        '''
+        Returns the stacked X'X (k, k, k), X'y (k, k, d) and y'y (k, d)
+        of each model that leaves a field out. The intercept is the last
+        field of every model
+        '''
+        x_idx = numpy.array([
+            [i for i in range(0, self.k) if i != j] + [self.k]
+            for j in range(0, self.k)
+        ])
+        y_idx = numpy.arange(self.k + 1, self.k + 1 + self.d)
+        models = numpy.arange(0, self.k)[:, None, None]
+        xtx = self.loo_gram[models, x_idx[:, :, None], x_idx[:, None, :]]
+        xty = self.loo_gram[models, x_idx[:, :, None], y_idx[None, None, :]]
+        yty = self.loo_gram[:, y_idx, y_idx]
+        return xtx, xty, yty
+
+    def solve_leave_one_out(self):
+        '''
+        Solves every leave one out model with a single batched solve
+        Returns shifted betas (k, k, d)
+        '''
+        xtx, xty, yty = self.leave_one_out_systems()
+        return solve_normal_equations(xtx, xty)
+
+    def leave_one_out_rss(self, betas):
+        '''
+        Returns the residual sum of squares (k, d) of each leave one
+        out model's betas over the rows of this sweep
+        '''
+        xtx, xty, yty = self.leave_one_out_systems()
+        ## rss = y'y - 2b'X'y + b'X'Xb ##
+        cross = numpy.einsum('jkd,jkd->jd', betas, xty)
+        quad = numpy.einsum('jkd,jkl,jld->jd', betas, xtx, betas)
+        return numpy.maximum(yty - 2 * cross + quad, 0)
+
+    def leave_one_out_rsq(self, betas):
+        '''
+        Returns the rsq (k, d) of each leave one out model, capped
+        the same way Regression.calc_rsq is
+        '''
+        return 1 - numpy.minimum(1, self.leave_one_out_rss(betas) / self.tss)
 
 
 class Regression():
@@ -8,50 +171,121 @@ class Regression():
     Runs regressions to measure the predictiveness
     Using full_train=Train, will use the entire DF
     to train, which should be used when updating the config
+
+    Models are fit with closed form numpy OLS. Passing backend='statsmodels'
+    fits with sm.OLS instead, which is kept as a reference
+
+    Passing a seed (anything numpy.random.default_rng accepts) makes the
+    train/test split reproducible. A boolean train_mask over the rows of df
+    (ie from SplitGenerator) can be passed instead to use a split drawn upfront
+
+    Fits read their rows from a FieldMatrix of df. Passing the one built when
+    the data was loaded shares it across regressions, otherwise one is built
+    for the columns each fit uses. The train and test frames are only sliced
+    out of df when they are used (ie to score)
+
+    train_regularized() fits with a ridge, lasso, or elastic net penalty in
+    place of OLS, and regularization_path() scores every field over a grid
+    of penalties from the same cross products as the leave one out sweep
     '''
     def __init__(
-        self, df, fields, dependent, windowing_fields, full_train=False
+        self, df, fields, dependent, windowing_fields, full_train=False,
+        backend='numpy', seed=None, train_mask=None, matrix=None
     ):
+        if backend not in ['numpy', 'statsmodels']:
+            raise ValueError('Unknown regression backend: {0}'.format(backend))
         self.df = df
         self.fields = fields
         self.dependent = dependent
         self.windowing_fields = windowing_fields
-        self.train_df, self.test_df = self.window()
+        self.backend = backend
+        self.seed = seed
+        self.train_mask = train_mask
+        self.matrix = matrix
         self.full_train=full_train
+        self.train_rows, self.test_rows = self.split_rows()
+        self.frames = {}
+        self.sweeps = {}
         ## trained vars ##
         self.coefs = []
         self.const = 0
         ## results ##
         self.results = {}
     
+    def split_rows(self):
+        '''
+        Returns boolean masks of the training and test rows of df
+        With full_train, every row trains and none are held out. Otherwise
+        uses the provided train_mask if there is one, or draws a split of
+        the windowing groups
+        '''
+        if self.full_train:
+            train_rows = numpy.ones(len(self.df), dtype=bool)
+            return train_rows, ~train_rows
+        if self.train_mask is None:
+            splits = SplitGenerator(self.df, self.windowing_fields)
+            train_rows = splits.row_mask(splits.masks(1, self.seed)[0])
+            return train_rows, splits.grouped & ~train_rows
+        train_rows = numpy.asarray(self.train_mask, dtype=bool)
+        return train_rows, ~train_rows
+
     def window(self):
         '''
         Splits the data into a training and test set
         '''
-        ## create a df of all unique combos ##
-        temp = self.df[self.windowing_fields].groupby(self.windowing_fields).head(1)
-        ## randomly assign training and test ##
-        mask = numpy.random.rand(len(temp)) < 0.6
-        train = temp[mask].copy()
-        train['sample'] = 'train'
-        test = temp[~mask].copy()
-        test['sample'] = 'test'
-        ## combine ##
-        temp = pd.concat([
-            train, test
-        ])
-        ## add back to df ##
-        temp = pd.merge(
-            self.df,
-            temp,
-            on=self.windowing_fields,
-            how='left'
-        )
-        ## return ##
         return (
-            temp[temp['sample']=='train'].reset_index(drop=True),
-            temp[temp['sample']=='test'].reset_index(drop=True)
+            self.df[self.train_rows].reset_index(drop=True),
+            self.df[self.test_rows].reset_index(drop=True)
         )
+
+    @property
+    def train_df(self):
+        '''
+        The training rows of df, sliced out the first time they are used
+        '''
+        if 'train' not in self.frames:
+            self.frames['train'] = self.df[self.train_rows].reset_index(drop=True)
+        return self.frames['train']
+
+    @train_df.setter
+    def train_df(self, df):
+        self.frames['train'] = df
+
+    @property
+    def test_df(self):
+        '''
+        The test rows of df, sliced out the first time they are used
+        '''
+        if 'test' not in self.frames:
+            self.frames['test'] = self.df[self.test_rows].reset_index(drop=True)
+        return self.frames['test']
+
+    @test_df.setter
+    def test_df(self, df):
+        self.frames['test'] = df
+
+    def field_matrix(self, columns):
+        '''
+        Returns the shared FieldMatrix if it holds every column, otherwise
+        builds one of just the columns
+        '''
+        if self.matrix is not None and all(col in self.matrix for col in columns):
+            return self.matrix
+        return FieldMatrix(self.df, columns)
+
+    def training_rows(self, matrix):
+        '''
+        Returns the training rows with every field, logging any dropped
+        for NAs
+        '''
+        rows = self.train_rows & matrix.valid(self.fields)
+        removed = int(self.train_rows.sum() - rows.sum())
+        if removed > 0:
+            logger.warning('     Warning - some fields contained NAs. {0} records removed.'.format(
+                removed
+            ))
+            logger.warning('          Fields: {0}'.format(', '.join(self.fields)))
+        return rows
     
     def calc_rsq(self, df):
         '''
@@ -61,24 +295,41 @@ class Regression():
         tss = numpy.sum((df[self.dependent] - df[self.dependent].mean()) ** 2)
         return 1 - min(1, rss/tss)
 
+    @profiler.timed('regression_train', profile=True)
     def train(self):
         '''
         Trains the regression of a windowed test set
         '''
-        ## drop records with NAs in the frame ##
-        temp = self.train_df.copy()
-        temp = temp.dropna(subset=self.fields)
-        if len(temp) != len(self.train_df):
-            print('     Warning - some fields contained NAs. {0} records removed.'.format(
-                len(self.train_df) - len(temp)
-            ))
-            print('          Fields: {0}'.format(', '.join(self.fields)))
+        if self.backend == 'statsmodels':
+            self.train_statsmodels()
+            return
+        ## only gather the rows with every field ##
+        matrix = self.field_matrix(self.fields + [self.dependent])
+        rows = self.training_rows(matrix)
+        x = matrix.gather(self.fields, rows)
+        y = matrix.gather([self.dependent], rows)[:, 0]
+        ## train ##
+        coefs, const = ols(x, y)
+        ## update trained variables ##
+        self.coefs = coefs.tolist()
+        self.const = float(const)
+
+    def train_statsmodels(self):
+        '''
+        Trains the regression of a windowed test set with sm.OLS
+        '''
+        ## statsmodels is slow to import and only needed here ##
+        import statsmodels.api as sm
+        ## only gather the rows with every field ##
+        matrix = self.field_matrix(self.fields + [self.dependent])
+        rows = self.training_rows(matrix)
         ## add constant ##
-        temp['intercept'] = 1
+        design = numpy.ones((int(rows.sum()), len(self.fields) + 1), dtype=numpy.float64)
+        design[:, :-1] = matrix.gather(self.fields, rows)
         ## train ##
         model = sm.OLS(
-            temp[self.dependent],
-            temp[self.fields + ['intercept']],
+            matrix.gather([self.dependent], rows)[:, 0],
+            design,
             hasconst=True
         ).fit()
         ## clear coefs ##
@@ -90,16 +341,37 @@ class Regression():
             else:
                 self.coefs.append(var)
     
+    def train_regularized(self, method, penalty, l1_ratio=0.5):
+        '''
+        Trains the regression with a ridge, lasso, or elastic_net penalty
+        (see RegularizationPath) instead of OLS
+        '''
+        matrix = self.field_matrix(self.fields + [self.dependent])
+        rows = self.training_rows(matrix)
+        sweep = GramSweep(
+            matrix.gather(self.fields, rows), matrix.gather([self.dependent], rows)
+        )
+        betas = RegularizationPath(
+            sweep.gram, len(self.fields), method, [penalty], l1_ratio
+        ).betas()[0, :, 0]
+        coefs = betas[:-1]
+        ## undo the shift of the cross products ##
+        self.coefs = coefs.tolist()
+        self.const = float(sweep.y_shift[0] + betas[-1] - coefs @ sweep.x_shift)
+    
     def apply_prediction(self, df):
         '''
         Applies prediction to a df from the trained model
         '''
-        df['prediction'] = self.const
-        for index, coef in enumerate(self.coefs):
-            df['prediction'] = df['prediction'] + (df[self.fields[index]] * coef)
+        df['prediction'] = (
+            df[self.fields].to_numpy(dtype=numpy.float64) @
+            numpy.asarray(self.coefs, dtype=numpy.float64) +
+            self.const
+        )
         ## return the df ##
         return df
 
+    @profiler.timed('regression_score')
     def score(self):
         '''
         Scores the testing and training sets
@@ -114,4 +386,175 @@ class Regression():
         self.results = {
             'train_rsq' : train_rsq,
             'test_rsq' : test_rsq
-        }
\ No newline at end of file
+        }
+
+    def subset_grams(self, dependents):
+        '''
+        Returns the augmented grams of the train and test sets, both shifted
+        by the train means, from which any subset of the fields can be
+        searched for and scored (see subsets.SubsetSearch). Only rows with
+        every field and dependent are used, so only those are gathered
+        '''
+        matrix = self.field_matrix(self.fields + dependents)
+        complete = matrix.valid(self.fields + dependents)
+        train_rows = self.train_rows & complete
+        test_rows = self.test_rows & complete
+        train = GramSweep(
+            matrix.gather(self.fields, train_rows), matrix.gather(dependents, train_rows)
+        )
+        test = GramSweep(
+            matrix.gather(self.fields, test_rows), matrix.gather(dependents, test_rows),
+            x_shift=train.x_shift, y_shift=train.y_shift
+        )
+        return train.gram, test.gram
+
+    def gram_sweeps(self, dependents):
+        '''
+        Returns the train and test GramSweeps of the fields and dependents,
+        both shifted by the train means. They are built once for a set of
+        dependents, and shared by the leave one out sweep and the
+        regularization path
+        '''
+        key = tuple(dependents)
+        if key not in self.sweeps:
+            matrix = self.field_matrix(self.fields + dependents)
+            train = GramSweep(
+                matrix.gather(self.fields, self.train_rows),
+                matrix.gather(dependents, self.train_rows)
+            )
+            test = GramSweep(
+                matrix.gather(self.fields, self.test_rows),
+                matrix.gather(dependents, self.test_rows),
+                x_shift=train.x_shift, y_shift=train.y_shift
+            )
+            self.sweeps[key] = (train, test)
+        return self.sweeps[key]
+
+    @profiler.timed('regression_leave_one_out', profile=True)
+    def leave_one_out_rsq(self, dependents):
+        '''
+        Trains and scores every model that leaves one of the fields out for
+        each dependent. Returns the train and test rsq (fields, dependents)
+
+        With the numpy backend, the cross products of each sample are built
+        once and every model is solved from them in a single batched solve
+        '''
+        if self.backend == 'statsmodels':
+            records = self.leave_one_out_statsmodels(dependents)
+            shape = (len(dependents), len(self.fields))
+            return (
+                numpy.array([r['train_rsq'] for r in records]).reshape(shape).T,
+                numpy.array([r['test_rsq'] for r in records]).reshape(shape).T
+            )
+        train, test = self.gram_sweeps(dependents)
+        betas = train.solve_leave_one_out()
+        return train.leave_one_out_rsq(betas), test.leave_one_out_rsq(betas)
+
+    def leave_one_out(self, dependents):
+        '''
+        Trains and scores every model that leaves one of the fields out for
+        each dependent. Returns a list of results, one per model
+        '''
+        train_rsq, test_rsq = self.leave_one_out_rsq(dependents)
+        ## structure results ##
+        records = []
+        for dep_index, dependent in enumerate(dependents):
+            for index, field in enumerate(self.fields):
+                records.append({
+                    'dependent' : dependent,
+                    'field_left_out' : field,
+                    'train_rsq' : train_rsq[index, dep_index],
+                    'test_rsq' : test_rsq[index, dep_index]
+                })
+        return records
+
+    def penalty_grids(self, dependents, methods, l1_ratio=0.5):
+        '''
+        Returns a grid of penalties for each method, drawn from every row of
+        df rather than a split, so every split's path is fit on the same grid
+        '''
+        matrix = self.field_matrix(self.fields + dependents)
+        sweep = GramSweep(matrix.gather(self.fields), matrix.gather(dependents))
+        return {
+            method : penalty_grid(sweep.gram, len(self.fields), method, l1_ratio)
+            for method in methods
+        }
+
+    @profiler.timed('regression_path', profile=True)
+    def path_rsq(
+        self, dependents, methods=('ridge', 'lasso', 'elastic_net'),
+        penalties=None, l1_ratio=0.5
+    ):
+        '''
+        Fits every field with each method over a grid of penalties for each
+        dependent, and scores each fit on the train and test sets. Returns a
+        dict of each method's penalties, and the fields used and train and
+        test rsq of each fit (penalties, dependents)
+
+        penalties can be a grid, or a dict of a grid per method (see
+        penalty_grids), and default to a grid drawn from the training set.
+        Fits use the rows with every field and dependent, from the same
+        cross products as the leave one out sweep
+        '''
+        train, test = self.gram_sweeps(dependents)
+        paths = {}
+        for method in methods:
+            path = RegularizationPath(
+                train.gram, len(self.fields), method,
+                penalties.get(method) if isinstance(penalties, dict) else penalties,
+                l1_ratio
+            )
+            paths[method] = (
+                path.penalties, path.features(), path.rsq(tss=train.tss),
+                path.rsq(test.gram, tss=test.tss)
+            )
+        return paths
+
+    def regularization_path(
+        self, dependents, methods=('ridge', 'lasso', 'elastic_net'),
+        penalties=None, l1_ratio=0.5
+    ):
+        '''
+        Scores each method's path (see path_rsq). Returns a list of results,
+        one per method, penalty, and dependent
+        '''
+        records = []
+        paths = self.path_rsq(dependents, methods, penalties, l1_ratio)
+        for method, (grid, features, train_rsq, test_rsq) in paths.items():
+            for dep_index, dependent in enumerate(dependents):
+                for index, penalty in enumerate(grid):
+                    records.append({
+                        'dependent' : dependent,
+                        'method' : method,
+                        'penalty' : penalty,
+                        'features' : features[index, dep_index],
+                        'train_rsq' : train_rsq[index, dep_index],
+                        'test_rsq' : test_rsq[index, dep_index]
+                    })
+        return records
+
+    def leave_one_out_statsmodels(self, dependents):
+        '''
+        Reference leave one out sweep that refits each model with sm.OLS
+        '''
+        records = []
+        fields = self.fields
+        dependent = self.dependent
+        for prediction_type in dependents:
+            self.dependent = prediction_type
+            for index, field in enumerate(fields):
+                ## drop from set to see impact ##
+                fields_ = fields.copy()
+                fields_.pop(index)
+                self.fields = fields_
+                ## train, score, and append results ##
+                self.train()
+                self.score()
+                records.append({
+                    'dependent' : prediction_type,
+                    'field_left_out' : field
+                } | self.results)
+        ## restore ##
+        self.fields = fields
+        self.dependent = dependent
+        return records
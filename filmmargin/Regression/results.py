@@ -0,0 +1,292 @@
+import pandas as pd
+import numpy
+import json
+import os
+import pathlib
+
+## a row of each leave one out fit, and of each fit on a penalty path ##
+fit_dtype = numpy.dtype([
+    ('run_group', numpy.int32),
+    ('dependent', numpy.int16),
+    ('field', numpy.int16),
+    ('train_rsq', numpy.float64),
+    ('test_rsq', numpy.float64)
+])
+path_dtype = numpy.dtype([
+    ('run_group', numpy.int32),
+    ('dependent', numpy.int16),
+    ('method', numpy.int16),
+    ('penalty', numpy.int16),
+    ('features', numpy.int16),
+    ('train_rsq', numpy.float64),
+    ('test_rsq', numpy.float64)
+])
+
+def coded_array(shape, dtype, codes, path=None):
+    '''
+    Returns a structured array of shape with its code fields filled from
+    codes (a dict of arrays that broadcast to shape) and its rsqs NaN.
+    With a path, the array is a new .npy memmap there
+    '''
+    if path is None:
+        array = numpy.empty(shape, dtype=dtype)
+    else:
+        array = numpy.lib.format.open_memmap(path, mode='w+', dtype=dtype, shape=shape)
+    for name, values in codes.items():
+        array[name] = values
+    array['train_rsq'] = numpy.nan
+    array['test_rsq'] = numpy.nan
+    return array
+
+def nan_mean(sums, counts):
+    '''
+    Returns sums / counts, NaN where there is no count
+    '''
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.where(counts > 0, sums / numpy.maximum(counts, 1), numpy.nan)
+
+
+class ResultStore():
+    '''
+    Results of every round of a development run, in structured arrays
+    preallocated for all of the rounds
+
+    Leave one out fits are stored (rounds, dependents, fields) and fits on a
+    penalty path (rounds, methods, penalties, dependents), with dependents,
+    fields, and methods as integer codes into the run's lists. A round is
+    written as one block of each, and summaries are reshaped means and
+    bincounts over the codes of completed rounds rather than groupbys over
+    a frame of records
+
+    Passing a directory streams the arrays to .npy memmaps in it, with the
+    run's setup in meta.json. A round is flagged done once its results are
+    written, and checkpoint() flushes the results ahead of the flags, so a
+    run interrupted at any point can be resumed by opening a store with the
+    same setup on the directory, which keeps the done rounds. A directory
+    holding a different run (ie other fields, or data with other penalty
+    grids) is not resumed and raises a ValueError
+    '''
+    def __init__(
+        self, rounds, dependents, fields, methods=(), penalties=None,
+        directory=None, meta=None
+    ):
+        self.rounds = rounds
+        self.dependents = list(dependents)
+        self.fields = list(fields)
+        self.methods = list(methods)
+        self.penalties = numpy.asarray(
+            [penalties[method] for method in self.methods] if len(self.methods) > 0
+            else numpy.empty((0, 0)), dtype=numpy.float64
+        )
+        self.directory = None if directory is None else pathlib.Path(directory)
+        self.meta = {
+            'rounds' : rounds,
+            'dependents' : self.dependents,
+            'fields' : self.fields,
+            'methods' : self.methods,
+            'penalties' : self.penalties.tolist()
+        } | (meta or {})
+        if self.directory is not None and (self.directory / 'meta.json').exists():
+            self.resume()
+        else:
+            self.allocate()
+
+    @staticmethod
+    def read_meta(directory):
+        '''
+        Returns the setup of the run stored in a directory, or None if
+        there isn't one
+        '''
+        path = pathlib.Path(directory) / 'meta.json'
+        if not path.exists():
+            return None
+        with open(path, 'r') as fp:
+            return json.load(fp)
+
+    def file(self, name):
+        '''
+        Returns the path of one of the store's arrays, or None in memory
+        '''
+        return None if self.directory is None else self.directory / '{0}.npy'.format(name)
+
+    def allocate(self):
+        '''
+        Allocates the arrays with every round pending
+        '''
+        d = len(self.dependents)
+        k = len(self.fields)
+        m, n_penalties = self.penalties.shape
+        if self.directory is not None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+        runs = numpy.arange(1, self.rounds + 1, dtype=numpy.int32)
+        self.fits = coded_array((self.rounds, d, k), fit_dtype, {
+            'run_group' : runs[:, None, None],
+            'dependent' : numpy.arange(0, d)[None, :, None],
+            'field' : numpy.arange(0, k)[None, None, :]
+        }, self.file('fits'))
+        self.paths = coded_array((self.rounds, m, n_penalties, d), path_dtype, {
+            'run_group' : runs[:, None, None, None],
+            'method' : numpy.arange(0, m)[None, :, None, None],
+            'penalty' : numpy.arange(0, n_penalties)[None, None, :, None],
+            'dependent' : numpy.arange(0, d)[None, None, None, :],
+            'features' : 0
+        }, self.file('paths'))
+        if self.directory is None:
+            self.done = numpy.zeros(self.rounds, dtype=bool)
+            return
+        self.done = numpy.lib.format.open_memmap(
+            self.file('done'), mode='w+', dtype=bool, shape=(self.rounds,)
+        )
+        self.checkpoint()
+        ## the setup is written last, so a store is only resumed once
+        ## its arrays exist ##
+        temp = self.directory / 'meta.json.tmp'
+        with open(temp, 'w') as fp:
+            json.dump(self.meta, fp, indent=4)
+        os.replace(temp, self.directory / 'meta.json')
+
+    def resume(self):
+        '''
+        Opens the arrays of a stored run with the same setup
+        '''
+        saved = self.read_meta(self.directory)
+        ## compare as json, which is how the setup was saved ##
+        if saved != json.loads(json.dumps(self.meta)):
+            different = [
+                key for key in set(saved) | set(self.meta)
+                if saved.get(key) != json.loads(json.dumps(self.meta.get(key)))
+            ]
+            raise ValueError('{0} holds a different run (differs in {1})'.format(
+                self.directory, ', '.join(sorted(different))
+            ))
+        self.fits = numpy.load(self.file('fits'), mmap_mode='r+')
+        self.paths = numpy.load(self.file('paths'), mmap_mode='r+')
+        self.done = numpy.load(self.file('done'), mmap_mode='r+')
+
+    def pending(self):
+        '''
+        Returns the rounds (from 0) that aren't done
+        '''
+        return numpy.flatnonzero(~numpy.asarray(self.done)).tolist()
+
+    def add(self, round_num, train_rsq, test_rsq, paths=None):
+        '''
+        Writes a round's leave one out rsqs (fields, dependents), and the
+        (features, train rsq, test rsq) of each method's path (penalties,
+        dependents), which paths holds when the store has methods, and flags
+        it done
+        '''
+        self.fits['train_rsq'][round_num] = numpy.asarray(train_rsq).T
+        self.fits['test_rsq'][round_num] = numpy.asarray(test_rsq).T
+        for index, method in enumerate(self.methods):
+            features, path_train, path_test = paths[method]
+            self.paths['features'][round_num, index] = features
+            self.paths['train_rsq'][round_num, index] = path_train
+            self.paths['test_rsq'][round_num, index] = path_test
+        self.done[round_num] = True
+
+    def checkpoint(self):
+        '''
+        Flushes the results, then the done flags, to disk
+        '''
+        if self.directory is None:
+            return
+        self.fits.flush()
+        self.paths.flush()
+        self.done.flush()
+
+    def summarize(self):
+        '''
+        Returns the average train and test rsq of each field left out and
+        dependent over the done rounds, and its average lift over the
+        round's average across the fields left out. A field passed twice is
+        summarized once over both of its fits
+        '''
+        done = numpy.asarray(self.done)
+        names = sorted(set(self.fields))
+        name_codes = numpy.array([names.index(field) for field in self.fields])
+        dependents = sorted(set(self.dependents))
+        dependent_codes = numpy.array([dependents.index(dep) for dep in self.dependents])
+        ## key of each fit, in the order of (field, dependent) ##
+        keys = numpy.broadcast_to(
+            name_codes[None, None, :] * len(dependents) + dependent_codes[None, :, None],
+            (int(done.sum()), len(self.dependents), len(self.fields))
+        ).ravel()
+        n_keys = len(names) * len(dependents)
+        columns = {}
+        for rsq in ['train_rsq', 'test_rsq']:
+            values = numpy.asarray(self.fits[rsq])[done]
+            valid = ~numpy.isnan(values)
+            filled = numpy.where(valid, values, 0.0)
+            ## average of each round and dependent across the fields ##
+            group = nan_mean(
+                filled.sum(axis=2, keepdims=True), valid.sum(axis=2, keepdims=True)
+            )
+            lift = values - group
+            lift_valid = ~numpy.isnan(lift)
+            columns[rsq] = [
+                nan_mean(
+                    numpy.bincount(keys, weights=numpy.where(ok, v, 0.0).ravel(), minlength=n_keys),
+                    numpy.bincount(keys, weights=ok.ravel(), minlength=n_keys)
+                )
+                for v, ok in [(values, valid), (lift, lift_valid)]
+            ]
+        agg = pd.DataFrame({
+            'field_left_out' : numpy.repeat(names, len(dependents)),
+            'dependent' : numpy.tile(dependents, len(names)),
+            'train_avg_rsq' : columns['train_rsq'][0],
+            'test_avg_rsq' : columns['test_rsq'][0],
+            'train_lift_when_excluded' : columns['train_rsq'][1],
+            'test_lift_when_excluded' : columns['test_rsq'][1],
+        })
+        ## pairs with no fits in any round aren't reported ##
+        seen = numpy.bincount(keys, minlength=n_keys) > 0
+        return agg[seen].sort_values(
+            by=['train_lift_when_excluded'],
+            ascending=[True]
+        ).reset_index(drop=True)
+
+    def summarize_paths(self):
+        '''
+        Returns each method's path averaged over the done rounds, with the
+        penalty of each method and dependent with the best average test rsq
+        selected
+        '''
+        done = numpy.asarray(self.done)
+        paths = numpy.asarray(self.paths)[done]
+        m, n_penalties = self.penalties.shape
+        d = len(self.dependents)
+        columns = {}
+        for rsq in ['train_rsq', 'test_rsq']:
+            values = paths[rsq]
+            valid = ~numpy.isnan(values)
+            count = valid.sum(axis=0)
+            mean = nan_mean(numpy.where(valid, values, 0.0).sum(axis=0), count)
+            columns[rsq] = mean
+            if rsq == 'test_rsq':
+                squares = numpy.where(valid, (values - mean) ** 2, 0.0).sum(axis=0)
+                columns['test_std_rsq'] = numpy.sqrt(nan_mean(squares, count - 1))
+        ## (methods, penalties, dependents) to rows of dependent, method, penalty ##
+        order = lambda values: numpy.moveaxis(values, 2, 0).ravel()
+        agg = pd.DataFrame({
+            'dependent' : order(numpy.broadcast_to(
+                numpy.array(self.dependents, dtype=object)[None, None, :], (m, n_penalties, d)
+            )),
+            'method' : order(numpy.broadcast_to(
+                numpy.array(self.methods, dtype=object)[:, None, None], (m, n_penalties, d)
+            )),
+            'penalty' : order(numpy.broadcast_to(self.penalties[:, :, None], (m, n_penalties, d))),
+            'features' : order(paths['features'].mean(axis=0) if len(paths) > 0 else numpy.full((m, n_penalties, d), numpy.nan)),
+            'train_avg_rsq' : order(columns['train_rsq']),
+            'test_avg_rsq' : order(columns['test_rsq']),
+            'test_std_rsq' : order(columns['test_std_rsq']),
+        })
+        agg['selected'] = False
+        best = agg.dropna(subset=['test_avg_rsq']).groupby(
+            ['dependent', 'method']
+        )['test_avg_rsq'].idxmax()
+        agg.loc[best, 'selected'] = True
+        return agg.sort_values(
+            by=['dependent', 'method', 'penalty'],
+            ascending=[True, True, False]
+        ).reset_index(drop=True)
@@ -0,0 +1,45 @@
+import pandas as pd
+import numpy
+
+
+class SplitGenerator():
+    '''
+    Draws train/test splits over windowing groups (ie season, team)
+
+    Groups are factorized into integer codes once, in order of first
+    appearance, so any number of splits can be drawn as a single
+    (n_rounds, n_groups) matrix and applied to rows by indexing with
+    the codes rather than merging a sample column back onto the data
+    '''
+    def __init__(self, df, windowing_fields, train_share=0.6):
+        self.windowing_fields = windowing_fields
+        self.train_share = train_share
+        ## rows with a missing windowing field are in no group (-1) ##
+        codes = df.groupby(windowing_fields, sort=False).ngroup()
+        self.group_codes = codes.fillna(-1).to_numpy(dtype=numpy.int64)
+        self.grouped = self.group_codes >= 0
+        self.n_groups = int(self.group_codes.max()) + 1 if len(df) > 0 else 0
+
+    def masks(self, n_rounds, seed=None):
+        '''
+        Returns an (n_rounds, n_groups) boolean matrix of training groups
+        drawn from a seeded generator
+        '''
+        rng = numpy.random.default_rng(seed)
+        return rng.random((n_rounds, self.n_groups)) < self.train_share
+
+    def row_mask(self, group_mask):
+        '''
+        Maps a group mask (or stack of them) to a training row mask
+        '''
+        return numpy.asarray(group_mask)[..., self.group_codes] & self.grouped
+
+    def split(self, df, group_mask):
+        '''
+        Returns the training and test rows of df for a group mask
+        '''
+        train_mask = self.row_mask(group_mask)
+        return (
+            df[train_mask].reset_index(drop=True),
+            df[self.grouped & ~train_mask].reset_index(drop=True)
+        )
@@ -0,0 +1,330 @@
+import numpy
+
+
+def sweep(a, j):
+    '''
+    Sweeps (or, if already swept, unsweeps) the symmetric matrix a on
+    pivot j, returning a new matrix
+
+    Sweeping the fields of a model into an augmented gram [X, y]'[X, y]
+    leaves the model's coefs in the y column of its rows, -(X'X)^-1 in its
+    block, and the rss in the y corner. The fields not swept hold what a
+    Cholesky factorization of the model leaves behind -- their cross
+    products with the model partialled out -- so adding or dropping a field
+    from any model costs O(k^2) instead of a refit
+    '''
+    d = a[j, j]
+    col = a[:, j].copy()
+    ## a zero pivot (a collinear field) leaves infs, which callers guard
+    ## against with min_pivot rather than warn about ##
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        swept = a - numpy.outer(col, col) / d
+        if d > 0:
+            swept[:, j] = col / d
+            swept[j, :] = col / d
+        else:
+            swept[:, j] = -col / d
+            swept[j, :] = -col / d
+        swept[j, j] = -1 / d
+    return swept
+
+
+class SubsetSearch():
+    '''
+    Finds the best subsets of a set of fields for a dependent from an
+    augmented gram of [fields, intercept, dependents], like GramSweep.gram
+
+    Every model includes the intercept. Subsets are ranked by their rss on
+    the rows of the gram, and forward and backward selection and the
+    exhaustive search all move between models by sweeping one field in or
+    out. A field whose pivot falls below min_pivot of its partialled
+    variance (ie a field passed twice) is collinear with the model and is
+    not added
+    '''
+    def __init__(self, gram, k, dependent=0, min_pivot=1e-10):
+        self.k = k
+        index = list(range(0, k + 1)) + [k + 1 + dependent]
+        self.gram = numpy.asarray(gram, dtype=numpy.float64)[numpy.ix_(index, index)]
+        ## sweep the intercept, which leaves centered cross products ##
+        self.base = sweep(self.gram, k)
+        self.tss = self.base[-1, -1]
+        self.scale = numpy.diag(self.base)[:k].copy()
+        self.min_pivot = min_pivot
+        self.nodes = 0
+
+    def rss(self, a):
+        '''
+        Returns the rss of a swept matrix's model
+        '''
+        return max(a[-1, -1], 0)
+
+    def rsq(self, rss):
+        '''
+        Returns the rsq of an rss, capped the same way Regression.calc_rsq is
+        '''
+        if self.tss <= 0:
+            return numpy.nan
+        return 1 - min(1, rss / self.tss)
+
+    def pivotable(self, a, candidates):
+        '''
+        Returns the candidates (not in the model) that can be swept in
+        '''
+        candidates = numpy.asarray(candidates, dtype=numpy.int64)
+        return candidates[
+            a[candidates, candidates] > self.min_pivot * self.scale[candidates]
+        ]
+
+    def step_rss(self, a, candidates):
+        '''
+        Returns the rss of the model after sweeping each candidate in or out
+        on its own. Candidates in the model raise the rss when dropped, and
+        those out of it lower it when added
+        '''
+        candidates = numpy.asarray(candidates, dtype=numpy.int64)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            return numpy.maximum(
+                a[-1, -1] - a[candidates, -1] ** 2 / a[candidates, candidates], 0
+            )
+
+    def model(self, subset):
+        '''
+        Returns the swept matrix of a subset
+        '''
+        a = self.base
+        for j in subset:
+            a = sweep(a, j)
+        return a
+
+    def betas(self, subset):
+        '''
+        Returns the shifted betas of a subset, in the order of its fields
+        followed by the intercept
+        '''
+        a = self.model(subset)
+        return a[list(subset) + [self.k], -1]
+
+    def subset_rss(self, subset, betas):
+        '''
+        Returns the rss of a subset's betas (ie from another search built
+        with the same shifts) over the rows of this gram
+        '''
+        index = list(subset) + [self.k]
+        xtx = self.gram[numpy.ix_(index, index)]
+        xty = self.gram[index, -1]
+        return max(self.gram[-1, -1] - 2 * betas @ xty + betas @ xtx @ betas, 0)
+
+    def forward(self, max_size=None):
+        '''
+        Adds the field that lowers the rss most until max_size fields are in
+        Returns the (subset, rss) of each step
+        '''
+        max_size = self.k if max_size is None else max_size
+        a = self.base
+        subset = []
+        path = []
+        while len(subset) < max_size:
+            candidates = self.pivotable(
+                a, [j for j in range(0, self.k) if j not in subset]
+            )
+            if len(candidates) == 0:
+                break
+            rss = self.step_rss(a, candidates)
+            j = int(candidates[numpy.argmin(rss)])
+            a = sweep(a, j)
+            subset.append(j)
+            path.append((tuple(sorted(subset)), self.rss(a)))
+        return path
+
+    def backward(self, min_size=1):
+        '''
+        Starts from every field that is not collinear with those before it
+        and drops the field that raises the rss least until min_size are left
+        Returns the (subset, rss) of each step
+        '''
+        a = self.base
+        subset = []
+        for j in range(0, self.k):
+            if len(self.pivotable(a, [j])) > 0:
+                a = sweep(a, j)
+                subset.append(j)
+        path = [(tuple(subset), self.rss(a))]
+        while len(subset) > min_size:
+            rss = self.step_rss(a, subset)
+            j = subset[int(numpy.argmin(rss))]
+            ## unsweep ##
+            a = sweep(a, j)
+            subset.remove(j)
+            path.append((tuple(subset), self.rss(a)))
+        return path
+
+    def exhaustive(self, max_size=None, incumbents=()):
+        '''
+        Finds the subset with the lowest rss of each size up to max_size
+        with branch and bound. Each node of the search fixes some fields in
+        the model and leaves the rest to its children. Since adding fields
+        never raises the rss, the rss of a node's fields plus all of its
+        children's is a floor on every subset below it, and the node is
+        pruned when that floor can't beat the best subset of any size below.
+        incumbents, (subset, rss) pairs from ie forward(), seed the best
+        subsets so pruning starts early
+
+        Returns the (subset, rss) of each size
+        '''
+        max_size = self.k if max_size is None else min(max_size, self.k)
+        ## best rss and subset of each size so far ##
+        self.best_rss = numpy.full(self.k + 1, numpy.inf)
+        self.best_subsets = [None] * (self.k + 1)
+        for subset, rss in incumbents:
+            self.update_best(subset, rss)
+        self.nodes = 0
+        ## the search only needs the fields and dependent once the
+        ## intercept is swept ##
+        index = list(range(0, self.k)) + [self.k + 1]
+        self.branch(
+            self.base[numpy.ix_(index, index)], [],
+            numpy.arange(0, self.k), max_size
+        )
+        return [
+            (self.best_subsets[size], self.best_rss[size])
+            for size in range(1, self.k + 1) if self.best_subsets[size] is not None
+        ]
+
+    def update_best(self, subset, rss):
+        '''
+        Keeps the subset if it is the best of its size so far
+        '''
+        size = len(subset)
+        if rss < self.best_rss[size]:
+            self.best_rss[size] = rss
+            self.best_subsets[size] = tuple(sorted(subset))
+
+    def prunable(self, floor, low, high):
+        '''
+        Whether no subset with low to high fields can beat the floor
+        '''
+        return floor >= self.best_rss[low:high + 1].max()
+
+    def floors(self, a):
+        '''
+        Returns the rss of the model with each free field of a node and every
+        field after it. A Cholesky factorization of the fields in reverse
+        order adds them one at a time, so its last row holds the drop in rss
+        from each
+        '''
+        order = list(range(len(a) - 2, -1, -1)) + [len(a) - 1]
+        try:
+            factor = numpy.linalg.cholesky(a[order][:, order])
+        except numpy.linalg.LinAlgError:
+            ## fields that are collinear with those after them are skipped ##
+            floors = numpy.empty(len(a) - 1)
+            full = a
+            for i in range(len(a) - 2, -1, -1):
+                if full[i, i] > self.min_pivot * a[i, i]:
+                    full = full - numpy.outer(full[:, i], full[:, i]) / full[i, i]
+                floors[i] = max(full[-1, -1], 0)
+            return floors
+        drops = numpy.cumsum(factor[-1, :-1] ** 2)
+        return numpy.maximum(a[-1, -1] - drops, 0)[::-1]
+
+    def branch(self, a, subset, free, max_size):
+        '''
+        Searches every subset that adds free fields to a subset. a holds the
+        cross products of the free fields and the dependent with the subset
+        partialled out, which is what sweeping the subset leaves in them
+        '''
+        self.nodes += 1
+        pivots = numpy.diag(a)[:-1]
+        keep = pivots > self.min_pivot * self.scale[free]
+        if not keep.any():
+            return
+        ## children are the subset plus each free field. Strongest first, so
+        ## good subsets are found early and later children, which can't use
+        ## the fields before them, have the highest floors ##
+        ## collinear fields' pivots are zero, and they aren't kept ##
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            rss = numpy.maximum(a[-1, -1] - a[:-1, -1] ** 2 / pivots, 0)
+        order = numpy.flatnonzero(keep)[numpy.argsort(rss[keep], kind='stable')]
+        free = free[order]
+        rss = rss[order]
+        order = numpy.append(order, len(a) - 1)
+        a = a[order][:, order]
+        ## the children are all one size, so only the best can be kept ##
+        self.update_best(subset + [int(free[0])], rss[0])
+        if len(subset) + 1 >= max_size:
+            return
+        floors = self.floors(a)
+        for i, j in enumerate(free[:-1]):
+            low = len(subset) + 2
+            high = min(len(subset) + 1 + len(free) - i - 1, max_size)
+            ## later children have fewer fields to add, so their floors
+            ## are no lower and they can reach no more sizes ##
+            if self.prunable(floors[i], low, high):
+                break
+            ## sweep the child's field in, keeping the fields after it ##
+            col = a[i + 1:, i]
+            self.branch(
+                a[i + 1:, i + 1:] - numpy.outer(col, col) / a[i, i],
+                subset + [int(j)], free[i + 1:], max_size
+            )
+
+def search_subsets(
+    train_gram, test_gram, fields, dependents,
+    methods=('forward', 'backward', 'exhaustive'), max_size=None
+):
+    '''
+    Runs each search method over a train gram for each dependent, and scores
+    the best subset each finds of every size on the test gram
+    Returns a list of results, one per method and subset
+    '''
+    k = len(fields)
+    max_size = k if max_size is None else max_size
+    records = []
+    for index, dependent in enumerate(dependents):
+        train = SubsetSearch(train_gram, k, index)
+        test = SubsetSearch(test_gram, k, index)
+        found = {}
+        if 'forward' in methods:
+            found['forward'] = train.forward(max_size)
+        if 'backward' in methods:
+            found['backward'] = [
+                (subset, rss) for subset, rss in train.backward()
+                if len(subset) <= max_size
+            ]
+        if 'exhaustive' in methods:
+            found['exhaustive'] = train.exhaustive(
+                max_size, incumbents=found.get('forward', []) + found.get('backward', [])
+            )
+        for method, path in found.items():
+            for subset, rss in path:
+                records.append({
+                    'dependent' : dependent,
+                    'method' : method,
+                    'features' : len(subset),
+                    'fields' : tuple(fields[j] for j in subset),
+                    'train_rsq' : train.rsq(rss),
+                    'test_rsq' : test.rsq(test.subset_rss(subset, train.betas(subset)))
+                })
+    return records
+
+def score_subsets(train_gram, test_gram, fields, dependents, subsets):
+    '''
+    Fits and scores given subsets, a dict of each dependent's field tuples
+    Returns a list of results, one per dependent and subset
+    '''
+    k = len(fields)
+    records = []
+    for index, dependent in enumerate(dependents):
+        train = SubsetSearch(train_gram, k, index)
+        test = SubsetSearch(test_gram, k, index)
+        for subset_fields in subsets.get(dependent, []):
+            subset = [fields.index(field) for field in subset_fields]
+            betas = train.betas(subset)
+            records.append({
+                'dependent' : dependent,
+                'features' : len(subset),
+                'fields' : tuple(subset_fields),
+                'train_rsq' : train.rsq(train.subset_rss(subset, betas)),
+                'test_rsq' : test.rsq(test.subset_rss(subset, betas))
+            })
+    return records
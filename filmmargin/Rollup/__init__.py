@@ -0,0 +1,2 @@
+from .rollup import TeamRollup, rollup_paths, rollup_columns
+from .rollup import margins_source, read_source, write_source
\ No newline at end of file
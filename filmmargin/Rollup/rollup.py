@@ -0,0 +1,382 @@
+import pandas as pd
+import numpy
+import hashlib
+import json
+import os
+import pathlib
+
+from ..DataLoader.gameindex import (
+    encode_teams, as_float, team_bits, week_bits, season_bits, season_base
+)
+from ..Writer import read_margins
+
+## margins averaged in each rollup ##
+rollup_columns = ('film_margin', 'film_margin_predictive', 'margin')
+
+def encode_rollup_keys(team, season, week):
+    '''
+    Packs teams, seasons, and weeks into int64 keys that sort by season,
+    team (alphabetically), then week. Keys are -1 for any row that can't be
+    packed (ie a missing team)
+    '''
+    season = as_float(season) - season_base
+    week = as_float(week)
+    team = encode_teams(team)
+    valid = (
+        (season >= 0) & (season < 2 ** season_bits) &
+        (week >= 0) & (week < 2 ** week_bits) &
+        (team >= 0)
+    )
+    ## team codes hold the first letter in the lowest bits, so the
+    ## letters are reversed for the keys to sort alphabetically ##
+    team = (
+        ((team & 31) << 10) |
+        (((team >> 5) & 31) << 5) |
+        ((team >> 10) & 31)
+    )
+    keys = (
+        (numpy.where(valid, season, 0).astype(numpy.int64) << (team_bits + week_bits)) |
+        (numpy.where(valid, team, 0) << week_bits) |
+        numpy.where(valid, week, 0).astype(numpy.int64)
+    )
+    return numpy.where(valid, keys, -1)
+
+def decode_teams(keys):
+    '''
+    Returns the team abbreviation of each rollup key
+    '''
+    codes, inverse = numpy.unique(
+        (keys >> week_bits) & (2 ** team_bits - 1), return_inverse=True
+    )
+    names = numpy.array([
+        ''.join(
+            chr(ord('A') - 1 + ((code >> shift) & 31))
+            for shift in [10, 5, 0] if (code >> shift) & 31
+        )
+        for code in codes.tolist()
+    ] + [''], dtype=object)
+    return names[inverse]
+
+def rollup_paths(path):
+    '''
+    Returns the paths of the team season and team week rollups written next
+    to a margins file, in the same format, and of the json noting which
+    margins file they were rolled up from
+    '''
+    path = pathlib.Path(path)
+    return {
+        'seasons' : path.with_name('{0}_team_seasons{1}'.format(path.stem, path.suffix)),
+        'weeks' : path.with_name('{0}_team_weeks{1}'.format(path.stem, path.suffix)),
+        'source' : path.with_name('{0}_rollup.json'.format(path.stem))
+    }
+
+def margins_source(path, rows):
+    '''
+    Returns the fingerprint (a hash of its contents) and row count of a
+    margins file, which a rollup is only refreshed against if it matches
+    '''
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(1024 ** 2), b''):
+            digest.update(block)
+    return {'fingerprint' : digest.hexdigest(), 'rows' : int(rows)}
+
+def read_source(path):
+    '''
+    Returns the margins source saved next to a rollup, or None if there
+    isn't one
+    '''
+    path = pathlib.Path(path)
+    if not path.exists():
+        return None
+    with open(path, 'r') as fp:
+        return json.load(fp)
+
+def write_source(path, source):
+    '''
+    Saves the source of a rollup, replacing the last one atomically
+    '''
+    path = pathlib.Path(path)
+    temp = path.with_name('.{0}.tmp'.format(path.name))
+    with open(temp, 'w') as fp:
+        json.dump(source, fp, indent=4)
+    os.replace(temp, path)
+
+
+class TeamRollup():
+    '''
+    Team season averages of the film margins, kept through every week the
+    team played so to date and leaderboard queries are a lookup rather than
+    a groupby over every margin row
+
+    Each row holds a team's cumulative games, sums, and non null counts of
+    each column through a week, and its average over its last form_games
+    games. Rows are compact arrays sorted by an int64 key of (season, team,
+    week), so a team's row through any week is one numpy.searchsorted and a
+    season's leaderboard is a contiguous slice
+
+    refresh() rebuilds only the team seasons of the rows passed to it from
+    the margins, splicing them in between the rows left as they are. The
+    rows are saved as a frame (to_frame() / from_frame()), which is how the
+    weeks sidecar file next to the margins is written and read back
+    '''
+    def __init__(self, columns=rollup_columns, form_games=4):
+        self.columns = list(columns)
+        self.form_games = form_games
+        self.keys = numpy.empty(0, dtype=numpy.int64)
+        self.games = numpy.empty(0, dtype=numpy.int32)
+        self.sums = numpy.empty((0, len(self.columns)), dtype=numpy.float64)
+        self.counts = numpy.empty((0, len(self.columns)), dtype=numpy.int32)
+        self.form = numpy.empty((0, len(self.columns)), dtype=numpy.float64)
+
+    @classmethod
+    def from_margins(cls, margins, columns=rollup_columns, form_games=4):
+        '''
+        Rolls up every team season of a margins frame
+        '''
+        rollup = cls(columns, form_games)
+        rollup.set_rows(*rollup.build(margins))
+        return rollup
+
+    @classmethod
+    def from_frame(cls, df, columns=rollup_columns, form_games=4):
+        '''
+        Rebuilds a rollup saved with to_frame(). Raises a ValueError if the
+        frame was rolled up with other columns or form_games
+        '''
+        rollup = cls(columns, form_games)
+        missing = [col for col in rollup.frame_columns() if col not in df.columns]
+        if len(missing) > 0:
+            raise ValueError('rollup is missing {0}'.format(', '.join(missing)))
+        keys = encode_rollup_keys(df['team'], df['season'], df['week'])
+        valid = keys >= 0
+        order = numpy.argsort(keys[valid], kind='stable')
+        df = df[valid].iloc[order]
+        rollup.set_rows(
+            keys[valid][order],
+            df['games'].to_numpy(dtype=numpy.int32),
+            df[['{0}_sum'.format(col) for col in rollup.columns]].to_numpy(
+                dtype=numpy.float64, na_value=numpy.nan
+            ),
+            df[['{0}_games'.format(col) for col in rollup.columns]].to_numpy(dtype=numpy.int32),
+            df[[rollup.form_column(col) for col in rollup.columns]].to_numpy(
+                dtype=numpy.float64, na_value=numpy.nan
+            )
+        )
+        return rollup
+
+    @classmethod
+    def read(cls, path, columns=rollup_columns, form_games=4):
+        '''
+        Reads a weeks rollup file written next to the margins
+        '''
+        return cls.from_frame(read_margins(path), columns, form_games)
+
+    def form_column(self, col):
+        '''
+        Returns the name of a column's average over the last form_games
+        '''
+        return '{0}_last_{1}'.format(col, self.form_games)
+
+    def frame_columns(self):
+        '''
+        Returns the columns of the rollup's frames
+        '''
+        columns = ['team', 'season', 'week', 'games']
+        for col in self.columns:
+            columns += [
+                '{0}_avg'.format(col), self.form_column(col),
+                '{0}_sum'.format(col), '{0}_games'.format(col)
+            ]
+        return columns
+
+    def set_rows(self, keys, games, sums, counts, form):
+        '''
+        Replaces the rows
+        '''
+        self.keys = keys
+        self.games = games
+        self.sums = sums
+        self.counts = counts
+        self.form = form
+
+    def build(self, margins):
+        '''
+        Returns the rows (keys, games, sums, counts, form) of the team seasons
+        in a margins frame, cumulated through each week
+        '''
+        keys = encode_rollup_keys(margins['team'], margins['season'], margins['week'])
+        values = margins[self.columns].to_numpy(dtype=numpy.float64, na_value=numpy.nan)
+        values = values[keys >= 0]
+        keys, inverse = numpy.unique(keys[keys >= 0], return_inverse=True)
+        n = len(keys)
+        ## games and margins of each week (a week can hold more than one
+        ## game), then sums through each row ##
+        present = ~numpy.isnan(values)
+        weekly = numpy.column_stack(
+            [numpy.bincount(inverse, minlength=n)] +
+            [
+                numpy.bincount(inverse, weights=present[:, index], minlength=n)
+                for index in range(0, len(self.columns))
+            ] +
+            [
+                numpy.bincount(
+                    inverse, weights=numpy.where(present[:, index], values[:, index], 0.0),
+                    minlength=n
+                )
+                for index in range(0, len(self.columns))
+            ]
+        ).astype(numpy.float64)
+        ## totals before each row ##
+        before = numpy.zeros((n + 1, weekly.shape[1]))
+        numpy.cumsum(weekly, axis=0, out=before[1:])
+        ## first row of each row's team season ##
+        segments = keys >> week_bits
+        first = numpy.ones(n, dtype=bool)
+        first[1:] = segments[1:] != segments[:-1]
+        first = numpy.maximum.accumulate(numpy.where(first, numpy.arange(0, n), 0))
+        rows = numpy.arange(1, n + 1)
+        totals = before[rows] - before[first]
+        recent = before[rows] - before[numpy.maximum(rows - self.form_games, first)]
+        c = len(self.columns)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            form = recent[:, 1 + c:] / recent[:, 1:1 + c]
+        return (
+            keys,
+            numpy.rint(totals[:, 0]).astype(numpy.int32),
+            totals[:, 1 + c:],
+            numpy.rint(totals[:, 1:1 + c]).astype(numpy.int32),
+            form
+        )
+
+    def refresh(self, margins, refreshed):
+        '''
+        Rebuilds the team seasons of the refreshed margin rows from every
+        margin row of those team seasons, and leaves the rest as they are
+        Returns the number of team seasons rebuilt
+        '''
+        affected = encode_rollup_keys(
+            refreshed['team'], refreshed['season'], numpy.zeros(len(refreshed))
+        )
+        affected = numpy.unique(affected[affected >= 0] >> week_bits)
+        if len(affected) == 0:
+            return 0
+        segments = encode_rollup_keys(
+            margins['team'], margins['season'], numpy.zeros(len(margins))
+        ) >> week_bits
+        rows = self.build(margins[numpy.isin(segments, affected)])
+        kept = ~numpy.isin(self.keys >> week_bits, affected)
+        ## both sets of keys are sorted, so the rebuilt rows are inserted
+        ## where they fall among the kept ones ##
+        positions = numpy.searchsorted(self.keys[kept], rows[0])
+        self.set_rows(*[
+            numpy.insert(current[kept], positions, new, axis=0)
+            for current, new in zip(
+                [self.keys, self.games, self.sums, self.counts, self.form], rows
+            )
+        ])
+        return len(affected)
+
+    def frame_values(self, rows=None):
+        '''
+        Returns the columns of the rows at the positions (default all) as
+        a dict of arrays
+        '''
+        rows = slice(None) if rows is None else rows
+        keys = self.keys[rows]
+        sums = self.sums[rows]
+        counts = self.counts[rows]
+        form = self.form[rows]
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            averages = sums / counts
+        columns = {
+            'team' : decode_teams(keys),
+            'season' : (keys >> (team_bits + week_bits)) + season_base,
+            'week' : keys & (2 ** week_bits - 1),
+            'games' : self.games[rows]
+        }
+        for index, col in enumerate(self.columns):
+            columns['{0}_avg'.format(col)] = averages[:, index]
+            columns[self.form_column(col)] = form[:, index]
+            columns['{0}_sum'.format(col)] = sums[:, index]
+            columns['{0}_games'.format(col)] = counts[:, index]
+        return columns
+
+    def to_frame(self, rows=None):
+        '''
+        Returns the rows at the positions (default all) as a frame
+        '''
+        return pd.DataFrame(self.frame_values(rows))
+
+    def through(self, segments, week=None):
+        '''
+        Returns the position of each team season's row through a week (the
+        last week if None), or -1 if it has no games by then
+        '''
+        segments = numpy.asarray(segments, dtype=numpy.int64)
+        if len(self.keys) == 0:
+            return numpy.full(len(segments), -1, dtype=numpy.int64)
+        week = 2 ** week_bits - 1 if week is None else min(max(int(week), 0), 2 ** week_bits - 1)
+        positions = numpy.searchsorted(
+            self.keys, (segments << week_bits) | week, side='right'
+        ) - 1
+        found = (positions >= 0) & (
+            self.keys[numpy.maximum(positions, 0)] >> week_bits == segments
+        )
+        return numpy.where(found, positions, -1)
+
+    def season_rows(self, season=None, week=None):
+        '''
+        Returns the positions of each team's row through a week (the last
+        week if None) of a season, or of every season
+        '''
+        if season is None:
+            lo, hi = 0, len(self.keys)
+        else:
+            start = (int(season) - season_base) << (team_bits + week_bits)
+            lo, hi = numpy.searchsorted(
+                self.keys, [start, start + (1 << (team_bits + week_bits))]
+            )
+        segments = self.keys[lo:hi] >> week_bits
+        first = numpy.ones(len(segments), dtype=bool)
+        first[1:] = segments[1:] != segments[:-1]
+        positions = self.through(segments[first], week)
+        return positions[positions >= 0]
+
+    def seasons(self):
+        '''
+        Returns every team season's row through its last week
+        '''
+        return self.to_frame(self.season_rows())
+
+    def team_season(self, team, season, week=None):
+        '''
+        Returns a team's row of a season through a week (the last week if
+        None) as a dict, or None if it has no games by then
+        '''
+        key = encode_rollup_keys([team], [season], [0])
+        if key[0] < 0:
+            return None
+        position = self.through(key >> week_bits, week)
+        if position[0] < 0:
+            return None
+        return self.to_frame(position).iloc[0].to_dict()
+
+    def leaderboard(self, season, week=None, by='film_margin_avg', ascending=False):
+        '''
+        Returns every team's row of a season through a week (the last week
+        if None), sorted by a column of the rows
+        '''
+        if by not in self.frame_columns():
+            raise ValueError('unknown column {0}'.format(by))
+        columns = self.frame_values(self.season_rows(season, week))
+        values = columns[by]
+        ## sorted here rather than in pandas, which costs more than the
+        ## lookup for a season's worth of rows ##
+        if by == 'team':
+            order = numpy.argsort(values, kind='stable')
+            order = order if ascending else order[::-1]
+        else:
+            order = numpy.argsort(values if ascending else -values, kind='stable')
+            order = order[numpy.argsort(numpy.isnan(values[order]), kind='stable')]
+        return pd.DataFrame({name : column[order] for name, column in columns.items()})
@@ -0,0 +1 @@
+from .scorer import Scorer
\ No newline at end of file
@@ -0,0 +1,86 @@
+import pandas as pd
+import numpy
+import json
+
+## margin column each config model is written to ##
+margin_columns = {
+    'descriptive' : 'film_margin',
+    'predictive' : 'film_margin_predictive',
+    'legacy' : 'film_margin_old_model'
+}
+
+class Scorer():
+    '''
+    Scores any number of linear models in a single matrix multiply
+
+    Models are dicts of field coefficients plus an intercept, as they are
+    stored in config.json. Every model's coefficients are compiled into
+    one (fields, models) matrix over the union of their fields, so scoring
+    is one product of a contiguous float block of those fields. A row
+    missing a field is NaN for each model that uses the field, and counts
+    of these rows are kept in missing after each score
+    '''
+    def __init__(self, models):
+        self.models = list(models.keys())
+        ## union of fields, in the order they appear ##
+        self.fields = list(dict.fromkeys(
+            field for coefs in models.values() for field in coefs
+            if field != 'intercept'
+        ))
+        self.coefs = numpy.zeros((len(self.fields), len(self.models)))
+        self.intercepts = numpy.zeros(len(self.models))
+        for model_index, model in enumerate(self.models):
+            for field, coef in models[model].items():
+                if field == 'intercept':
+                    self.intercepts[model_index] = coef
+                else:
+                    self.coefs[self.fields.index(field), model_index] = coef
+        ## which fields each model uses ##
+        self.uses = self.coefs != 0
+        self.missing = {}
+
+    @classmethod
+    def from_config(cls, config):
+        '''
+        Builds a scorer from every model in a config (a dict or a path
+        to the config file)
+        '''
+        if not isinstance(config, dict):
+            with open(config, 'r') as fp:
+                config = json.load(fp)
+        return cls({
+            model : coefs for model, coefs in config.items()
+            if isinstance(coefs, dict) and 'intercept' in coefs
+        })
+
+    def score(self, df):
+        '''
+        Returns an (rows, models) array of each model's margin
+        '''
+        x = df[self.fields].to_numpy(dtype=numpy.float64)
+        missing = numpy.isnan(x)
+        has_missing = missing.any()
+        if has_missing:
+            x = numpy.where(missing, 0, x)
+        margins = x @ self.coefs + self.intercepts
+        ## rows missing a field a model uses can't be scored by it ##
+        if has_missing:
+            unscored = (missing.astype(numpy.int64) @ self.uses) > 0
+            margins[unscored] = numpy.nan
+            self.missing = dict(zip(self.models, unscored.sum(axis=0).tolist()))
+        else:
+            self.missing = dict.fromkeys(self.models, 0)
+        return margins
+
+    def apply(self, df, columns=None):
+        '''
+        Adds each model's margin to df. Columns default to the margin
+        column of each config model, and to the model name otherwise
+        '''
+        columns = columns or {}
+        margins = self.score(df)
+        for model_index, model in enumerate(self.models):
+            df[columns.get(model, margin_columns.get(model, model))] = (
+                margins[:, model_index]
+            )
+        return df
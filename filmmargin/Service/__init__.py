@@ -0,0 +1 @@
+from .service import MarginService, MarginStore, LRUCache
\ No newline at end of file
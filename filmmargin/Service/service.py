@@ -0,0 +1,421 @@
+import pandas as pd
+import numpy
+import json
+import os
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl
+
+from ..Scorer import Scorer
+from ..Scorer.scorer import margin_columns
+from ..Rollup import TeamRollup, rollup_columns
+from ..Profiler import logger
+
+## columns of each margin row, ahead of the margins of each model ##
+meta_columns = ['game_id', 'season', 'week', 'team', 'opponent', 'pf', 'pa', 'margin']
+
+class LRUCache():
+    '''
+    Thread safe cache of the most recently used responses, holding at
+    most max_size of them
+    '''
+    def __init__(self, max_size=4096):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''
+        Returns a cached value, or None if it isn't cached
+        '''
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key, value):
+        '''
+        Caches a value, evicting the least recently used past max_size
+        '''
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self):
+        '''
+        Returns the size, hits and misses of the cache
+        '''
+        with self.lock:
+            return {
+                'size' : len(self.entries),
+                'hits' : self.hits,
+                'misses' : self.misses
+            }
+
+
+class MarginStore():
+    '''
+    Film margins of the flat game grades scored with one config, with the
+    rows of each game and of each team's season indexed up front so queries
+    are a dict lookup and a slice, and the margins rolled up by team season
+    through each week (see TeamRollup) for the leaderboards. Each store has
+    its own response cache, so swapping in a store scored with a new config
+    drops every cached response along with the old margins
+    '''
+    def __init__(self, df, scorer, cache_size=4096):
+        self.scorer = scorer
+        self.columns = [
+            margin_columns.get(model, model) for model in scorer.models
+        ]
+        frame = df[[col for col in meta_columns if col in df.columns]].copy()
+        if 'margin' not in frame.columns:
+            frame['margin'] = frame['pf'] - frame['pa']
+        margins = scorer.score(df)
+        for index, col in enumerate(self.columns):
+            frame[col] = margins[:, index]
+        self.frame = frame.reset_index(drop=True)
+        ## ids are matched as text, since they arrive in a url ##
+        self.games = self.frame.groupby(
+            self.frame['game_id'].astype(str), sort=False
+        ).indices
+        self.team_seasons = {
+            (str(team), int(season)) : rows for (team, season), rows in
+            self.frame.groupby(['team', 'season'], observed=True, sort=False).indices.items()
+        }
+        self.rollup = TeamRollup.from_margins(
+            self.frame, columns=[col for col in rollup_columns if col in self.frame.columns]
+        )
+        self.cache = LRUCache(cache_size)
+
+    def records(self, rows):
+        '''
+        Returns json of the margin rows at the positions
+        '''
+        return self.frame.iloc[rows].to_json(orient='records').encode('utf-8')
+
+    def game(self, game_id):
+        '''
+        Returns json of both teams' rows of a game, or None if there
+        is no such game
+        '''
+        rows = self.games.get(str(game_id))
+        return None if rows is None else self.records(rows)
+
+    def team_season(self, team, season):
+        '''
+        Returns json of a team's rows of a season by week, or None if
+        the team has none
+        '''
+        rows = self.team_seasons.get((str(team), int(season)))
+        if rows is None:
+            return None
+        return self.records(rows[numpy.argsort(
+            self.frame['week'].to_numpy()[rows], kind='stable'
+        )])
+
+    def team_rollup(self, team, season, week=None):
+        '''
+        Returns json of a team's season averages through a week (the last
+        week if None), or None if it has no games by then
+        '''
+        row = self.rollup.team_season(team, season, week)
+        return None if row is None else pd.Series(row).to_json().encode('utf-8')
+
+    def leaderboard(self, season, week=None, by=None):
+        '''
+        Returns json of every team's season averages through a week (the
+        last week if None) sorted by a column, or None if the season has
+        no games by then
+        '''
+        df = self.rollup.leaderboard(
+            season, week, by or '{0}_avg'.format(self.rollup.columns[0])
+        )
+        if len(df) == 0:
+            return None
+        return df.to_json(orient='records').encode('utf-8')
+
+    def score(self, grades):
+        '''
+        Returns json of the margins of raw grade records. Fields a record
+        leaves out, or that aren't numbers, are treated as missing
+        '''
+        if isinstance(grades, dict):
+            grades = [grades]
+        if not isinstance(grades, list) or not all(isinstance(record, dict) for record in grades):
+            raise ValueError('grades must be a record or a list of records')
+        ## payloads are a few rows, so they skip building a frame per field ##
+        x = numpy.full((len(grades), len(self.scorer.fields)), numpy.nan)
+        for row, record in enumerate(grades):
+            for col, field in enumerate(self.scorer.fields):
+                try:
+                    x[row, col] = float(record[field])
+                except (KeyError, TypeError, ValueError):
+                    pass
+        margins = self.scorer.score(pd.DataFrame(x, columns=self.scorer.fields, copy=False))
+        return json.dumps([
+            {
+                col : None if numpy.isnan(margin) else float(margin)
+                for col, margin in zip(self.columns, row)
+            }
+            for row in margins.tolist()
+        ]).encode('utf-8')
+
+    def keys(self):
+        '''
+        Returns json of every game_id and (team, season) in the store
+        '''
+        return json.dumps({
+            'game_ids' : list(self.games.keys()),
+            'team_seasons' : [list(key) for key in self.team_seasons.keys()]
+        }).encode('utf-8')
+
+
+class MarginService():
+    '''
+    Long running local HTTP service that answers film margin queries from
+    memory. The flat game grades are passed in once and the config's models
+    are compiled into a Scorer, so no query reloads the config or the data
+
+    GET /margins?game_id=... -- both teams' rows of a game
+    GET /margins?team=KC&season=2023 -- a team's rows of a season, by week
+    GET /rollup?team=KC&season=2023[&week=8] -- a team's season averages
+    GET /leaderboard?season=2023[&week=8][&by=margin_avg] -- every team, ranked
+    POST /score -- margins of a json grade record, or a list of them
+    GET /keys -- every game_id and (team, season) that can be queried
+    GET /health -- rows, models, fields, config, and cache stats
+
+    Responses are json, and repeat queries are answered from an LRU cache of
+    cache_size responses. config.json is checked for changes every
+    reload_interval seconds, and when it changes every margin is rescored
+    and the cache is dropped. A config that fails to load is logged and the
+    current models are kept
+
+    Use as a context manager, call start() and stop(), or serve_forever()
+    '''
+    def __init__(
+        self, df, config_path, host='127.0.0.1', port=8000,
+        cache_size=4096, reload_interval=1.0
+    ):
+        self.df = df
+        self.config_path = config_path
+        self.cache_size = cache_size
+        self.reload_interval = reload_interval
+        self.config_mtime = None
+        self.store = None
+        self.reloads = 0
+        self.load_config()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.server.daemon_threads = True
+        self.stopped = threading.Event()
+        self.threads = []
+
+    @property
+    def url(self):
+        '''
+        Base url of the service
+        '''
+        host, port = self.server.server_address[:2]
+        return 'http://{0}:{1}'.format(host, port)
+
+    def load_config(self):
+        '''
+        Scores the margins with the config's models and swaps them in
+        '''
+        mtime = os.stat(self.config_path).st_mtime_ns
+        with open(self.config_path, 'r') as fp:
+            config = json.load(fp)
+        store = MarginStore(self.df, Scorer.from_config(config), self.cache_size)
+        ## a single assignment, so queries see the old or new store ##
+        self.store = store
+        self.config_mtime = mtime
+        self.reloads += 1
+        logger.info('     Loaded {0} models for {1} rows'.format(
+            len(store.scorer.models), len(store.frame)
+        ))
+
+    def check_config(self):
+        '''
+        Reloads the config if it changed since it was loaded
+        '''
+        try:
+            mtime = os.stat(self.config_path).st_mtime_ns
+        except OSError:
+            return
+        if mtime == self.config_mtime:
+            return
+        try:
+            self.load_config()
+        except Exception as e:
+            logger.warning('     Warning - could not reload {0} ({1}). Keeping the current models'.format(
+                self.config_path, e
+            ))
+            ## don't retry until the file changes again ##
+            self.config_mtime = mtime
+
+    def watch(self):
+        '''
+        Checks the config for changes until the service stops
+        '''
+        while not self.stopped.wait(self.reload_interval):
+            self.check_config()
+
+    def start(self):
+        '''
+        Serves requests and watches the config from background threads
+        '''
+        self.threads = [
+            threading.Thread(target=self.server.serve_forever, daemon=True),
+            threading.Thread(target=self.watch, daemon=True)
+        ]
+        for thread in self.threads:
+            thread.start()
+        return self
+
+    def serve_forever(self):
+        '''
+        Serves requests from this thread until interrupted
+        '''
+        watcher = threading.Thread(target=self.watch, daemon=True)
+        watcher.start()
+        logger.info('     Serving film margins on {0}'.format(self.url))
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.stopped.set()
+            self.server.server_close()
+
+    def stop(self):
+        '''
+        Shuts the service down
+        '''
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def health(self, store):
+        '''
+        Returns json of the state of the service
+        '''
+        return json.dumps({
+            'rows' : len(store.frame),
+            'models' : store.scorer.models,
+            'fields' : store.scorer.fields,
+            'config' : str(self.config_path),
+            'reloads' : self.reloads,
+            'cache' : store.cache.stats()
+        }).encode('utf-8')
+
+    def query(self, store, path, params, body=None):
+        '''
+        Answers a request, returning a status and json body
+        '''
+        if path == '/margins':
+            if 'game_id' in params:
+                key = ('game', params['game_id'])
+                get = lambda: store.game(params['game_id'])
+            elif 'team' in params and 'season' in params:
+                try:
+                    season = int(params['season'])
+                except ValueError:
+                    return 400, {'error' : 'season must be a year'}
+                key = ('team', params['team'], season)
+                get = lambda: store.team_season(params['team'], season)
+            else:
+                return 400, {'error' : 'pass a game_id, or a team and season'}
+        elif path in ['/rollup', '/leaderboard']:
+            try:
+                season = int(params['season'])
+                week = int(params['week']) if 'week' in params else None
+            except KeyError:
+                return 400, {'error' : 'pass a season'}
+            except ValueError:
+                return 400, {'error' : 'season and week must be numbers'}
+            if path == '/rollup':
+                if 'team' not in params:
+                    return 400, {'error' : 'pass a team and season'}
+                key = ('rollup', params['team'], season, week)
+                get = lambda: store.team_rollup(params['team'], season, week)
+            else:
+                key = ('leaderboard', season, week, params.get('by'))
+                get = lambda: store.leaderboard(season, week, params.get('by'))
+        elif path == '/score':
+            if body is None:
+                return 405, {'error' : 'POST grade records to /score'}
+            key = ('score', body)
+            def get():
+                try:
+                    return store.score(json.loads(body))
+                except ValueError as e:
+                    raise ValueError('invalid grades ({0})'.format(e))
+        elif path == '/keys':
+            key = ('keys',)
+            get = store.keys
+        elif path == '/health':
+            return 200, self.health(store)
+        else:
+            return 404, {'error' : 'unknown path {0}'.format(path)}
+        payload = store.cache.get(key)
+        if payload is None:
+            try:
+                payload = get()
+            except ValueError as e:
+                return 400, {'error' : str(e)}
+            if payload is None:
+                return 404, {'error' : 'no margins found'}
+            store.cache.put(key, payload)
+        return 200, payload
+
+    def handler(self):
+        '''
+        Builds the request handler class bound to this service
+        '''
+        service = self
+        class Handler(BaseHTTPRequestHandler):
+            ## keep connections open between requests, and send each
+            ## response as soon as it's written rather than waiting on
+            ## the client's ack of the headers ##
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def respond(self, body=None):
+                parsed = urlparse(self.path)
+                status, payload = service.query(
+                    service.store, parsed.path.rstrip('/'),
+                    dict(parse_qsl(parsed.query)), body
+                )
+                if isinstance(payload, dict):
+                    payload = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def do_GET(self):
+                self.respond()
+
+            def do_POST(self):
+                length = int(self.headers.get('Content-Length', 0))
+                self.respond(self.rfile.read(length))
+        return Handler
@@ -1,65 +1,227 @@
 import pandas as pd
-from supabase import create_client
+import logging
+import threading
+import time
+
+from ..Profiler import profiler, logger
+
+## suppress logging of each request ##
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+def map_in_daemons(func, items, workers):
+    '''
+    Returns func of each item, called across up to workers daemon threads,
+    so requests still running when the interpreter exits (ie after the
+    caller timed out) don't hold it open. The first failure stops the
+    workers and is raised. Their stages are profiled under the caller's
+    current stage
+    '''
+    results = [None] * len(items)
+    errors = []
+    positions = iter(range(0, len(items)))
+    lock = threading.Lock()
+    parent = profiler.current()
+    def work():
+        while len(errors) == 0:
+            with lock:
+                index = next(positions, None)
+            if index is None:
+                return
+            try:
+                with profiler.within(parent):
+                    results[index] = func(items[index])
+            except BaseException as e:
+                errors.append(e)
+    threads = [
+        threading.Thread(target=work, daemon=True)
+        for _ in range(0, max(1, min(workers, len(items))))
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if len(errors) > 0:
+        raise errors[0]
+    return results
 
 class SupabaseClient():
     '''
     wrapper for supabase client that downloads the table
+
+    Pages are requested concurrently over a bounded set of daemon threads
+    (workers=1 fetches them one after another). Passing keyset=True
+    pages by (unique) game_id instead of offset, which is stable if rows
+    are written during the download, but has to request pages in order
     '''
-    def __init__(self, url, key, table):
+    def __init__(
+        self, url, key, table, page_size=1000, workers=4,
+        retries=3, backoff=0.5, keyset=False
+    ):
+        ## the supabase client is slow to import, so only load it when used ##
+        from supabase import create_client
         self.client = create_client(
             url, key
         ).table(table)
+        self.page_size = page_size
+        self.workers = workers
+        self.retries = retries
+        self.backoff = backoff
+        self.keyset = keyset
         self.data = None
-    
-    def get_table_count(self):
+
+    def apply_since(self, query, since):
+        '''
+        Limits a query to rows on or after a (season, week)
+        '''
+        if since is None:
+            return query
+        season, week = since
+        return query.or_(
+            'season.gt.{0},and(season.eq.{0},week.gte.{1})'.format(
+                int(season), int(week)
+            )
+        )
+
+    def with_retries(self, func, *args):
+        '''
+        Calls a request function, retrying failures with exponential backoff
+        '''
+        for attempt in range(0, self.retries + 1):
+            try:
+                return func(*args)
+            except Exception as e:
+                if attempt == self.retries:
+                    raise
+                logger.warning('     Warning - request failed ({0}). Retrying...'.format(e))
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def get_table_count(self, since=None):
         '''
         Gets the number of rows in the table, which is necessary for
-        pagination
+        pagination. This is a HEAD request, so no rows are returned
         '''
-        resp = self.client.select(
-            '*', count="exact"
-        ).execute()
+        resp = self.apply_since(self.client.select(
+            'game_id', count="exact", head=True
+        ), since).execute()
         ## return ##
         return resp.count
-    
-    def offset_req(self, start, end):
+
+    def get_max_game_id(self):
+        '''
+        Gets the largest game_id in the table
+        '''
+        resp = self.client.select('game_id').order(
+            'game_id', desc=True
+        ).limit(1).execute()
+        ## return ##
+        return resp.data[0]['game_id'] if len(resp.data) > 0 else None
+
+    def get_fingerprint(self):
+        '''
+        Returns a fingerprint of the table's contents from its row count and
+        largest game_id, which changes when games are added or removed
+        '''
+        return '{0}-{1}'.format(
+            self.with_retries(self.get_table_count),
+            self.with_retries(self.get_max_game_id)
+        )
+
+    def offset_req(self, start, end, since=None):
         '''
         Makes and offset request of the table with a start and finish
         for pagination
-        Ranges are 0 indexed and inclusive on start, but not end
+        Ranges are 0 indexed and inclusive on start and end
+        '''
+        resp = self.apply_since(
+            self.client.select('*'), since
+        ).order('game_id').range(start, end).execute()
+        ## return ##
+        return resp.data
+
+    def keyset_req(self, after, since=None):
         '''
-        resp = self.client.select('*').range(start, end).execute()
+        Requests the next page of rows with a game_id after the last one
+        received
+        '''
+        query = self.apply_since(self.client.select('*'), since)
+        if after is not None:
+            query = query.gt('game_id', after)
+        resp = query.order('game_id').limit(self.page_size).execute()
         ## return ##
         return resp.data
-    
-    def get_data(self):
+
+    def add_page(self, columns, data):
+        '''
+        Appends a page of rows to a dict of column lists
+        '''
+        for col in data[0].keys():
+            columns.setdefault(col, []).extend(row[col] for row in data)
+
+    def get_offset_page(self, start, end, since=None):
+        '''
+        Requests an offset page, following up if the server caps
+        the rows it returns below the page size
+        '''
+        data = []
+        with profiler.stage('supabase_page', start=start, end=end):
+            while start <= end:
+                page = self.with_retries(self.offset_req, start, end, since)
+                if len(page) == 0:
+                    break
+                data.extend(page)
+                start += len(page)
+        return data
+
+    def get_offset_pages(self, rows, since=None):
+        '''
+        Requests every offset page of the table across the worker threads
+        and returns them in order
+        '''
+        ranges = [
+            (start, min(start + self.page_size, rows) - 1)
+            for start in range(0, rows, self.page_size)
+        ]
+        return map_in_daemons(
+            lambda bounds: self.get_offset_page(bounds[0], bounds[1], since),
+            ranges, self.workers
+        )
+
+    def get_keyset_pages(self, since=None, after=None):
+        '''
+        Requests pages of the table by game_id until one comes back empty
+        Passing after only requests rows with a larger game_id
+        '''
+        pages = []
+        while True:
+            with profiler.stage('supabase_page', after=after):
+                data = self.with_retries(self.keyset_req, after, since)
+            if len(data) == 0:
+                return pages
+            pages.append(data)
+            after = data[-1]['game_id']
+
+    @profiler.timed('supabase_fetch')
+    def get_data(self, since=None, after=None):
         '''
         Returns the table using pagination
+        Passing since=(season, week) only returns rows from that week on,
+        and passing after only returns rows with a larger game_id
         '''
-        ## container of processed rows ##
-        dfs = []
-        ## counter ##
-        processed_rows = 0
         ## get row count ##
-        rows = self.get_table_count()
-        ## paginate ##
-        while processed_rows < rows:
-            ## set range start ##
-            index_start = processed_rows ## note, b/c it is zero indexed, its not +1
-            ## get end range ##
-            index_end = (
-                index_start + 1000 
-                if index_start + 1000 < rows
-                else rows
-            )
-            ## get data ##
-            data = self.offset_req(index_start, index_end)
-            ## append to frames ##
-            dfs.append(pd.DataFrame(data))
-            ## update processed rows ##
-            processed_rows += len(data)
-        ## combine ##
-        df = pd.concat(dfs)
+        if self.keyset or after is not None:
+            pages = self.get_keyset_pages(since, after)
+        else:
+            rows = self.with_retries(self.get_table_count, since)
+            pages = self.get_offset_pages(rows, since)
+        ## build columns from the pages ##
+        columns = {}
+        for data in pages:
+            if len(data) > 0:
+                self.add_page(columns, data)
+        if len(columns) == 0:
+            self.data = pd.DataFrame()
+            return self.data
+        df = pd.DataFrame(columns)
         ## store
         self.data = df.sort_values(
             by=['game_id'],
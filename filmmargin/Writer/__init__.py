@@ -0,0 +1 @@
+from .writer import MarginWriter, read_margins
\ No newline at end of file
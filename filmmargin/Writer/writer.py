@@ -0,0 +1,129 @@
+import pandas as pd
+import os
+import pathlib
+
+## file extensions of each output format ##
+format_extensions = {
+    'csv' : '.csv',
+    'parquet' : '.parquet',
+    'arrow' : '.arrow'
+}
+
+def infer_format(path):
+    '''
+    Determines the output format of a path from its extension
+    '''
+    suffix = pathlib.Path(str(path)).suffix.lower()
+    if suffix in ['.parquet', '.pq']:
+        return 'parquet'
+    if suffix in ['.arrow', '.feather', '.ipc']:
+        return 'arrow'
+    return 'csv'
+
+def read_margins(path):
+    '''
+    Reads a margins file written in any output format. Older csvs were
+    written with the index as their first column, which is dropped
+    '''
+    format = infer_format(path)
+    if format == 'parquet':
+        return pd.read_parquet(path)
+    if format == 'arrow':
+        return pd.read_feather(path)
+    df = pd.read_csv(path)
+    if len(df.columns) > 0 and df.columns[0].startswith('Unnamed'):
+        df = df.drop(columns=[df.columns[0]])
+    return df
+
+class MarginWriter():
+    '''
+    Streams frames to a csv, parquet, or arrow (IPC) file in chunks
+
+    Rows are written to a temp file next to the path, which replaces the
+    path only once every chunk is written, so readers never see a partial
+    file. CSVs are written without the index and with floats rounded to
+    float_precision decimals. Parquet and arrow files are compressed
+    '''
+    def __init__(
+        self, path, format=None, chunk_size=50000, float_precision=4,
+        compression='zstd'
+    ):
+        self.path = pathlib.Path(path)
+        self.format = format or infer_format(path)
+        if self.format not in format_extensions:
+            raise ValueError('Unknown output format: {0}'.format(self.format))
+        self.chunk_size = chunk_size
+        self.float_precision = float_precision
+        self.compression = compression
+
+    def write(self, df):
+        '''
+        Writes a frame in chunks and returns the rows written
+        '''
+        return self.write_chunks(
+            df.iloc[start:start + self.chunk_size]
+            for start in range(0, max(len(df), 1), self.chunk_size)
+        )
+
+    def write_chunks(self, chunks):
+        '''
+        Writes an iterable of frames to the file and returns the rows written
+        '''
+        temp = self.path.with_name('.{0}.tmp'.format(self.path.name))
+        try:
+            if self.format == 'csv':
+                rows = self.write_csv(temp, chunks)
+            else:
+                rows = self.write_arrow(temp, chunks)
+            os.replace(temp, self.path)
+        finally:
+            if temp.exists():
+                temp.unlink()
+        return rows
+
+    def write_csv(self, path, chunks):
+        '''
+        Writes chunks to a csv
+        '''
+        rows = 0
+        with open(path, 'w', newline='') as fp:
+            for index, chunk in enumerate(chunks):
+                chunk.to_csv(
+                    fp,
+                    header=index == 0,
+                    index=False,
+                    float_format='%.{0}f'.format(self.float_precision)
+                )
+                rows += len(chunk)
+        return rows
+
+    def write_arrow(self, path, chunks):
+        '''
+        Writes chunks to a parquet or arrow file
+        '''
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet as pq
+        rows = 0
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pyarrow.Table.from_pandas(chunk, preserve_index=False)
+                if writer is None:
+                    if self.format == 'parquet':
+                        writer = pq.ParquetWriter(
+                            path, table.schema, compression=self.compression
+                        )
+                    else:
+                        writer = pyarrow.ipc.new_file(
+                            str(path), table.schema,
+                            options=pyarrow.ipc.IpcWriteOptions(
+                                compression=self.compression
+                            )
+                        )
+                writer.write_table(table)
+                rows += len(chunk)
+        finally:
+            if writer is not None:
+                writer.close()
+        return rows
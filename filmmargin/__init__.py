@@ -1,2 +1,55 @@
-from .development import *
-from .filmmargin import *
\ No newline at end of file
+import importlib
+
+## public names of each module. They are imported on first use, so a
+## cold start only pays for the dependencies it touches ##
+lazy_exports = {
+    ## margins ##
+    'update_margins' : '.filmmargin',
+    'calc_margins' : '.filmmargin',
+    'get_refresh_week' : '.filmmargin',
+    'upsert_margins' : '.filmmargin',
+    'output_columns' : '.filmmargin',
+    'update_rollup' : '.filmmargin',
+    ## scoring ##
+    'load_scorer' : '.scoring',
+    'grade_format' : '.scoring',
+    'iter_grade_chunks' : '.scoring',
+    'iter_scores' : '.scoring',
+    'score_grades' : '.scoring',
+    ## development ##
+    'run_development_regressions' : '.development',
+    'run_development_round' : '.development',
+    'run_shared_round' : '.development',
+    'run_feature_search' : '.development',
+    'pareto_front' : '.development',
+    'run_backtest' : '.development',
+    'update_model' : '.development',
+    'share_frame' : '.development',
+    'attach_frame' : '.development',
+    'NpEncoder' : '.development',
+    ## serving ##
+    'serve_margins' : '.serving',
+    ## classes ##
+    'MarginWriter' : '.Writer',
+    'read_margins' : '.Writer',
+    'Regression' : '.Regression',
+    'SplitGenerator' : '.Regression',
+    'WalkForward' : '.Regression',
+    'RegularizationPath' : '.Regression',
+    'ResultStore' : '.Regression',
+    'MarginService' : '.Service',
+    'TeamRollup' : '.Rollup',
+    'rollup_paths' : '.Rollup',
+    'load_credentials' : '.DataLoader',
+    'profiler' : '.Profiler',
+}
+
+def __getattr__(name):
+    if name not in lazy_exports:
+        raise AttributeError('module {0!r} has no attribute {1!r}'.format(__name__, name))
+    value = getattr(importlib.import_module(lazy_exports[name], __name__), name)
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(list(globals()) + list(lazy_exports))
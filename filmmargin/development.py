@@ -2,11 +2,16 @@ import pandas as pd
 import numpy
 import json
 import pathlib
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from multiprocessing import shared_memory
 
-from .DataLoader import DataLoader
-from .Regression import Regression
-
-import os
+from .DataLoader import DataLoader, load_credentials
+from .Regression import (
+    Regression, SplitGenerator, WalkForward, FieldMatrix, ResultStore,
+    search_subsets, score_subsets, bootstrap_regression
+)
+from .Profiler import profiler, logger
 
 ## for saving json, need to convert numpy dtypes ##
 class NpEncoder(json.JSONEncoder):
@@ -19,15 +24,138 @@ class NpEncoder(json.JSONEncoder):
             return obj.tolist()
         return super(NpEncoder, self).default(obj)
 
-def run_development_regressions(total_rounds=1000):
+## fields used in each model ##
+descriptive_fields = [
+    'overall_grade', 'opponent_overall_grade'
+]
+predictive_fields = [
+    'overall_grade', 'opponent_overall_grade',
+    'pass_grade', 'run_defense_grade'
+]
+
+## frame each worker process attaches to when running rounds in parallel ##
+worker_state = {}
+
+def share_frame(df, columns):
+    '''
+    Copies columns of a df into a float block in shared memory so worker
+    processes can attach to it once instead of being sent a pickled frame.
+    Text columns (ie team) are factorized into codes, which keeps the order
+    of windowing groups, and therefore the group masks, the same. Missing
+    text stays missing, so those rows are in no group here either
+    Returns the shared memory and the args to rebuild the frame from it
+    '''
+    shm = shared_memory.SharedMemory(
+        create=True, size=max(1, len(df) * len(columns) * 8)
+    )
+    block = numpy.ndarray(
+        (len(df), len(columns)), dtype=numpy.float64, buffer=shm.buf
+    )
+    for index, column in enumerate(columns):
+        values = df[column]
+        if not pd.api.types.is_numeric_dtype(values):
+            codes = pd.factorize(values)[0]
+            values = numpy.where(codes >= 0, codes, numpy.nan)
+        block[:, index] = numpy.asarray(values, dtype=numpy.float64)
+    return shm, (shm.name, block.shape, columns)
+
+def attach_frame(shm_name, shape, columns):
+    '''
+    Process pool initializer that rebuilds the shared frame in a worker
+    '''
+    shm = shared_memory.SharedMemory(name=shm_name)
+    block = numpy.ndarray(shape, dtype=numpy.float64, buffer=shm.buf)
+    ## hold the shm so the buffer outlives the initializer ##
+    worker_state['shm'] = shm
+    worker_state['df'] = pd.DataFrame(block, columns=columns, copy=False)
+    worker_state['matrix'] = FieldMatrix(worker_state['df'])
+    worker_state['splits'] = SplitGenerator(
+        worker_state['df'], ['season', 'team']
+    )
+
+def run_development_round(
+    df, round_num, train_mask, fields, backend, matrix=None,
+    dependents=('margin', 'seasonal_margin'), regularization=(),
+    penalties=None, l1_ratio=0.5
+):
+    '''
+    Runs every leave one out regression for a single round on its own
+    train/test split, gathering its rows from matrix when passed. Returns
+    the round number, the train and test rsq (fields, dependents) of the
+    leave one out models, and the (features, train rsq, test rsq) of each
+    method in regularization over its penalties (see ResultStore.add)
+    '''
+    dependents = list(dependents)
+    ## init the regression ##
+    ## do this upfront so each model within the round receives
+    ## the same train/test split, which happens on init ##
+    reg = Regression(
+        df=df,
+        fields=fields,
+        dependent=dependents[0],
+        windowing_fields=['season', 'team'],
+        backend=backend,
+        train_mask=train_mask,
+        matrix=matrix
+    )
+    ## train and score every leave one out model for each prediction type ##
+    train_rsq, test_rsq = reg.leave_one_out_rsq(dependents)
+    paths = {}
+    if len(regularization) > 0:
+        paths = {
+            method : (features, path_train, path_test)
+            for method, (grid, features, path_train, path_test) in reg.path_rsq(
+                dependents, regularization, penalties, l1_ratio
+            ).items()
+        }
+    return round_num, train_rsq, test_rsq, paths
+
+def run_shared_round(
+    round_num, group_mask, fields, backend, dependents=('margin', 'seasonal_margin'),
+    regularization=(), penalties=None, l1_ratio=0.5
+):
+    '''
+    Runs a round in a worker process against the shared frame
+    '''
+    return run_development_round(
+        worker_state['df'], round_num,
+        worker_state['splits'].row_mask(group_mask), fields, backend,
+        worker_state['matrix'], dependents, regularization, penalties, l1_ratio
+    )
+
+@profiler.run('run_development_regressions')
+def run_development_regressions(
+    total_rounds=1000, backend='numpy', workers=1, seed=None,
+    dependents=('margin', 'seasonal_margin'), regularization=(), l1_ratio=0.5,
+    checkpoint=None
+):
     '''
     Cycles through different variables and calcs efficacy for the model
+    backend='statsmodels' refits every model with sm.OLS as a reference
+    dependents can include targets built by the DataLoader (ie
+    margin_season_others, margin_next_3)
+
+    Passing regularization methods (ridge, lasso, elastic_net) also fits
+    every field over a grid of penalties on each round's split, from the
+    cross products the leave one out sweep already built. Each method's grid
+    is drawn once from every row, so rounds line up, and the path averaged
+    over the rounds is returned after the leave one out results, with the
+    penalty that cross validates best selected
+
+    Every round's split is drawn upfront from the master seed, so a given
+    seed returns the same results regardless of how many workers are used.
+    With workers > 1, rounds are spread over a process pool that reads the
+    data from shared memory, and only the pool as a whole is timed
+
+    Each round's results are written into a ResultStore preallocated for
+    every round. Passing a checkpoint directory streams them to disk there,
+    and rerunning with the same directory and setup resumes from the rounds
+    that weren't finished. Without a seed, a checkpointed run draws one and
+    saves it, so a resumed run redraws the same splits
     '''
-    records = []
+    dependents = list(dependents)
     ## env vars
-    url = os.getenv('SUPABASE_URL')
-    key = os.getenv('SUPABASE_KEY')
-    table = os.getenv('SUPABASE_TABLE')
+    url, key, table = load_credentials()
     ## fields to test ##
     fields = [
         ## overall
@@ -44,75 +172,249 @@ def run_development_regressions(total_rounds=1000):
         'opponent_overall_grade', 'opponent_offense_grade',
         'opponent_pass_grade', 'opponent_coverage_defense_grade'
     ]
-    print('     Loading data...')
-    data = DataLoader(url, key, table)
-    print('     Running {0} rounds of regressions over {1} feilds...'.format(
+    logger.info('     Loading data...')
+    with profiler.stage('load_data'):
+        data = DataLoader(url, key, table, targets=dependents)
+    logger.info('     Running {0} rounds of regressions over {1} feilds...'.format(
         total_rounds, len(fields)
     ))
-    for round_num in range(0,total_rounds):
-        if round(round_num/50,0) == round_num/50:
-            print('          On round {0}'.format(round_num))
-        ## init the regression ##
-        ## do this upfront so each iterations within the round receives
-        ## the same train/test split, which happens on init ##
-        reg = Regression(
+    if checkpoint is not None and seed is None:
+        saved = ResultStore.read_meta(checkpoint)
+        seed = (
+            saved['seed'] if saved is not None else
+            int(numpy.random.default_rng().integers(0, 2 ** 63))
+        )
+    ## draw every round's split of season/team groups at once ##
+    splits = SplitGenerator(data.flat_game_grades, ['season', 'team'])
+    group_masks = splits.masks(total_rounds, seed)
+    penalties = None
+    if len(regularization) > 0:
+        penalties = Regression(
             df=data.flat_game_grades,
             fields=fields,
-            dependent='margin',
-            windowing_fields=['season', 'team']
-        )
-        ## prediction type ##
-        for prediction_type in ['margin', 'seasonal_margin']:
-            ## update the reg ##
-            reg.dependent = prediction_type
-            ## cycle through fields ##
-            for index, field in enumerate(fields):
-                ## drop from set to see impact ##
-                fields_ = fields.copy()
-                fields_.pop(index)
-                reg.fields = fields_
-                ## train, score, and append results ##
-                reg.train()
-                reg.score()
-                results = reg.results.copy()
-                ## create meta data about the run ##
-                meta = {
-                    'run_group' : round_num + 1,
-                    'dependent' : prediction_type,
-                    'field_left_out' : field
-                }
-                records.append(meta | results)
+            dependent=dependents[0],
+            windowing_fields=['season', 'team'],
+            train_mask=splits.grouped,
+            matrix=data.field_matrix
+        ).penalty_grids(dependents, regularization, l1_ratio)
+    store = ResultStore(
+        total_rounds, dependents, fields, regularization, penalties,
+        directory=checkpoint, meta={
+            'seed' : seed,
+            'backend' : backend,
+            'l1_ratio' : l1_ratio,
+            'rows' : len(data.flat_game_grades)
+        }
+    )
+    pending = store.pending()
+    if len(pending) < total_rounds:
+        logger.info('     Resuming with {0} of {1} rounds done...'.format(
+            total_rounds - len(pending), total_rounds
+        ))
+    try:
+        if workers > 1 and len(pending) > 0:
+            ## only the columns the rounds use are shared ##
+            columns = list(dict.fromkeys(
+                ['season', 'team'] + fields + dependents
+            ))
+            shm, spec = share_frame(data.flat_game_grades, columns)
+            try:
+                with profiler.stage('development_pool', workers=workers), ProcessPoolExecutor(
+                    max_workers=workers, initializer=attach_frame, initargs=spec
+                ) as pool:
+                    rounds = pool.map(
+                        partial(
+                            run_shared_round, fields=fields, backend=backend,
+                            dependents=dependents, regularization=regularization,
+                            penalties=penalties, l1_ratio=l1_ratio
+                        ),
+                        pending, group_masks[pending],
+                        chunksize=max(1, len(pending) // (workers * 4))
+                    )
+                    for round_num, train_rsq, test_rsq, paths in rounds:
+                        if round(round_num/50,0) == round_num/50:
+                            logger.info('          On round {0}'.format(round_num))
+                            store.checkpoint()
+                        store.add(round_num, train_rsq, test_rsq, paths)
+            finally:
+                shm.close()
+                shm.unlink()
+        else:
+            for round_num in pending:
+                if round(round_num/50,0) == round_num/50:
+                    logger.info('          On round {0}'.format(round_num))
+                    store.checkpoint()
+                with profiler.stage('development_round', round=round_num):
+                    store.add(*run_development_round(
+                        data.flat_game_grades, round_num,
+                        splits.row_mask(group_masks[round_num]), fields, backend,
+                        data.field_matrix, dependents, regularization, penalties,
+                        l1_ratio
+                    ))
+    finally:
+        ## keep every finished round if the run is interrupted ##
+        store.checkpoint()
     ## summarize ##
-    print('     Summarizing results')
-    df = pd.DataFrame(records)
-    ## calc rsq for round ##
-    for rsq in ['train_rsq', 'test_rsq']:
-        df['group_{0}'.format(rsq)] = df.groupby(
-            ['run_group', 'dependent']
-        )[rsq].transform('mean')
-        ## calc rsq vs group ##
-        df['{0}_lift'.format(rsq)] = df[rsq] - df['group_{0}'.format(rsq)]
+    logger.info('     Summarizing results')
+    agg = store.summarize()
+    if len(regularization) > 0:
+        path = store.summarize_paths()
+        for row in path[path['selected']].itertuples():
+            logger.info('          {0} {1}: penalty {2:.4g} with {3:.1f} fields, {4:.4f} avg test rsq'.format(
+                row.dependent, row.method, row.penalty, row.features, row.test_avg_rsq
+            ))
+        return agg, path
+    ## return ##
+    return agg
+
+
+def pareto_front(df):
+    '''
+    Returns the subsets of each dependent that no subset with as few or fewer
+    fields beats on average test rsq
+    '''
+    df = df.sort_values(
+        by=['dependent', 'features', 'test_avg_rsq'],
+        ascending=[True, True, False]
+    )
+    best = df.groupby('dependent')['test_avg_rsq'].cummax()
+    previous = best.groupby(df['dependent']).shift(1)
+    return df[
+        pd.isnull(previous) | (df['test_avg_rsq'] > previous)
+    ].reset_index(drop=True)
+
+@profiler.run('run_feature_search')
+def run_feature_search(
+    total_rounds=100, methods=('forward', 'backward'),
+    max_size=None, seed=None, dependents=('margin', 'seasonal_margin')
+):
+    '''
+    Searches every team and opponent grade for the best subsets of each size
+    with forward and backward selection on each round's train split. Every
+    subset found in any round is then refit and scored on every round's
+    split, and the Pareto front of average test rsq against the number of
+    fields is returned, along with how many of the rounds' searches picked
+    each subset
+
+    Searches and scores run from each split's gram, and rows missing any
+    grade are left out. Adding 'exhaustive' to methods also runs a branch
+    and bound search for the best subset of every size, which takes seconds
+    a round over every grade, so pair it with fewer rounds or a max_size,
+    which caps the fields in a subset
+    '''
+    dependents = list(dependents)
+    ## env vars
+    url, key, table = load_credentials()
+    logger.info('     Loading data...')
+    with profiler.stage('load_data'):
+        data = DataLoader(url, key, table, targets=dependents)
+    grades = data.grade_names()
+    fields = grades + ['opponent_{0}'.format(grade) for grade in grades]
+    logger.info('     Searching {0} rounds of subsets of {1} fields...'.format(
+        total_rounds, len(fields)
+    ))
+    ## draw every round's split of season/team groups at once ##
+    splits = SplitGenerator(data.flat_game_grades, ['season', 'team'])
+    group_masks = splits.masks(total_rounds, seed)
+    ## search each round, keeping its grams to score the subsets found ##
+    grams = []
+    records = []
+    for round_num in range(0, total_rounds):
+        if round(round_num/50,0) == round_num/50:
+            logger.info('          On round {0}'.format(round_num))
+        with profiler.stage('subset_search_round', round=round_num):
+            reg = Regression(
+                df=data.flat_game_grades,
+                fields=fields,
+                dependent=dependents[0],
+                windowing_fields=['season', 'team'],
+                train_mask=splits.row_mask(group_masks[round_num]),
+                matrix=data.field_matrix
+            )
+            train_gram, test_gram = reg.subset_grams(dependents)
+            grams.append((train_gram, test_gram))
+            records.extend(search_subsets(
+                train_gram, test_gram, fields, dependents, methods, max_size
+            ))
+    found = pd.DataFrame(records)
+    ## score every subset found on every round ##
+    subsets = {
+        dependent : found[found['dependent'] == dependent]['fields'].unique().tolist()
+        for dependent in dependents
+    }
+    logger.info('     Scoring {0} subsets...'.format(
+        sum(len(v) for v in subsets.values())
+    ))
+    scores = []
+    with profiler.stage('score_subsets'):
+        for train_gram, test_gram in grams:
+            scores.extend(score_subsets(
+                train_gram, test_gram, fields, dependents, subsets
+            ))
     ## average ##
-    agg = df.groupby(['field_left_out', 'dependent']).agg(
+    agg = pd.DataFrame(scores).groupby(['dependent', 'features', 'fields']).agg(
         train_avg_rsq = ('train_rsq', 'mean'),
         test_avg_rsq = ('test_rsq', 'mean'),
-        train_lift_when_excluded = ('train_rsq_lift', 'mean'),
-        test_lift_when_excluded = ('test_rsq_lift', 'mean'),
+        test_std_rsq = ('test_rsq', 'std'),
+    ).reset_index()
+    picked = found.groupby(['dependent', 'fields']).agg(
+        times_picked = ('method', 'size'),
+        methods = ('method', lambda methods: ', '.join(sorted(set(methods))))
     ).reset_index()
-    ## sort ##
-    agg = agg.sort_values(
-        by=['train_lift_when_excluded'],
-        ascending=[True]
-    ).reset_index(drop=True)
+    agg = pd.merge(agg, picked, on=['dependent', 'fields'], how='left')
     ## return ##
-    return agg
+    front = pareto_front(agg)
+    front['fields'] = front['fields'].apply(', '.join)
+    return front
+
 
+@profiler.run('run_backtest')
+def run_backtest(fields=None, dependents=('margin', 'margin_next_3'), forgetting=1.0):
+    '''
+    Walks forward through every week, scoring it with a model trained
+    through the week before, and returns the weekly and seasonal out of
+    sample rsq and rmse of each dependent, which can include targets built
+    by the DataLoader. fields default to the predictive model's, and
+    forgetting below 1 down weights older weeks
 
-def update_model():
+    Targets that average over later games (ie seasonal_margin) train on
+    games that haven't been played by the scored week, so their scores
+    are optimistic (see WalkForward)
+    '''
+    dependents = list(dependents)
+    ## env vars
+    url, key, table = load_credentials()
+    logger.info('     Loading data...')
+    with profiler.stage('load_data'):
+        data = DataLoader(url, key, table, targets=dependents)
+    logger.info('     Walking forward...')
+    backtest = WalkForward(
+        data.flat_game_grades, fields or predictive_fields, dependents, forgetting
+    )
+    weekly, seasonal = backtest.run()
+    for dependent in dependents:
+        overall = seasonal[seasonal['dependent'] == dependent]
+        logger.info('          {0}: {1:.3f} avg rsq, {2:.2f} avg rmse by season'.format(
+            dependent, overall['rsq'].mean(), overall['rmse'].mean()
+        ))
+    return weekly, seasonal
+
+
+@profiler.run('update_model')
+def update_model(bootstrap_replicates=0, level=0.95, seed=None, workers=None):
     '''
     Trains a new model on all available data and update the
-    config file
+    config file. Models in the config that are not retrained here
+    (ie legacy) are kept
+
+    Passing bootstrap_replicates refits each model on that many resamples
+    of its (season, team) groups, and saves the standard error and
+    percentile interval (at level) of each coef under bootstrap, which
+    is otherwise dropped since it would no longer match the coefs
     '''
+    package_dir = pathlib.Path(__file__).parent.parent.resolve()
+    with open('{0}/config.json'.format(package_dir), 'r') as fp:
+        config = json.load(fp)
     ## structure for saving to config ##
     output_dict={
         'updated_through' : {
@@ -123,41 +425,34 @@ def update_model():
         'predictive' : {}
     }
     ## DB config ##
-    url = os.getenv('SUPABASE_URL')
-    key = os.getenv('SUPABASE_KEY')
-    table = os.getenv('SUPABASE_TABLE')
-    ## fields to use in each model ##
-    descriptive_fields=[
-        'overall_grade', 'opponent_overall_grade'
-    ]
-    predictive_fields=[
-        'overall_grade', 'opponent_overall_grade',
-        'pass_grade', 'run_defense_grade'
-    ]
+    url, key, table = load_credentials()
     ## load data ##
-    print('Updating the config file with new models')
-    print('     Loading data...')
-    data = DataLoader(url, key, table)
+    logger.info('Updating the config file with new models')
+    logger.info('     Loading data...')
+    with profiler.stage('load_data'):
+        data = DataLoader(url, key, table)
     ## update config with training week/season data
     output_dict['updated_through']['season'] = data.flat_game_grades['season'].max()
     output_dict['updated_through']['week'] = data.flat_game_grades[
         data.flat_game_grades['season'] == output_dict['updated_through']['season']
     ]['week'].max()
     ## create a reg for each
-    print('     Running model...')
+    logger.info('     Running model...')
     reg_descriptive = Regression(
         df=data.flat_game_grades,
         fields=descriptive_fields,
         dependent='margin',
         windowing_fields=['season', 'team'],
-        full_train=True
+        full_train=True,
+        matrix=data.field_matrix
     )
     reg_predictive = Regression(
         df=data.flat_game_grades,
         fields=predictive_fields,
         dependent='seasonal_margin',
         windowing_fields=['season', 'team'],
-        full_train=True
+        full_train=True,
+        matrix=data.field_matrix
     )
     ## fit ##
     reg_descriptive.train()
@@ -173,8 +468,24 @@ def update_model():
     ## constants ##
     output_dict['descriptive']['intercept'] = reg_descriptive.const
     output_dict['predictive']['intercept'] = reg_predictive.const
+    ## uncertainty of the coefs ##
+    if bootstrap_replicates > 0:
+        logger.info('     Bootstrapping {0} replicates...'.format(bootstrap_replicates))
+        output_dict['bootstrap'] = {
+            'replicates' : bootstrap_replicates,
+            'level' : level,
+            'descriptive' : bootstrap_regression(
+                reg_descriptive, bootstrap_replicates, level, seed, workers
+            ),
+            'predictive' : bootstrap_regression(
+                reg_predictive, bootstrap_replicates, level, seed, workers
+            )
+        }
+    ## carry over models that were not retrained ##
+    for k, v in config.items():
+        if k not in output_dict and k != 'bootstrap':
+            output_dict[k] = v
     ## save ##
-    package_dir = pathlib.Path(__file__).parent.parent.resolve()
-    with open('{0}/config.json'.format(package_dir), 'w') as fp:
+    with profiler.stage('save'), open('{0}/config.json'.format(package_dir), 'w') as fp:
         json.dump(output_dict, fp, indent=4, cls=NpEncoder)
 
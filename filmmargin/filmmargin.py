@@ -1,61 +1,212 @@
 import pandas as pd
+import numpy
 import json
 import pathlib
 
-from .DataLoader import DataLoader
+from .DataLoader import DataLoader, load_credentials
+from .Scorer import Scorer
+from .Writer import MarginWriter, read_margins
+from .Writer.writer import format_extensions
+from .Rollup import TeamRollup, rollup_paths, margins_source, read_source, write_source
+from .Profiler import profiler, logger
 
 import os
 
-## suppress logging ##
-import logging
-logging.getLogger("httpx").setLevel(logging.WARNING)
+## columns written to the margins file ##
+output_columns = [
+    'game_id', 'season', 'week', 'team', 'opponent',
+    'pf', 'pa', 'margin', 'film_margin', 'film_margin_predictive',
+    'film_margin_old_model'
+]
 
-def update_margins():
+@profiler.timed('calc_margins', profile=True)
+def calc_margins(df, config):
+    '''
+    Adds the film margins of every model in the config to a flat
+    game grades df
+    '''
+    scorer = Scorer.from_config(config)
+    df = scorer.apply(df)
+    for model, missing in scorer.missing.items():
+        if missing > 0:
+            logger.warning('     Warning - {0} rows are missing fields for the {1} model'.format(
+                missing, model
+            ))
+    ## create margin ##
+    df['margin'] = (
+        df['pf'] -
+        df['pa']
+    )
+    return df
+
+def get_refresh_week(existing, lookback_weeks=1):
+    '''
+    Returns the (season, week) an incremental update should reload from,
+    which is the latest week in the existing margins, stepped back by
+    lookback_weeks - 1 so recent weeks pick up late grade and score changes
+    '''
+    weeks = existing[['season', 'week']].drop_duplicates().sort_values(
+        by=['season', 'week'],
+        ascending=[True, True]
+    ).reset_index(drop=True)
+    row = weeks.iloc[max(0, len(weeks) - max(1, lookback_weeks))]
+    return int(row['season']), int(row['week'])
+
+def margin_keys(df):
+    '''
+    Returns the (season, week, team) key of each margin row. A team plays
+    once a week, so these are unique even for rows whose game_id is
+    missing (ie a game that isn't in the games file yet)
+    '''
+    return pd.MultiIndex.from_arrays([
+        df['season'].astype('int64').to_numpy(),
+        df['week'].astype('int64').to_numpy(),
+        df['team'].astype(str).to_numpy()
+    ], names=['season', 'week', 'team'])
+
+def upsert_margins(existing, new, tolerance=1e-4):
+    '''
+    Updates existing margin rows in place with new rows for the same team and
+    week (see margin_keys), and appends any rows that are not in the existing
+    margins yet. Returns the combined margins and the number of rows changed
+    and added. Float changes within the tolerance (ie csv rounding) are not
+    counted
+    '''
+    existing = existing.copy()
+    new_keys = margin_keys(new)
+    duplicated = new_keys.duplicated(keep='last')
+    if duplicated.any():
+        logger.warning('     Warning - {0} new rows repeat a team and week. Keeping the last of each'.format(
+            int(duplicated.sum())
+        ))
+        new = new[~duplicated]
+        new_keys = new_keys[~duplicated]
+    existing_keys = margin_keys(existing)
+    ## position of each existing row in the new rows ##
+    match = new_keys.get_indexer(existing_keys)
+    matched = match >= 0
+    changed = pd.Series(False, index=existing.index)
+    for col in output_columns:
+        values = new[col].to_numpy()[match[matched]]
+        current = existing.loc[matched, col].to_numpy()
+        if pd.api.types.is_float_dtype(new[col]):
+            same = numpy.isclose(
+                values.astype(float), current.astype(float),
+                rtol=0, atol=tolerance, equal_nan=True
+            )
+        else:
+            same = (values == current) | (pd.isnull(values) & pd.isnull(current))
+        changed[matched] = changed[matched].to_numpy() | ~same
+        existing.loc[matched, col] = values
+    ## append the rest ##
+    added = new[~new_keys.isin(existing_keys)][output_columns]
+    return (
+        pd.concat([existing, added]).reset_index(drop=True),
+        int(changed.sum()), len(added)
+    )
+
+def update_rollup(margins, output_path, refreshed=None, source=None):
+    '''
+    Writes the team season and team week rollups of the margins next to the
+    margins file (see rollup_paths), once the margins file is written.
+    With the rows an incremental update refreshed, and the source (see
+    margins_source) of the margins file they were upserted into, the
+    existing weeks rollup is read and only the team seasons of those rows
+    are rebuilt. A rollup that wasn't rolled up from that file (ie the file
+    was updated without a rollup since) is rebuilt in full. Returns the
+    rollup
+    '''
+    paths = rollup_paths(output_path)
+    rollup = None
+    if refreshed is not None and paths['weeks'].exists():
+        if source is None or read_source(paths['source']) != source:
+            logger.warning('     Warning - rebuilding the rollup (it is out of date with {0})'.format(
+                pathlib.Path(output_path).name
+            ))
+        else:
+            try:
+                rollup = TeamRollup.read(paths['weeks'])
+            except ValueError as e:
+                logger.warning('     Warning - rebuilding the rollup ({0})'.format(e))
+    if rollup is None:
+        rollup = TeamRollup.from_margins(margins)
+    else:
+        rebuilt = rollup.refresh(margins, refreshed)
+        logger.info('          {0} team seasons rolled up'.format(rebuilt))
+    MarginWriter(paths['seasons']).write(rollup.seasons())
+    MarginWriter(paths['weeks']).write(rollup.to_frame())
+    ## noted last, so a rollup interrupted before it is written is rebuilt ##
+    write_source(paths['source'], margins_source(output_path, len(margins)))
+    return rollup
+
+@profiler.run('update_margins')
+def update_margins(
+    incremental=False, lookback_weeks=1, output_format='csv', output_path=None,
+    rollup=False
+):
     '''
     Calculates the film margins
+    The margins are written to film_margins with the extension of the
+    output_format (csv, parquet, or arrow), unless an output_path is passed
+
+    With incremental=True, the existing margins file is read and only weeks
+    from its latest week (less lookback_weeks - 1) on are loaded and scored.
+    Those rows are upserted into the file by team and week. Changes to the
+    config's models are not picked up by existing rows, so a full run should
+    follow update_model()
+
+    With rollup=True, team season and team week averages of the margins
+    are written next to the margins file as well (see update_rollup). An
+    incremental run only refreshes the rollup if it was rolled up from the
+    margins file the run started from, and rebuilds it otherwise
+
+    Progress and stage timings are logged to the filmmargin logger (see
+    Profiler for the profiling switches)
     '''
-    print('Updating film margins')
+    logger.info('Updating film margins')
     ## env vars
-    url = os.getenv('SUPABASE_URL')
-    key = os.getenv('SUPABASE_KEY')
-    table = os.getenv('SUPABASE_TABLE')
-    print('     Loading config...')
+    url, key, table = load_credentials()
+    logger.info('     Loading config...')
     package_dir = pathlib.Path(__file__).parent.parent.resolve()
+    output_path = output_path or '{0}/film_margins{1}'.format(
+        package_dir, format_extensions[output_format]
+    )
     with open('{0}/config.json'.format(package_dir), 'r') as fp:
         config = json.load(fp)
-    print('     Loading data...')
-    data = DataLoader(url, key, table)
+    ## determine what to load ##
+    existing = None
+    source = None
+    since = None
+    if incremental and os.path.exists(output_path):
+        with profiler.stage('read_margins'):
+            existing = read_margins(output_path)
+            if rollup:
+                source = margins_source(output_path, len(existing))
+        if len(existing) > 0:
+            since = get_refresh_week(existing, lookback_weeks)
+            logger.info('     Refreshing from {0} week {1}...'.format(since[0], since[1]))
+        else:
+            existing = None
+    logger.info('     Loading data...')
+    with profiler.stage('load_data'):
+        data = DataLoader(url, key, table, since=since, targets=[])
+    if len(data.flat_game_grades) == 0:
+        logger.info('     No games to update')
+        return
     ## calculate ##
-    print('     Calcualting margins...')
-    ## descriptive ##
-    data.flat_game_grades['film_margin'] = config['descriptive']['intercept']
-    for k, v in config['descriptive'].items():
-        if k != 'intercept':
-            data.flat_game_grades['film_margin'] = (
-                data.flat_game_grades['film_margin'] +
-                (data.flat_game_grades[k] * v)
-            )
-    ## predictive
-    data.flat_game_grades['film_margin_predictive'] = config['predictive']['intercept']
-    for k, v in config['predictive'].items():
-        if k != 'intercept':
-            data.flat_game_grades['film_margin_predictive'] = (
-                data.flat_game_grades['film_margin_predictive'] +
-                (data.flat_game_grades[k] * v)
-            )
-    ## create margin ##
-    data.flat_game_grades['margin'] = (
-        data.flat_game_grades['pf'] -
-        data.flat_game_grades['pa']
-    )
-    data.flat_game_grades['film_margin_old_model'] = (
-        -87.728 +
-        1.263 * data.flat_game_grades['overall_grade']
-    )
+    logger.info('     Calcualting margins...')
+    data.flat_game_grades = calc_margins(data.flat_game_grades, config)
     ## save ##
-    print('     Saving...')
-    data.flat_game_grades[[
-        'game_id', 'season', 'week', 'team', 'opponent',
-        'pf', 'pa', 'margin', 'film_margin', 'film_margin_predictive',
-        'film_margin_old_model'
-    ]].to_csv('{0}/film_margins.csv'.format(package_dir))
\ No newline at end of file
+    logger.info('     Saving...')
+    margins = data.flat_game_grades[output_columns]
+    refreshed = None
+    if existing is not None:
+        refreshed = margins
+        with profiler.stage('upsert_margins'):
+            margins, changed, added = upsert_margins(existing, margins)
+        logger.info('          {0} rows changed, {1} rows added'.format(changed, added))
+    with profiler.stage('save', rows=len(margins)):
+        MarginWriter(output_path).write(margins)
+    if rollup:
+        with profiler.stage('rollup', rows=len(margins)):
+            update_rollup(margins, output_path, refreshed, source)
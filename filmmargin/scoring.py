@@ -0,0 +1,111 @@
+import pandas as pd
+import numpy
+import json
+import pathlib
+import sys
+
+from .Scorer import Scorer
+from .Scorer.scorer import margin_columns
+from .Writer import MarginWriter
+
+## set top level pacakage directory ##
+package_dir = pathlib.Path(__file__).parent.parent.resolve()
+
+def load_scorer(config=None, models=None):
+    '''
+    Builds a scorer from a config (dict or path, defaulting to the package
+    config), limited to the given models if passed
+    '''
+    if not isinstance(config, dict):
+        with open(config or '{0}/config.json'.format(package_dir), 'r') as fp:
+            config = json.load(fp)
+    if models is not None:
+        unknown = [model for model in models if model not in config]
+        if len(unknown) > 0:
+            raise ValueError('Unknown models: {0}'.format(', '.join(unknown)))
+        config = {model : config[model] for model in models}
+    return Scorer.from_config(config)
+
+def grade_format(grades, format=None):
+    '''
+    Determines whether a file input is csv or parquet
+    '''
+    if format is not None:
+        return format
+    name = str(getattr(grades, 'name', grades))
+    return 'parquet' if name.endswith(('.parquet', '.pq')) else 'csv'
+
+def iter_grade_chunks(grades, columns, chunk_size=100000, format=None):
+    '''
+    Yields chunks of grade rows as DataFrames from an array (whose columns
+    are in the order of columns), a DataFrame, or a csv or parquet path
+    or stream ('-' reads csv from stdin)
+    '''
+    if isinstance(grades, numpy.ndarray):
+        for start in range(0, len(grades), chunk_size):
+            yield pd.DataFrame(grades[start:start + chunk_size], columns=columns)
+    elif isinstance(grades, pd.DataFrame):
+        for start in range(0, len(grades), chunk_size):
+            yield grades.iloc[start:start + chunk_size]
+    elif grade_format(grades, format) == 'parquet':
+        import pyarrow.parquet as pq
+        file = pq.ParquetFile(grades)
+        read = [col for col in file.schema_arrow.names if col in columns]
+        for batch in file.iter_batches(batch_size=chunk_size, columns=read):
+            yield batch.to_pandas()
+    else:
+        for chunk in pd.read_csv(
+            sys.stdin if grades == '-' else grades,
+            chunksize=chunk_size,
+            usecols=lambda col: col in columns
+        ):
+            yield chunk
+
+def iter_scores(
+    grades, config=None, models=None, chunk_size=100000, keep_columns=None,
+    columns=None, format=None
+):
+    '''
+    Yields the film margins of grade rows one chunk at a time, so inputs
+    of any size are scored in constant memory. keep_columns are carried
+    over from the input (ie an id), and columns names the columns of an
+    array input, which default to the scorer's fields
+    '''
+    scorer = load_scorer(config, models)
+    keep_columns = keep_columns or []
+    columns = columns or scorer.fields
+    for chunk in iter_grade_chunks(
+        grades, list(columns) + keep_columns, chunk_size, format
+    ):
+        margins = pd.DataFrame(
+            scorer.score(chunk),
+            columns=[margin_columns.get(model, model) for model in scorer.models],
+            index=chunk.index
+        )
+        yield pd.concat([chunk[keep_columns], margins], axis=1)
+
+def score_grades(grades, output=None, float_precision=4, **kwargs):
+    '''
+    Scores grade rows with the config models without loading any data.
+    Takes an array, DataFrame, or csv or parquet path or stream, and the
+    options of iter_scores
+
+    Returns the margins as a DataFrame, or if an output path is passed
+    (or '-' for stdout), streams the margins to it as csv, parquet or
+    arrow, by extension, and returns the number of rows written
+    '''
+    chunks = iter_scores(grades, **kwargs)
+    if output is None:
+        frames = list(chunks)
+        return pd.concat(frames) if len(frames) > 0 else pd.DataFrame()
+    if output == '-':
+        ## formatted the same way MarginWriter writes csvs ##
+        rows = 0
+        for index, chunk in enumerate(chunks):
+            chunk.to_csv(
+                sys.stdout, header=index == 0, index=False,
+                float_format='%.{0}f'.format(float_precision)
+            )
+            rows += len(chunk)
+        return rows
+    return MarginWriter(output, float_precision=float_precision).write_chunks(chunks)
@@ -0,0 +1,31 @@
+import pathlib
+
+from .DataLoader import DataLoader, load_credentials
+from .Service import MarginService
+from .Profiler import profiler, logger
+
+## set top level pacakage directory ##
+package_dir = pathlib.Path(__file__).parent.parent.resolve()
+
+def serve_margins(
+    host='127.0.0.1', port=8000, cache_size=4096, reload_interval=1.0,
+    config_path=None
+):
+    '''
+    Loads the flat game grades once and serves their film margins from
+    memory until interrupted (see MarginService for the endpoints). The
+    config defaults to the package config.json, and is reloaded when it
+    changes
+    '''
+    logger.info('Serving film margins')
+    url, key, table = load_credentials()
+    logger.info('     Loading data...')
+    with profiler.stage('load_data'):
+        data = DataLoader(url, key, table, targets=[])
+    service = MarginService(
+        data.flat_game_grades,
+        config_path or '{0}/config.json'.format(package_dir),
+        host=host, port=port, cache_size=cache_size,
+        reload_interval=reload_interval
+    )
+    service.serve_forever()
@@ -0,0 +1,37 @@
+import pathlib
+import sys
+
+import pytest
+
+## tests import the package and benchmarks from the repo root ##
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent.resolve()))
+
+from benchmarks.synthetic import generate
+from benchmarks.suite import standin_key
+
+@pytest.fixture(scope='session')
+def synthetic():
+    '''
+    Three seasons of synthetic (game_grades, games)
+    '''
+    return generate(seasons=3, seed=0)
+
+@pytest.fixture
+def standin(synthetic):
+    '''
+    Stand in Supabase server of the synthetic grades, with small pages so
+    every download spans several of them
+    '''
+    from benchmarks.standin import StandInServer
+    with StandInServer(synthetic[0], max_rows=100) as server:
+        yield server
+
+@pytest.fixture
+def client_for():
+    '''
+    Returns a function that builds a SupabaseClient for a stand in server
+    '''
+    from filmmargin.Supabase import SupabaseClient
+    def build(server, **kwargs):
+        return SupabaseClient(server.url, standin_key, server.table, **kwargs)
+    return build
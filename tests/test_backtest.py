@@ -0,0 +1,88 @@
+import numpy
+import pandas as pd
+import pytest
+import statsmodels.api as sm
+
+from benchmarks.suite import prepare_loader, predictive_fields
+from benchmarks.synthetic import generate
+from filmmargin.Regression import WalkForward
+
+dependents = ['margin', 'seasonal_margin']
+
+@pytest.fixture(scope='module')
+def flat():
+    '''
+    Two seasons of flat grades with some grades missing
+    '''
+    game_grades, games = generate(seasons=2, seed=2, missing_rate=0.05)
+    df = prepare_loader(game_grades, games, steps=3).flat_game_grades
+    df['margin'] = df['pf'] - df['pa']
+    return df
+
+def refit(df, through, dependent, weights=None):
+    '''
+    Fits a model from scratch on every complete row through a week
+    '''
+    rows = df[
+        pd.MultiIndex.from_frame(df[['season', 'week']]) <= through
+    ].dropna(subset=predictive_fields + dependents)
+    x = sm.add_constant(rows[predictive_fields].astype('float64'))
+    if weights is None:
+        return sm.OLS(rows[dependent].astype('float64'), x).fit().params
+    return sm.WLS(rows[dependent].astype('float64'), x, weights=weights(rows)).fit().params
+
+def check_refits(df, walk, weights=None):
+    ## the last few weeks of each season, which covers the turn of the season ##
+    weeks = list(walk.weeks)
+    checked = [week for index, week in enumerate(weeks) if index % 7 == 3] + [weeks[-1]]
+    for week in checked:
+        index = weeks.index(week)
+        for d, dependent in enumerate(dependents):
+            params = refit(df, week, dependent, weights and weights(index))
+            numpy.testing.assert_allclose(walk.consts[index, d], params['const'], rtol=1e-7)
+            numpy.testing.assert_allclose(
+                walk.coefs[index, :, d], params[predictive_fields].to_numpy(), rtol=1e-7
+            )
+
+def test_walk_forward_matches_a_refit_at_every_step(flat):
+    walk = WalkForward(flat, predictive_fields, dependents)
+    walk.fit()
+    check_refits(flat, walk)
+    ## each week is scored by the model through the week before it ##
+    predictions = walk.predict()
+    codes = walk.week_codes
+    rows = numpy.flatnonzero(codes == 5)
+    x = flat[predictive_fields].to_numpy(dtype=numpy.float64)[rows]
+    expected = x @ walk.coefs[4] + walk.consts[4]
+    numpy.testing.assert_allclose(predictions[rows], expected)
+    assert numpy.isnan(predictions[codes == 0]).all()
+
+def test_forgetting_matches_a_weighted_refit(flat):
+    forgetting = 0.9
+    walk = WalkForward(flat, predictive_fields, dependents, forgetting=forgetting)
+    walk.fit()
+    def weights(through):
+        def row_weights(rows):
+            codes = walk.weeks.get_indexer(pd.MultiIndex.from_frame(rows[['season', 'week']]))
+            return forgetting ** (through - codes)
+        return row_weights
+    check_refits(flat, walk, weights)
+
+def test_summary_scores_out_of_sample_predictions(flat):
+    weekly, seasonal = WalkForward(flat, predictive_fields, dependents).run()
+    assert list(seasonal.columns) == ['season', 'dependent', 'rows', 'rsq', 'rmse']
+    ## the first week has no model, so it isn't scored ##
+    assert weekly['rows'].sum() == seasonal['rows'].sum()
+    first = weekly.iloc[0]
+    assert (first['season'], first['week']) != tuple(flat[['season', 'week']].min())
+    with pytest.raises(ValueError):
+        WalkForward(flat, predictive_fields, dependents, forgetting=0)
+
+def test_default_targets_are_built_by_the_loader():
+    ## the defaults only look a few games ahead, rather than the season ##
+    loader = prepare_loader(*generate(seasons=2, seed=3), steps=3)
+    loader.add_targets(['margin_next_3'])
+    walk = WalkForward(loader.flat_game_grades, predictive_fields)
+    assert walk.dependents == ['margin', 'margin_next_3']
+    weekly, seasonal = walk.run()
+    assert set(seasonal['dependent']) == {'margin', 'margin_next_3'}
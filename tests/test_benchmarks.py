@@ -0,0 +1,34 @@
+from benchmarks.suite import compare, benchmarks, run_window, prepare_regression
+from benchmarks.synthetic import generate
+
+def report(platform, *results):
+    return {'meta' : {'platform' : platform}, 'results' : list(results)}
+
+def test_compare_fails_errors_and_missing_baselines(capsys):
+    baseline = report(
+        'here',
+        {'name' : 'fast', 'scale' : 1, 'wall_s' : 1.0, 'peak_rss_mb' : 100.0},
+        {'name' : 'slow', 'scale' : 1, 'wall_s' : 1.0, 'peak_rss_mb' : 100.0},
+        {'name' : 'broken', 'scale' : 1, 'wall_s' : 1.0, 'peak_rss_mb' : 100.0},
+    )
+    results = report(
+        'here',
+        {'name' : 'fast', 'scale' : 1, 'wall_s' : 0.9, 'peak_rss_mb' : 100.0},
+        {'name' : 'slow', 'scale' : 1, 'wall_s' : 1.5, 'peak_rss_mb' : 100.0},
+        {'name' : 'broken', 'scale' : 1, 'error' : 'ValueError()'},
+        {'name' : 'new', 'scale' : 1, 'wall_s' : 1.0, 'peak_rss_mb' : 100.0},
+    )
+    failures = compare(results, baseline)
+    assert sorted(failure['name'] for failure in failures) == ['broken', 'new', 'slow']
+    assert 'machine local' not in capsys.readouterr().out
+    ## a baseline from elsewhere is flagged ##
+    compare(results, dict(baseline, meta={'platform' : 'there'}))
+    assert 'machine local' in capsys.readouterr().out
+
+def test_regression_window_times_the_split():
+    state = prepare_regression(*generate(seasons=1, seed=0))
+    reg = state['reg']
+    reg.train_rows[:] = False
+    assert run_window(state) == len(reg.df)
+    assert reg.train_rows.any()
+    assert benchmarks['regression_window']['run'] is run_window
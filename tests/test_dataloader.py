@@ -0,0 +1,95 @@
+import pathlib
+import subprocess
+import sys
+import time
+
+import pandas as pd
+import pytest
+
+from filmmargin.Cache import SnapshotCache
+from filmmargin.DataLoader import DataLoader
+from filmmargin.Supabase import SupabaseClient
+from filmmargin.Supabase.supabase import map_in_daemons
+from benchmarks.suite import standin_key
+
+repo_dir = pathlib.Path(__file__).parent.parent.resolve()
+
+def since_rows(grades, since):
+    return grades[
+        (grades['season'] > since[0]) |
+        ((grades['season'] == since[0]) & (grades['week'] >= since[1]))
+    ].reset_index(drop=True)
+
+def load(standin, synthetic, directory, monkeypatch, since):
+    '''
+    Loads through a stand in server with the games cached, recording the
+    filters each download was made with
+    '''
+    SnapshotCache(directory).put('games', 'synthetic', synthetic[1])
+    calls = []
+    get_data = SupabaseClient.get_data
+    def recording(self, since=None, after=None):
+        calls.append({'since' : since, 'after' : after})
+        return get_data(self, since=since, after=after)
+    monkeypatch.setattr(SupabaseClient, 'get_data', recording)
+    loader = DataLoader(
+        standin.url, standin_key, standin.table, since=since,
+        cache_dir=directory, targets=[]
+    )
+    return loader, calls
+
+def test_cold_incremental_load_only_downloads_since(standin, synthetic, tmp_path, monkeypatch):
+    since = (2011, 10)
+    loader, calls = load(standin, synthetic, tmp_path, monkeypatch, since)
+    assert calls == [{'since' : since, 'after' : None}]
+    expected = since_rows(synthetic[0], since)
+    pd.testing.assert_frame_equal(
+        loader.loaded_game_grades[expected.columns], expected, check_dtype=False
+    )
+    ## a partial download isn't cached as the table ##
+    assert SnapshotCache(tmp_path).get(standin.table)[0] is None
+
+def test_cached_snapshot_is_filtered_in_memory(standin, synthetic, tmp_path, monkeypatch):
+    full, calls = load(standin, synthetic, tmp_path, monkeypatch, None)
+    assert calls == [{'since' : None, 'after' : None}]
+    since = (2011, 10)
+    loader, calls = load(standin, synthetic, tmp_path, monkeypatch, since)
+    assert calls == []
+    expected = since_rows(synthetic[0], since)
+    pd.testing.assert_frame_equal(
+        loader.loaded_game_grades[expected.columns], expected, check_dtype=False
+    )
+
+def test_timeout_does_not_hold_the_interpreter_open(tmp_path):
+    ## a source that never finishes times out, and the run exits right
+    ## after rather than waiting for it ##
+    script = '\n'.join([
+        'import time',
+        'from filmmargin.DataLoader import DataLoader',
+        'DataLoader.fetch_games = lambda self: time.sleep(60)',
+        'DataLoader.fetch_game_grades = lambda self, url, key, since=None: time.sleep(60)',
+        'try:',
+        '    DataLoader(None, None, None, cache_dir={0!r}, targets=[], timeout=0.5)'.format(str(tmp_path)),
+        'except TimeoutError as e:',
+        '    print(e)',
+    ])
+    start = time.time()
+    result = subprocess.run(
+        [sys.executable, '-c', script], capture_output=True, text=True,
+        cwd=repo_dir, timeout=60
+    )
+    assert result.stdout.strip() == 'games and game grades did not load within 0.5s'
+    assert time.time() - start < 30
+
+def test_map_in_daemons_keeps_order_and_raises():
+    def slow_square(x):
+        time.sleep(0.01 * (5 - x))
+        return x * x
+    assert map_in_daemons(slow_square, list(range(0, 5)), 3) == [0, 1, 4, 9, 16]
+    assert map_in_daemons(slow_square, [], 3) == []
+    def failing(x):
+        if x == 2:
+            raise ValueError('page 2')
+        return x
+    with pytest.raises(ValueError, match='page 2'):
+        map_in_daemons(failing, list(range(0, 5)), 2)
@@ -0,0 +1,49 @@
+import numpy
+import pandas as pd
+
+from filmmargin.development import share_frame, attach_frame, worker_state
+from filmmargin.Regression import SplitGenerator
+
+def test_shared_frame_keeps_the_groups(synthetic):
+    from benchmarks.suite import prepare_loader
+    df = prepare_loader(*synthetic, steps=3).flat_game_grades.copy()
+    ## a team the grades don't name is in no group ##
+    df['team'] = df['team'].astype(object)
+    df.loc[df.index[::37], 'team'] = numpy.nan
+    columns = ['season', 'team', 'overall_grade', 'margin']
+    shm, spec = share_frame(df, columns)
+    try:
+        attach_frame(*spec)
+        shared = worker_state['df']
+        assert shared['team'].isna().sum() == df['team'].isna().sum()
+        splits = SplitGenerator(df, ['season', 'team'])
+        numpy.testing.assert_array_equal(
+            worker_state['splits'].group_codes, splits.group_codes
+        )
+        numpy.testing.assert_array_equal(
+            shared['overall_grade'].to_numpy(), df['overall_grade'].to_numpy(dtype=float)
+        )
+    finally:
+        worker_state.pop('shm').close()
+        worker_state.clear()
+        shm.unlink()
+
+def test_development_rounds_match_across_workers(synthetic):
+    from benchmarks.suite import StandInEnvironment
+    from filmmargin.development import run_development_regressions
+    game_grades, games = synthetic
+    game_grades = game_grades.copy()
+    game_grades.loc[game_grades.index[::53], 'home_team'] = None
+    env = StandInEnvironment(game_grades, games)
+    try:
+        results = [
+            run_development_regressions(
+                total_rounds=6, workers=workers, seed=3,
+                regularization=('ridge',)
+            )
+            for workers in [1, 2]
+        ]
+    finally:
+        env.close()
+    for serial, pooled in zip(*results):
+        pd.testing.assert_frame_equal(serial, pooled)
@@ -0,0 +1,77 @@
+import numpy
+import pandas as pd
+
+from filmmargin.DataLoader.gameindex import GameIndex, encode_keys, encode_team
+
+fields = ['season', 'week', 'home_team', 'away_team']
+
+def merged_ids(grades, games):
+    '''
+    game_ids from the four key merge the index replaced
+    '''
+    return pd.merge(
+        grades[fields],
+        games[~pd.isnull(games['result'])][['game_id'] + fields],
+        on=fields, how='left'
+    )['game_id']
+
+def with_unmatched(grades):
+    '''
+    The grades plus rows with no completed game: a bad team, a missing
+    week, and a game that was never played
+    '''
+    extra = grades.iloc[:3][fields].copy()
+    extra['home_team'] = ['NOPE', extra['home_team'].iloc[1], 'XX']
+    extra['week'] = [extra['week'].iloc[0], numpy.nan, 30]
+    return pd.concat([grades[fields], extra], ignore_index=True)
+
+def test_encode_keys_are_unique_and_invalid_rows_are_negative(synthetic):
+    games = synthetic[1]
+    keys = encode_keys(games['season'], games['week'], games['home_team'], games['away_team'])
+    assert (keys >= 0).all()
+    assert len(numpy.unique(keys)) == len(games)
+    assert encode_team('kc') == encode_team('KC')
+    assert encode_team('') == -1 and encode_team('ABCD') == -1 and encode_team(None) == -1
+    bad = encode_keys([2010, 1850, 2010], [1, 1, numpy.nan], ['KC', 'KC', 'KC'], ['LV', 'LV', 'LV'])
+    assert bad[0] >= 0 and (bad[1:] == -1).all()
+
+def test_lookup_matches_merge(synthetic):
+    game_grades, games = synthetic
+    grades = with_unmatched(game_grades)
+    index = GameIndex.from_games(games)
+    game_ids, matched = index.lookup(
+        grades['season'], grades['week'], grades['home_team'], grades['away_team']
+    )
+    expected = merged_ids(grades, games)
+    assert (matched == expected.notna().to_numpy()).all()
+    assert list(pd.Series(game_ids)[matched]) == list(expected[matched])
+    unmatched = index.unmatched(grades, matched)
+    assert unmatched['rows'].sum() == (~matched).sum()
+    assert list(unmatched.columns) == fields + ['rows']
+
+def test_index_round_trips_and_adds_new_games(synthetic):
+    games = synthetic[1]
+    ## index the first season, then add the rest as if they finished later ##
+    first = games[games['season'] == games['season'].min()]
+    index = GameIndex.from_games(first)
+    assert index.add(games) == (~pd.isnull(games['result'])).sum() - (~pd.isnull(first['result'])).sum()
+    assert index.add(games) == 0
+    full = GameIndex.from_games(games)
+    assert (index.keys == full.keys).all()
+    assert list(index.game_ids) == list(full.game_ids)
+    ## a saved index reloads as is ##
+    reloaded = GameIndex.from_frame(index.to_frame())
+    assert (reloaded.keys == index.keys).all()
+    assert list(reloaded.game_ids) == list(index.game_ids)
+    ## a game whose id changes is updated ##
+    renamed = games.copy()
+    renamed.loc[renamed.index[0], 'game_id'] = 'renamed'
+    assert index.add(renamed) == 1
+    row = renamed.iloc[[0]]
+    game_ids, matched = index.lookup(row['season'], row['week'], row['home_team'], row['away_team'])
+    assert matched.all() and game_ids[0] == 'renamed'
+
+def test_empty_index_matches_nothing():
+    game_ids, matched = GameIndex().lookup([2010], [1], ['KC'], ['LV'])
+    assert not matched.any()
+    assert pd.isnull(game_ids[0])
@@ -0,0 +1,82 @@
+import json
+
+from filmmargin.Profiler import Profiler
+
+def test_events_are_bounded_and_the_summary_counts_every_stage(tmp_path):
+    profiler = Profiler(trace_memory=False, profile=False, max_events=5)
+    for index in range(0, 20):
+        with profiler.stage('outer', index=index):
+            with profiler.stage('inner'):
+                pass
+    assert len(profiler.events) == 5
+    assert profiler.events[-1]['stage'] == 'outer' and profiler.events[-1]['index'] == 19
+    summary = {stage['stage'] : stage for stage in profiler.summary()}
+    assert summary['outer']['count'] == 20 and summary['inner']['count'] == 20
+    assert summary['inner']['depth'] == 1
+    assert [stage['stage'] for stage in profiler.summary()] == ['outer', 'inner']
+    profiler.write_report(tmp_path / 'report.json')
+    with open(tmp_path / 'report.json', 'r') as fp:
+        report = json.load(fp)
+    assert len(report['events']) == 5 and report['summary'][0]['count'] == 20
+
+def test_run_starts_a_new_summary(tmp_path):
+    profiler = Profiler(trace_memory=False, profile=False, report_path=tmp_path / 'run.json')
+    with profiler.stage('before'):
+        pass
+    with profiler.run('update'):
+        with profiler.stage('load'):
+            pass
+    assert [stage['stage'] for stage in profiler.summary()] == ['update', 'load']
+    assert (tmp_path / 'run.json').exists()
+
+def test_stages_on_daemon_threads_keep_their_parent():
+    from filmmargin.Profiler import profiler
+    from filmmargin.DataLoader.dataloader import run_in_daemon
+    from filmmargin.Supabase.supabase import map_in_daemons
+    def page(index):
+        with profiler.stage('page', index=index):
+            return index
+    def fetch():
+        with profiler.stage('fetch'):
+            return map_in_daemons(page, list(range(0, 4)), 2)
+    with profiler.run('load'):
+        assert run_in_daemon(fetch).result(timeout=10) == [0, 1, 2, 3]
+        events = list(profiler.events)
+    ## a thread started outside any stage has no parent ##
+    run_in_daemon(page, 4).result(timeout=10)
+    pages = [event for event in events if event['stage'] == 'page']
+    assert [(event['parent'], event['depth']) for event in pages] == [('fetch', 2)] * 4
+    assert (profiler.events[-1]['parent'], profiler.events[-1]['depth']) == (None, 0)
+    fetch_event = [event for event in events if event['stage'] == 'fetch'][0]
+    assert (fetch_event['parent'], fetch_event['depth']) == ('load', 1)
+
+def test_peak_is_not_reset_under_a_stage_on_another_thread():
+    import threading
+    import tracemalloc
+    profiler = Profiler(trace_memory=True, profile=False)
+    tracemalloc.start()
+    try:
+        opened = threading.Event()
+        done = threading.Event()
+        def background():
+            with profiler.stage('background'):
+                opened.set()
+                done.wait(10)
+        thread = threading.Thread(target=background)
+        with profiler.stage('outer'):
+            block = bytearray(8 * 1024 ** 2)
+            del block
+            thread.start()
+            opened.wait(10)
+            ## the background stage didn't reset the outer stage's peak,
+            ## and nor does this one reset the background's ##
+            with profiler.stage('inner'):
+                pass
+            done.set()
+            thread.join()
+    finally:
+        tracemalloc.stop()
+    peaks = {event['stage'] : event['peak_mb'] for event in profiler.events}
+    assert peaks['outer'] >= 8
+    assert peaks['background'] > 7.5 and peaks['inner'] > 7.5
+    assert profiler.open == {}
@@ -0,0 +1,275 @@
+import numpy
+import pandas as pd
+import pytest
+import statsmodels.api as sm
+
+from filmmargin.Regression import Regression
+from filmmargin.Regression.regression import solve_normal_equations, GramSweep, ols
+from benchmarks.synthetic import generate
+from benchmarks.suite import prepare_loader
+
+def design(rng, n=200, k=4, duplicate=False):
+    x = rng.normal(0, 1, (n, k))
+    if duplicate:
+        x[:, -1] = x[:, 0]
+    y = x @ rng.normal(0, 1, k) + rng.normal(0, 1, n)
+    return x, y
+
+@pytest.mark.parametrize('duplicate', [False, True])
+def test_solve_normal_equations_matches_statsmodels(duplicate):
+    x, y = design(numpy.random.default_rng(0), duplicate=duplicate)
+    x = sm.add_constant(x)
+    expected = sm.OLS(y, x).fit().params
+    betas = solve_normal_equations(x.T @ x, (x.T @ y)[:, None])[:, 0]
+    numpy.testing.assert_allclose(betas, expected, rtol=0, atol=1e-10)
+
+def test_stacked_systems_mix_solve_and_pinv():
+    rng = numpy.random.default_rng(1)
+    systems = [sm.add_constant(design(rng, duplicate=index % 2 == 1)[0]) for index in range(0, 4)]
+    ys = [rng.normal(0, 1, (200, 2)) for _ in systems]
+    betas = solve_normal_equations(
+        numpy.stack([x.T @ x for x in systems]),
+        numpy.stack([x.T @ y for x, y in zip(systems, ys)])
+    )
+    for index, (x, y) in enumerate(zip(systems, ys)):
+        for dep in range(0, 2):
+            numpy.testing.assert_allclose(
+                betas[index, :, dep], sm.OLS(y[:, dep], x).fit().params,
+                rtol=0, atol=1e-10
+            )
+
+def test_ols_matches_statsmodels():
+    x, y = design(numpy.random.default_rng(2))
+    x = x * 50 + 65
+    params = sm.OLS(y, sm.add_constant(x)).fit().params
+    coefs, const = ols(x, y)
+    numpy.testing.assert_allclose(coefs, params[1:], rtol=0, atol=1e-10)
+    assert abs(const - params[0]) < 1e-10
+
+@pytest.mark.parametrize('duplicate', [False, True])
+def test_gram_sweep_leave_one_out_matches_statsmodels(duplicate):
+    rng = numpy.random.default_rng(3)
+    x, y = design(rng, n=300, k=5)
+    ## rows missing one field only count towards the model without it ##
+    x[rng.random(x.shape) < 0.03] = numpy.nan
+    y[rng.random(len(y)) < 0.02] = numpy.nan
+    if duplicate:
+        ## a field passed twice, NAs and all ##
+        x[:, -1] = x[:, 0]
+    sweep = GramSweep(x, y)
+    betas = sweep.solve_leave_one_out()
+    rsq = sweep.leave_one_out_rsq(betas)
+    tss = numpy.nansum((y - numpy.nanmean(y)) ** 2)
+    for left_out in range(0, x.shape[1]):
+        fields = [i for i in range(0, x.shape[1]) if i != left_out]
+        rows = ~numpy.isnan(x[:, fields]).any(axis=1) & ~numpy.isnan(y)
+        fit = sm.OLS(y[rows], sm.add_constant(x[rows][:, fields])).fit()
+        numpy.testing.assert_allclose(
+            betas[left_out, :-1, 0], fit.params[1:], rtol=0, atol=1e-10
+        )
+        assert abs(rsq[left_out, 0] - (1 - min(1, fit.ssr / tss))) < 1e-10
+
+@pytest.mark.parametrize('fields', [
+    ['overall_grade', 'pass_grade', 'run_defense_grade', 'coverage_defense_grade'],
+    ['overall_grade', 'pass_grade', 'pass_grade', 'run_defense_grade'],
+])
+def test_leave_one_out_matches_statsmodels_backend(fields):
+    loader = prepare_loader(*generate(seasons=3, seed=4, missing_rate=0.02), steps=3)
+    results = {
+        backend : Regression(
+            loader.flat_game_grades, fields, 'margin', ['season', 'team'],
+            backend=backend, seed=0
+        ).leave_one_out(['margin', 'seasonal_margin'])
+        for backend in ['numpy', 'statsmodels']
+    }
+    for fast, reference in zip(results['numpy'], results['statsmodels']):
+        assert fast['field_left_out'] == reference['field_left_out']
+        assert fast['dependent'] == reference['dependent']
+        for rsq in ['train_rsq', 'test_rsq']:
+            assert abs(fast[rsq] - reference[rsq]) < 1e-10
+
+def test_full_train_fits_and_bootstraps_every_row():
+    from filmmargin.Regression import bootstrap_regression
+    df = prepare_loader(*generate(seasons=2, seed=5), steps=3).flat_game_grades
+    fields = ['overall_grade', 'pass_grade']
+    reg = Regression(df, fields, 'margin', ['season', 'team'], full_train=True)
+    assert reg.train_rows.all() and not reg.test_rows.any()
+    assert len(reg.train_df) == len(df)
+    reg.train()
+    coefs, const = ols(df[fields].to_numpy(), df['margin'].to_numpy())
+    numpy.testing.assert_allclose(reg.coefs, coefs, rtol=0, atol=1e-10)
+    ## intervals describe the stored fit, so they straddle its coefs ##
+    intervals = bootstrap_regression(reg, replicates=200, seed=0, workers=1)
+    for field, coef in zip(fields, reg.coefs):
+        assert intervals[field]['lower'] < coef < intervals[field]['upper']
+
+def standardized(x, y):
+    xc = x - x.mean(axis=0)
+    scale = numpy.sqrt((xc ** 2).mean(axis=0))
+    scale[scale == 0] = 1.0
+    return xc / scale, y - y.mean(axis=0), scale
+
+def path_for(x, y, method, penalties, l1_ratio=0.5):
+    from filmmargin.Regression.paths import RegularizationPath
+    sweep = GramSweep(x, y)
+    return RegularizationPath(sweep.gram, x.shape[1], method, penalties, l1_ratio)
+
+def test_ridge_path_matches_closed_form():
+    x, y = design(numpy.random.default_rng(6), n=250, k=5)
+    x = x * [1, 10, 0.1, 5, 2] + 40
+    penalties = numpy.array([10.0, 1.0, 0.1, 0.001])
+    path = path_for(x, y, 'ridge', penalties)
+    xs, yc, scale = standardized(x, y)
+    n = len(x)
+    for index, penalty in enumerate(penalties):
+        expected = numpy.linalg.solve(xs.T @ xs + n * penalty * numpy.eye(x.shape[1]), xs.T @ yc)
+        numpy.testing.assert_allclose(path.std_coefs[index, :, 0], expected, rtol=0, atol=1e-10)
+        ## betas undo the standardization, and predict like the closed form ##
+        betas = path.betas()[index, :, 0]
+        numpy.testing.assert_allclose(
+            (x - x.mean(axis=0)) @ betas[:-1] + betas[-1] + y.mean(),
+            xs @ expected + y.mean(), rtol=0, atol=1e-8
+        )
+
+@pytest.mark.parametrize('method', ['lasso', 'elastic_net'])
+@pytest.mark.parametrize('duplicate', [False, True])
+def test_lasso_and_elastic_net_paths_meet_kkt(method, duplicate):
+    x, y = design(numpy.random.default_rng(7), n=300, k=6, duplicate=duplicate)
+    ## correlated fields are the slow case for descent ##
+    x[:, 1] = x[:, 1] * 0.2 + x[:, 2]
+    y = numpy.stack([y, y * 0.5 + x[:, 3]], axis=1)
+    path = path_for(x, y, method, None, l1_ratio=0.3)
+    xs, yc, scale = standardized(x, y)
+    n = len(x)
+    l1 = path.l1
+    for index in numpy.linspace(0, len(path.penalties) - 1, 8).astype(int):
+        penalty = path.penalties[index]
+        for dep in range(0, y.shape[1]):
+            coefs = path.std_coefs[index, :, dep]
+            gradient = xs.T @ (yc[:, dep] - xs @ coefs) / n - penalty * (1 - l1) * coefs
+            active = coefs != 0
+            tol = 1e-6 * numpy.abs(yc[:, dep]).std()
+            ## active fields sit on the penalty, the rest under it ##
+            assert numpy.all(numpy.abs(
+                gradient[active] - penalty * l1 * numpy.sign(coefs[active])
+            ) < tol)
+            assert numpy.all(numpy.abs(gradient[~active]) <= penalty * l1 + tol)
+    ## the largest penalty zeroes everything ##
+    assert (path.features()[0] == 0).all()
+
+@pytest.mark.parametrize('method', ['ridge', 'lasso', 'elastic_net'])
+def test_path_survives_constant_and_duplicate_fields(method):
+    x, y = design(numpy.random.default_rng(8), n=200, k=4)
+    x[:, 1] = 3.0
+    x[:, 3] = x[:, 0]
+    path = path_for(x, y, method, None)
+    betas = path.betas()
+    assert numpy.isfinite(betas).all()
+    ## the constant field never gets a coef ##
+    assert (path.std_coefs[:, 1] == 0).all()
+    rsq = path.rsq()
+    assert numpy.isfinite(rsq).all()
+    assert (rsq <= 1).all()
+    ## near ols, the fit is as good as ols on the fields that vary ##
+    params = sm.OLS(y, sm.add_constant(x[:, [0, 2]])).fit()
+    assert abs(rsq[-1, 0] - params.rsquared) < 1e-3
+
+def test_path_rsq_uses_the_sweep_tss():
+    ## rows missing a field are out of the fit, but not the tss ##
+    df = prepare_loader(*generate(seasons=3, seed=9, missing_rate=0.05), steps=3).flat_game_grades
+    fields = ['overall_grade', 'pass_grade', 'run_defense_grade']
+    reg = Regression(df, fields, 'margin', ['season', 'team'], seed=0)
+    grid, features, train_rsq, test_rsq = reg.path_rsq(
+        ['margin'], methods=['ridge'], penalties=[1e-9]
+    )['ridge']
+    ## so a near ols ridge scores like calc_rsq on the same fit ##
+    train = df[reg.train_rows][fields + ['margin']].dropna()
+    coefs, const = ols(train[fields].to_numpy(), train['margin'].to_numpy())
+    for rows, rsq in [(reg.train_rows, train_rsq), (reg.test_rows, test_rsq)]:
+        frame = df[rows]
+        complete = frame[fields + ['margin']].dropna()
+        rss = ((
+            complete['margin'].to_numpy(dtype=float) -
+            complete[fields].to_numpy(dtype=float) @ coefs - const
+        ) ** 2).sum()
+        y = frame['margin'].to_numpy(dtype=float)
+        tss = numpy.nansum((y - numpy.nanmean(y)) ** 2)
+        assert abs(rsq[0, 0] - (1 - min(1, rss / tss))) < 1e-6
+
+@pytest.fixture(scope='module')
+def flat():
+    return prepare_loader(*generate(seasons=3, seed=10), steps=3).flat_game_grades
+
+def test_split_masks_are_seeded(flat):
+    from filmmargin.Regression import SplitGenerator
+    splits = SplitGenerator(flat, ['season', 'team'])
+    masks = splits.masks(200, seed=11)
+    groups = flat.groupby(['season', 'team'], observed=True).ngroups
+    assert masks.shape == (200, groups) and splits.n_groups == groups
+    numpy.testing.assert_array_equal(masks, splits.masks(200, seed=11))
+    assert not (masks == splits.masks(200, seed=12)).all()
+    assert abs(masks.mean() - splits.train_share) < 0.01
+    ## each round trains on about the share of groups ##
+    assert (numpy.abs(masks.mean(axis=1) - splits.train_share) < 0.2).all()
+
+def test_split_keeps_groups_together(flat):
+    from filmmargin.Regression import SplitGenerator
+    df = flat.copy()
+    df['team'] = df['team'].astype(object)
+    df.loc[df.index[::41], 'team'] = numpy.nan
+    splits = SplitGenerator(df, ['season', 'team'], train_share=0.5)
+    masks = splits.masks(20, seed=13)
+    rows = splits.row_mask(masks)
+    assert rows.shape == (20, len(df))
+    ## rows missing a windowing field train in no round ##
+    assert not rows[:, df['team'].isna().to_numpy()].any()
+    keys = df['season'].astype(str) + '_' + df['team'].astype(str)
+    for round_rows in rows:
+        sides = pd.Series(round_rows).groupby(keys.to_numpy()).nunique()
+        assert (sides == 1).all()
+    train, test = splits.split(df, masks[0])
+    assert len(train) == rows[0].sum()
+    assert len(train) + len(test) == df['team'].notna().sum()
+    assert set(keys[rows[0]]).isdisjoint(set(test['season'].astype(str) + '_' + test['team'].astype(str)))
+
+@pytest.mark.parametrize('seed', [0, 1, 2])
+def test_field_matrix_matches_dropna(seed):
+    from filmmargin.Regression import FieldMatrix
+    rng = numpy.random.default_rng(seed)
+    n = 517
+    df = pd.DataFrame({
+        'a' : rng.normal(0, 1, n),
+        'b' : rng.normal(0, 1, n).astype(numpy.float32),
+        'c' : rng.integers(0, 10, n),
+        'd' : rng.normal(0, 1, n),
+        'empty' : numpy.nan,
+        'team' : 'KC'
+    })
+    for col, rate in [('a', 0.1), ('b', 0.3), ('d', 0.02)]:
+        df.loc[rng.random(n) < rate, col] = numpy.nan
+    df['c'] = df['c'].astype('Int64')
+    df.loc[rng.random(n) < 0.05, 'c'] = pd.NA
+    matrix = FieldMatrix(df)
+    assert 'team' not in matrix and 'empty' in matrix
+    for fields in [['a'], ['a', 'b'], ['b', 'd', 'c'], ['a', 'b', 'c', 'd'], ['d', 'empty'], []]:
+        expected = df[fields].dropna()
+        numpy.testing.assert_array_equal(
+            matrix.valid(fields), df.index.isin(expected.index)
+        )
+        if len(fields) == 0:
+            continue
+        numpy.testing.assert_array_equal(
+            matrix.gather(fields, matrix.valid(fields)),
+            expected.to_numpy(dtype=numpy.float64)
+        )
+        ## positions and a random subset of rows gather the same ##
+        rows = numpy.sort(rng.choice(n, 50, replace=False))
+        numpy.testing.assert_array_equal(
+            matrix.gather(fields, rows),
+            df[fields].iloc[rows].to_numpy(dtype=numpy.float64, na_value=numpy.nan)
+        )
+    ## every row of an all missing field is dropped ##
+    assert not matrix.valid(['empty']).any()
+    assert matrix.gather(['a', 'empty'], matrix.valid(['a', 'empty'])).shape == (0, 2)
+    ## adjacent columns over every row are a view ##
+    assert numpy.shares_memory(matrix.gather(['a', 'b']), matrix.values)
@@ -0,0 +1,107 @@
+import numpy
+import pandas as pd
+import pytest
+
+from filmmargin.Regression import ResultStore
+
+dependents = ['margin', 'seasonal_margin']
+## a field passed twice is summarized over both of its fits ##
+fields = ['overall_grade', 'pass_grade', 'run_grade', 'pass_grade']
+methods = ['ridge', 'lasso']
+penalties = {'ridge' : [10.0, 1.0, 0.1], 'lasso' : [1.0, 0.5, 0.25]}
+
+def round_results(round_num):
+    '''
+    Seeded results of a round, with a few fits that failed (NaN)
+    '''
+    rng = numpy.random.default_rng(round_num)
+    train_rsq = rng.uniform(0, 1, (len(fields), len(dependents)))
+    test_rsq = rng.uniform(-0.2, 1, (len(fields), len(dependents)))
+    test_rsq[rng.uniform(size=test_rsq.shape) < 0.1] = numpy.nan
+    paths = {
+        method : (
+            rng.integers(1, len(fields) + 1, (3, len(dependents))),
+            rng.uniform(0, 1, (3, len(dependents))),
+            rng.uniform(0, 1, (3, len(dependents)))
+        ) for method in methods
+    }
+    return round_num, train_rsq, test_rsq, paths
+
+def records_summary(rounds):
+    '''
+    The summary the development run used to build from a frame of records
+    '''
+    records = []
+    for round_num, train_rsq, test_rsq, _ in rounds:
+        for i, field in enumerate(fields):
+            for j, dependent in enumerate(dependents):
+                records.append({
+                    'run_group' : round_num + 1, 'dependent' : dependent,
+                    'field_left_out' : field,
+                    'train_rsq' : train_rsq[i, j], 'test_rsq' : test_rsq[i, j]
+                })
+    df = pd.DataFrame(records)
+    for rsq in ['train_rsq', 'test_rsq']:
+        df['{0}_lift'.format(rsq)] = df[rsq] - df.groupby(
+            ['run_group', 'dependent']
+        )[rsq].transform('mean')
+    return df.groupby(['field_left_out', 'dependent']).agg(
+        train_avg_rsq = ('train_rsq', 'mean'),
+        test_avg_rsq = ('test_rsq', 'mean'),
+        train_lift_when_excluded = ('train_rsq_lift', 'mean'),
+        test_lift_when_excluded = ('test_rsq_lift', 'mean'),
+    ).reset_index()
+
+def by_key(df):
+    return df.sort_values(['field_left_out', 'dependent']).reset_index(drop=True)
+
+def test_summary_matches_records():
+    rounds = [round_results(round_num) for round_num in range(0, 6)]
+    store = ResultStore(8, dependents, fields)
+    for round_num, train_rsq, test_rsq, _ in rounds:
+        store.add(round_num, train_rsq, test_rsq)
+    assert store.pending() == [6, 7]
+    pd.testing.assert_frame_equal(
+        by_key(store.summarize()), by_key(records_summary(rounds)), check_dtype=False
+    )
+
+def test_checkpointed_run_resumes_where_it_stopped(tmp_path):
+    rounds = [round_results(round_num) for round_num in range(0, 5)]
+    meta = {'seed' : 7, 'rows' : 100}
+    store = ResultStore(5, dependents, fields, methods, penalties, tmp_path, meta=meta)
+    for result in rounds[:3]:
+        store.add(*result)
+    store.checkpoint()
+    del store
+    ## a different setup isn't resumed ##
+    with pytest.raises(ValueError, match='rows'):
+        ResultStore(5, dependents, fields, methods, penalties, tmp_path, meta={'seed' : 7, 'rows' : 99})
+    resumed = ResultStore(5, dependents, fields, methods, penalties, tmp_path, meta=meta)
+    assert resumed.pending() == [3, 4]
+    assert ResultStore.read_meta(tmp_path)['seed'] == 7
+    for round_num in resumed.pending():
+        resumed.add(*rounds[round_num])
+    resumed.checkpoint()
+    ## the same as a run that was never interrupted ##
+    whole = ResultStore(5, dependents, fields, methods, penalties)
+    for result in rounds:
+        whole.add(*result)
+    pd.testing.assert_frame_equal(resumed.summarize(), whole.summarize())
+    pd.testing.assert_frame_equal(resumed.summarize_paths(), whole.summarize_paths())
+
+def test_path_summary_selects_the_best_penalty():
+    rounds = [round_results(round_num) for round_num in range(0, 4)]
+    store = ResultStore(4, dependents, fields, methods, penalties)
+    for result in rounds:
+        store.add(*result)
+    path = store.summarize_paths()
+    assert len(path) == len(dependents) * len(methods) * 3
+    for (dependent, method), group in path.groupby(['dependent', 'method']):
+        j = dependents.index(dependent)
+        expected = numpy.mean([r[3][method][2][:, j] for r in rounds], axis=0)
+        grid = penalties[method]
+        numpy.testing.assert_allclose(
+            group.sort_values('penalty', ascending=False)['test_avg_rsq'],
+            expected[numpy.argsort(grid)[::-1]]
+        )
+        assert group[group['selected']]['test_avg_rsq'].iloc[0] == expected.max()
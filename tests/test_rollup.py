@@ -0,0 +1,136 @@
+import logging
+
+import numpy
+import pandas as pd
+import pytest
+
+from benchmarks.suite import prepare_loader
+from filmmargin.filmmargin import output_columns, upsert_margins
+from filmmargin.Rollup import TeamRollup
+
+def scored(flat, seed):
+    '''
+    Margins of the flat grades with seeded film margins, some missing
+    '''
+    rng = numpy.random.default_rng(seed)
+    df = flat.copy()
+    df['margin'] = df['pf'] - df['pa']
+    for col in ['film_margin', 'film_margin_predictive', 'film_margin_old_model']:
+        df[col] = rng.normal(0, 10, len(df))
+        df.loc[rng.uniform(size=len(df)) < 0.05, col] = numpy.nan
+    return df[output_columns].reset_index(drop=True)
+
+@pytest.fixture(scope='module')
+def margins(synthetic):
+    return scored(prepare_loader(*synthetic, steps=3).flat_game_grades, 0)
+
+def test_seasons_match_a_groupby(margins):
+    seasons = TeamRollup.from_margins(margins).seasons()
+    expected = margins.groupby(['team', 'season']).agg(
+        games=('game_id', 'size'),
+        film_margin_avg=('film_margin', 'mean'),
+        margin_avg=('margin', 'mean'),
+        film_margin_games=('film_margin', 'count')
+    ).reset_index()
+    merged = seasons.merge(expected, on=['team', 'season'], suffixes=('', '_expected'))
+    assert len(merged) == len(seasons) == len(expected)
+    for col in ['games', 'film_margin_avg', 'margin_avg', 'film_margin_games']:
+        numpy.testing.assert_allclose(merged[col], merged['{0}_expected'.format(col)])
+
+def test_team_season_through_a_week_and_form(margins):
+    rollup = TeamRollup.from_margins(margins, form_games=3)
+    team, season = margins['team'].iloc[0], margins['season'].iloc[0]
+    games = margins[(margins['team'] == team) & (margins['season'] == season)].sort_values('week')
+    week = int(games['week'].iloc[5])
+    row = rollup.team_season(team, season, week)
+    through = games[games['week'] <= week]
+    assert row['games'] == len(through)
+    numpy.testing.assert_allclose(row['margin_avg'], through['margin'].mean())
+    numpy.testing.assert_allclose(row['margin_last_3'], through['margin'].iloc[-3:].mean())
+    assert rollup.team_season(team, season, 0) is None
+    assert rollup.team_season('NOPE', season) is None
+
+def test_leaderboard_is_sorted(margins):
+    rollup = TeamRollup.from_margins(margins)
+    season = int(margins['season'].max())
+    board = rollup.leaderboard(season)
+    assert len(board) == margins[margins['season'] == season]['team'].nunique()
+    assert board['film_margin_avg'].is_monotonic_decreasing
+    assert list(rollup.leaderboard(season, by='team', ascending=True)['team']) == sorted(board['team'])
+    with pytest.raises(ValueError):
+        rollup.leaderboard(season, by='nope')
+
+def test_refresh_matches_a_full_rollup(margins):
+    ## an incremental update reloads the last weeks, which changes some of
+    ## their margins and adds the week after ##
+    weeks = margins[['season', 'week']].drop_duplicates().sort_values(['season', 'week'])
+    cutoff = tuple(weeks.iloc[-3])
+    keys = pd.MultiIndex.from_frame(margins[['season', 'week']])
+    existing = margins[keys < cutoff].reset_index(drop=True)
+    refreshed = scored(margins, 1)[
+        (keys >= tuple(weeks.iloc[-4])) & (keys <= cutoff)
+    ].reset_index(drop=True)
+    combined, _, added = upsert_margins(existing, refreshed)
+    assert added > 0
+    rollup = TeamRollup.from_margins(existing)
+    rebuilt = rollup.refresh(combined, refreshed)
+    assert rebuilt == refreshed[['team', 'season']].drop_duplicates().shape[0]
+    pd.testing.assert_frame_equal(
+        rollup.to_frame(), TeamRollup.from_margins(combined).to_frame()
+    )
+    assert rollup.refresh(combined, refreshed.iloc[:0]) == 0
+
+def test_frame_round_trip(margins, tmp_path):
+    rollup = TeamRollup.from_margins(margins)
+    frame = rollup.to_frame()
+    pd.testing.assert_frame_equal(TeamRollup.from_frame(frame).to_frame(), frame)
+    with pytest.raises(ValueError):
+        TeamRollup.from_frame(frame, form_games=5)
+
+def through(game_grades, season, week):
+    return game_grades[
+        (game_grades['season'] < season) |
+        ((game_grades['season'] == season) & (game_grades['week'] <= week))
+    ].reset_index(drop=True)
+
+def run(game_grades, games, path, **kwargs):
+    '''
+    Runs update_margins against a stand in server of the grades
+    '''
+    from benchmarks.suite import StandInEnvironment
+    from filmmargin.filmmargin import update_margins
+    env = StandInEnvironment(game_grades, games)
+    try:
+        update_margins(output_path=str(path), **kwargs)
+    finally:
+        env.close()
+
+def test_rollup_updated_without_a_rollup_is_rebuilt(synthetic, tmp_path, caplog):
+    from filmmargin.Rollup import rollup_paths
+    from filmmargin.Writer import read_margins
+    caplog.set_level(logging.INFO, logger='filmmargin')
+    game_grades, games = synthetic
+    path = tmp_path / 'film_margins.csv'
+    first = int(game_grades['season'].min())
+    run(through(game_grades, first, 10), games, path, rollup=True)
+    ## the margins move into the next season without the rollup. The
+    ## weeks csv rounds its sums, so rollups are compared to 1e-3 ##
+    run(through(game_grades, first + 1, 5), games, path, incremental=True)
+    ## so refreshing the reloaded team seasons alone would leave the end
+    ## of the first season out ##
+    run(game_grades, games, path, incremental=True, rollup=True)
+    assert 'rebuilding the rollup' in caplog.text
+    expected = TeamRollup.from_margins(read_margins(path)).to_frame()
+    pd.testing.assert_frame_equal(
+        TeamRollup.read(rollup_paths(path)['weeks']).to_frame(), expected,
+        check_exact=False, atol=1e-3
+    )
+    ## a rollup that is up to date is refreshed ##
+    caplog.clear()
+    run(game_grades, games, path, incremental=True, rollup=True)
+    assert 'rebuilding the rollup' not in caplog.text
+    assert 'team seasons rolled up' in caplog.text
+    pd.testing.assert_frame_equal(
+        TeamRollup.read(rollup_paths(path)['weeks']).to_frame(), expected,
+        check_exact=False, atol=1e-3
+    )
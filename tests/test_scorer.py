@@ -0,0 +1,62 @@
+import json
+import pathlib
+
+import numpy
+import pytest
+
+from benchmarks.suite import prepare_loader
+from benchmarks.synthetic import generate
+from filmmargin.Scorer import Scorer
+
+config_path = pathlib.Path(__file__).parent.parent.resolve() / 'config.json'
+
+@pytest.fixture(scope='module')
+def flat():
+    '''
+    Flat grades with some grades missing
+    '''
+    game_grades, games = generate(seasons=2, seed=1, missing_rate=0.05)
+    return prepare_loader(game_grades, games, steps=3).flat_game_grades
+
+def looped(df, coefs):
+    '''
+    A model's margin the way update_margins used to add it up, one field
+    at a time (in float64, since the flat grades are float32)
+    '''
+    margin = coefs['intercept']
+    for field, coef in coefs.items():
+        if field != 'intercept':
+            margin = margin + df[field].astype('float64') * coef
+    return margin.to_numpy(dtype=numpy.float64)
+
+def test_scores_match_the_per_model_loop(flat):
+    with open(config_path, 'r') as fp:
+        config = json.load(fp)
+    scored = Scorer.from_config(config_path).apply(flat.copy())
+    for model, column in [
+        ('descriptive', 'film_margin'), ('predictive', 'film_margin_predictive'),
+        ('legacy', 'film_margin_old_model')
+    ]:
+        expected = looped(flat, config[model])
+        assert numpy.isnan(expected).any()
+        numpy.testing.assert_allclose(scored[column], expected, rtol=1e-12, equal_nan=True)
+
+def test_missing_counts_only_fields_each_model_uses(flat):
+    models = {
+        'overall' : {'overall_grade' : 1.0, 'intercept' : 0.0},
+        'pass' : {'pass_grade' : 0.5, 'overall_grade' : 0.1, 'intercept' : 1.0}
+    }
+    scorer = Scorer(models)
+    margins = scorer.score(flat)
+    assert scorer.fields == ['overall_grade', 'pass_grade']
+    assert scorer.missing == {
+        'overall' : int(flat['overall_grade'].isna().sum()),
+        'pass' : int((flat['overall_grade'].isna() | flat['pass_grade'].isna()).sum())
+    }
+    for index, model in enumerate(scorer.models):
+        numpy.testing.assert_allclose(
+            margins[:, index], looped(flat, models[model]), equal_nan=True
+        )
+    ## models without a margin column are named after themselves ##
+    applied = scorer.apply(flat.copy(), columns={'pass' : 'pass_margin'})
+    assert 'overall' in applied and 'pass_margin' in applied
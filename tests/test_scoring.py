@@ -0,0 +1,27 @@
+import numpy
+import pandas as pd
+
+from filmmargin.scoring import score_grades
+
+fields = ['overall_grade', 'opponent_overall_grade', 'pass_grade', 'run_defense_grade']
+
+def grades(n=10):
+    rng = numpy.random.default_rng(0)
+    df = pd.DataFrame(rng.uniform(40, 90, (n, len(fields))), columns=fields)
+    df.insert(0, 'game_id', ['game_{0}'.format(i) for i in range(0, n)])
+    return df
+
+def test_stdout_matches_the_csv_file(tmp_path, capsys):
+    ## a chunk size that leaves a short last chunk ##
+    options = {'keep_columns' : ['game_id'], 'chunk_size' : 4}
+    assert score_grades(grades(), '-', **options) == 10
+    path = tmp_path / 'margins.csv'
+    assert score_grades(grades(), str(path), **options) == 10
+    assert capsys.readouterr().out == path.read_text()
+    scored = pd.read_csv(path)
+    assert list(scored.columns) == [
+        'game_id', 'film_margin', 'film_margin_predictive', 'film_margin_old_model'
+    ]
+    numpy.testing.assert_allclose(
+        scored['film_margin'], score_grades(grades())['film_margin'].round(4)
+    )
@@ -0,0 +1,176 @@
+import json
+import os
+import pathlib
+import shutil
+import time
+import urllib.error
+import urllib.request
+
+import numpy
+import pytest
+
+from benchmarks.suite import prepare_loader
+from benchmarks.synthetic import generate
+from filmmargin.Scorer import Scorer
+from filmmargin.Service import MarginService
+from filmmargin.Service.service import LRUCache
+
+config_path = pathlib.Path(__file__).parent.parent.resolve() / 'config.json'
+
+@pytest.fixture(scope='module')
+def flat():
+    '''
+    Flat grades of two synthetic seasons
+    '''
+    game_grades, games = generate(seasons=2, seed=2)
+    return prepare_loader(game_grades, games, steps=3).flat_game_grades
+
+@pytest.fixture
+def service(flat, tmp_path):
+    '''
+    A running service on a free port, with its own copy of the config
+    '''
+    config = tmp_path / 'config.json'
+    shutil.copy(config_path, config)
+    with MarginService(flat, config, port=0, cache_size=4, reload_interval=0.05) as service:
+        yield service
+
+def fetch(service, path, body=None):
+    '''
+    Returns the status and json of a request to the service
+    '''
+    request = urllib.request.Request(
+        service.url + path, data=body,
+        method='GET' if body is None else 'POST'
+    )
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        return e.code, json.loads(e.read())
+
+def test_margins_match_the_scorer(service, flat):
+    expected = Scorer.from_config(config_path).apply(flat.copy())
+    game_id = str(flat['game_id'].iloc[0])
+    status, rows = fetch(service, '/margins?game_id={0}'.format(game_id))
+    assert status == 200
+    game = expected[flat['game_id'].astype(str) == game_id]
+    assert sorted(row['team'] for row in rows) == sorted(game['team'])
+    for row in rows:
+        numpy.testing.assert_allclose(
+            row['film_margin'],
+            game.loc[game['team'] == row['team'], 'film_margin'].iloc[0], rtol=1e-6
+        )
+    ## a team's season comes back in week order ##
+    team, season = flat['team'].iloc[0], int(flat['season'].iloc[0])
+    status, rows = fetch(service, '/margins?team={0}&season={1}'.format(team, season))
+    assert status == 200
+    weeks = [row['week'] for row in rows]
+    assert weeks == sorted(weeks)
+    assert len(rows) == ((flat['team'] == team) & (flat['season'] == season)).sum()
+
+def test_rollup_and_leaderboard(service, flat):
+    team, season = flat['team'].iloc[0], int(flat['season'].iloc[0])
+    status, rollup = fetch(service, '/rollup?team={0}&season={1}&week=4'.format(team, season))
+    assert status == 200
+    rows = flat[(flat['team'] == team) & (flat['season'] == season) & (flat['week'] <= 4)]
+    expected = Scorer.from_config(config_path).apply(rows.copy())['film_margin'].mean()
+    assert abs(rollup['film_margin_avg'] - expected) < 1e-4
+    status, board = fetch(service, '/leaderboard?season={0}&by=film_margin_avg'.format(season))
+    assert status == 200
+    assert len(board) == flat.loc[flat['season'] == season, 'team'].nunique()
+    averages = [row['film_margin_avg'] for row in board]
+    assert averages == sorted(averages, reverse=True)
+
+def test_score_and_health(service, flat):
+    record = flat.iloc[0].to_dict()
+    status, margins = fetch(service, '/score', json.dumps(record, default=str).encode('utf-8'))
+    assert status == 200
+    expected = Scorer.from_config(config_path).apply(flat.iloc[:1].copy())
+    assert abs(margins[0]['film_margin'] - expected['film_margin'].iloc[0]) < 1e-4
+    ## fields left out of a record are missing ##
+    status, margins = fetch(service, '/score', b'[{"overall_grade": 70}]')
+    assert status == 200 and margins[0]['film_margin'] is None
+    status, health = fetch(service, '/health')
+    assert status == 200
+    assert health['rows'] == len(flat)
+    assert health['models'] == ['descriptive', 'predictive', 'legacy']
+    assert health['reloads'] == 1
+
+@pytest.mark.parametrize('path, body, status', [
+    ('/leaderboard?season=2020&by=not_a_column', None, 400),
+    ('/leaderboard?week=3', None, 400),
+    ('/margins?team=KC&season=last', None, 400),
+    ('/margins', None, 400),
+    ('/rollup?season=2020', None, 400),
+    ('/score', b'{not json', 400),
+    ('/score', b'[1, 2]', 400),
+    ('/score', b'"a grade"', 400),
+    ('/score', None, 405),
+    ('/margins?game_id=not_a_game', None, 404),
+    ('/nowhere', None, 404),
+])
+def test_bad_requests(service, path, body, status):
+    code, payload = fetch(service, path, body)
+    assert code == status
+    assert 'error' in payload
+
+def test_cache_hits_and_evicts(service, flat):
+    game_ids = flat['game_id'].astype(str).unique()[:6]
+    for game_id in game_ids[:2]:
+        fetch(service, '/margins?game_id={0}'.format(game_id))
+    fetch(service, '/margins?game_id={0}'.format(game_ids[0]))
+    stats = fetch(service, '/health')[1]['cache']
+    assert stats == {'size' : 2, 'hits' : 1, 'misses' : 2}
+    ## past cache_size, the least recently used is dropped ##
+    for game_id in game_ids[2:]:
+        fetch(service, '/margins?game_id={0}'.format(game_id))
+    assert fetch(service, '/health')[1]['cache']['size'] == 4
+    keys = list(service.store.cache.entries.keys())
+    assert ('game', game_ids[0]) not in keys and ('game', game_ids[1]) not in keys
+
+def test_lru_cache():
+    cache = LRUCache(max_size=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    ## b was used least recently ##
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats() == {'size' : 2, 'hits' : 3, 'misses' : 1}
+    ## a cache of no size holds nothing ##
+    empty = LRUCache(max_size=0)
+    empty.put('a', 1)
+    assert empty.get('a') is None
+
+def wait_for(check, timeout=10):
+    start = time.time()
+    while not check():
+        assert time.time() - start < timeout
+        time.sleep(0.02)
+
+def test_config_reloads_when_it_changes(service, flat):
+    game_id = str(flat['game_id'].iloc[0])
+    before = fetch(service, '/margins?game_id={0}'.format(game_id))[1]
+    with open(service.config_path, 'r') as fp:
+        config = json.load(fp)
+    config['descriptive']['intercept'] += 10
+    with open(service.config_path, 'w') as fp:
+        json.dump(config, fp)
+    ## mtimes can be coarse, so move it on explicitly ##
+    mtime = os.stat(service.config_path).st_mtime_ns + 10 ** 9
+    os.utime(service.config_path, ns=(mtime, mtime))
+    wait_for(lambda: fetch(service, '/health')[1]['reloads'] == 2)
+    ## the cache went with the old store, so margins are rescored ##
+    after = fetch(service, '/margins?game_id={0}'.format(game_id))[1]
+    for old, new in zip(before, after):
+        assert abs(new['film_margin'] - old['film_margin'] - 10) < 1e-6
+        assert new['film_margin_predictive'] == old['film_margin_predictive']
+    ## a broken config keeps the current models ##
+    with open(service.config_path, 'w') as fp:
+        fp.write('{broken')
+    os.utime(service.config_path, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+    wait_for(lambda: service.config_mtime == mtime + 10 ** 9)
+    assert fetch(service, '/health')[1]['reloads'] == 2
+    assert fetch(service, '/margins?game_id={0}'.format(game_id))[1] == after
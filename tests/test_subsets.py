@@ -0,0 +1,54 @@
+import itertools
+import warnings
+
+import numpy
+import pytest
+
+from filmmargin.Regression import SubsetSearch, search_subsets
+from filmmargin.Regression.regression import GramSweep
+
+def grams(duplicate):
+    rng = numpy.random.default_rng(0)
+    x = rng.normal(0, 1, (300, 6))
+    if duplicate:
+        x[:, 5] = x[:, 0]
+        x[:, 4] = x[:, 1] * 2
+    y = x @ rng.normal(0, 1, 6) + rng.normal(0, 1, 300)
+    train = GramSweep(x[:200], y[:200])
+    test = GramSweep(x[200:], y[200:], x_shift=train.x_shift, y_shift=train.y_shift)
+    return train.gram, test.gram
+
+def best_by_size(search, k):
+    '''
+    Best rss of each size from fitting every subset
+    '''
+    best = {}
+    for size in range(1, k + 1):
+        for subset in itertools.combinations(range(0, k), size):
+            a = search.model(subset)
+            if numpy.isfinite(a).all():
+                best[size] = min(best.get(size, numpy.inf), search.rss(a))
+    return best
+
+@pytest.mark.parametrize('duplicate', [False, True])
+def test_exhaustive_finds_the_best_subset_of_each_size(duplicate):
+    train_gram, test_gram = grams(duplicate)
+    search = SubsetSearch(train_gram, 6)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        found = search.exhaustive(incumbents=search.forward())
+    best = best_by_size(search, 6)
+    for subset, rss in found:
+        assert rss == pytest.approx(best[len(subset)], rel=1e-9)
+
+def test_collinear_fields_search_without_warnings():
+    train_gram, test_gram = grams(True)
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        records = search_subsets(
+            train_gram, test_gram, list('abcdef'), ['y'],
+            methods=('forward', 'backward', 'exhaustive')
+        )
+    ## collinear fields never join a model ##
+    assert max(record['features'] for record in records) == 4
+    assert all(numpy.isfinite(record['test_rsq']) for record in records)
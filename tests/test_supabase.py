@@ -0,0 +1,60 @@
+import pandas as pd
+import pytest
+
+from benchmarks.standin import StandInServer
+
+def expected_rows(grades, since=None):
+    if since is not None:
+        grades = grades[
+            (grades['season'] > since[0]) |
+            ((grades['season'] == since[0]) & (grades['week'] >= since[1]))
+        ]
+    return grades.sort_values(by=['game_id']).reset_index(drop=True)
+
+def test_offset_and_keyset_paging_return_the_same_rows(standin, client_for, synthetic):
+    offset = client_for(standin, page_size=250, workers=3).get_data()
+    keyset = client_for(standin, page_size=250, keyset=True).get_data()
+    pd.testing.assert_frame_equal(offset, keyset)
+    pd.testing.assert_frame_equal(
+        offset[synthetic[0].columns], expected_rows(synthetic[0]), check_dtype=False
+    )
+
+@pytest.mark.parametrize('keyset', [False, True])
+def test_since_only_returns_later_weeks(standin, client_for, synthetic, keyset):
+    since = (2010, 12)
+    df = client_for(standin, page_size=250, keyset=keyset).get_data(since=since)
+    pd.testing.assert_frame_equal(
+        df[synthetic[0].columns], expected_rows(synthetic[0], since), check_dtype=False
+    )
+
+def test_after_only_returns_larger_game_ids(standin, client_for, synthetic):
+    after = int(synthetic[0]['game_id'].iloc[500])
+    df = client_for(standin, page_size=250).get_data(after=after)
+    assert len(df) == int((synthetic[0]['game_id'] > after).sum())
+    assert df['game_id'].min() > after
+
+def test_failed_requests_are_retried(synthetic, client_for, caplog):
+    with StandInServer(synthetic[0], max_rows=100, fail_every=3) as server:
+        df = client_for(server, page_size=250, workers=1, backoff=0).get_data()
+    retries = [record for record in caplog.records if 'Retrying' in record.getMessage()]
+    ## every third request failed once ##
+    assert len(retries) == server.requests // 3
+    pd.testing.assert_frame_equal(
+        df[synthetic[0].columns], expected_rows(synthetic[0]), check_dtype=False
+    )
+
+def test_requests_fail_once_retries_run_out(synthetic, client_for):
+    with StandInServer(synthetic[0], fail_every=1) as server:
+        client = client_for(server, retries=2, backoff=0)
+        with pytest.raises(Exception):
+            client.get_data()
+        ## the first attempt and both retries ##
+        assert server.requests == 3
+
+def test_count_and_fingerprint(standin, client_for, synthetic):
+    client = client_for(standin)
+    grades = synthetic[0]
+    assert client.get_table_count() == len(grades)
+    assert client.get_table_count(since=(2011, 1)) == int((grades['season'] >= 2011).sum())
+    assert client.get_max_game_id() == grades['game_id'].max()
+    assert client.get_fingerprint() == '{0}-{1}'.format(len(grades), grades['game_id'].max())
@@ -0,0 +1,78 @@
+import numpy
+import pandas as pd
+import pytest
+
+from filmmargin.DataLoader.targets import TargetBuilder, parse_target
+
+names = [
+    'margin_season', 'margin_season_others', 'margin_rest_of_season',
+    'margin_season_to_date', 'margin_next_1', 'margin_next_3',
+    'margin_previous_2'
+]
+
+def frame(seed=0):
+    '''
+    Shuffled team weeks with unplayed games (NA margins) and a row missing
+    its team
+    '''
+    rng = numpy.random.default_rng(seed)
+    df = pd.DataFrame([
+        {'team' : team, 'season' : season, 'week' : week}
+        for team in ['KC', 'LV', 'BUF'] for season in [2020, 2021]
+        for week in range(1, 9)
+    ])
+    df['margin'] = rng.normal(0, 10, len(df)).round(1)
+    df.loc[rng.choice(len(df), 8, replace=False), 'margin'] = numpy.nan
+    df.loc[5, 'team'] = None
+    return df.sample(frac=1, random_state=seed).reset_index(drop=True)
+
+def looped(df, name):
+    '''
+    The target of each row from its group's rows, one row at a time
+    '''
+    value, horizon, games = parse_target(name)
+    target = numpy.full(len(df), numpy.nan)
+    for _, group in df.dropna(subset=['team']).groupby(['team', 'season']):
+        group = group.sort_values('week')
+        values = group[value].to_numpy()
+        for position, row in enumerate(group.index):
+            others = {
+                'season' : values,
+                'season_others' : numpy.delete(values, position),
+                'rest_of_season' : values[position + 1:],
+                'season_to_date' : values[:position],
+                'next' : values[position + 1:position + 1 + (games or 0)],
+                'previous' : values[max(position - (games or 0), 0):position],
+            }[horizon]
+            others = others[~numpy.isnan(others)]
+            if len(others) > 0:
+                target[row] = others.mean()
+    return target
+
+@pytest.mark.parametrize('name', names)
+def test_targets_match_a_loop_over_each_group(name):
+    df = frame()
+    numpy.testing.assert_allclose(
+        TargetBuilder(df).target(name), looped(df, name), equal_nan=True
+    )
+
+def test_build_matches_each_target_and_seasonal_mean():
+    df = frame(1)
+    builder = TargetBuilder(df)
+    targets = builder.build(names)
+    assert list(targets.columns) == names
+    assert targets.index.equals(df.index)
+    for name in names:
+        numpy.testing.assert_allclose(targets[name], builder.target(name), equal_nan=True)
+    ## the season target is the seasonal margin the loader always built ##
+    seasonal = df.groupby(['team', 'season'])['margin'].transform('mean')
+    numpy.testing.assert_allclose(targets['margin_season'], seasonal, equal_nan=True)
+
+def test_parse_target():
+    assert parse_target('margin_next_3') == ('margin', 'next', 3)
+    assert parse_target('seasonal_margin') is None
+    assert parse_target('home_pass_grade_season_others') == (
+        'home_pass_grade', 'season_others', None
+    )
+    with pytest.raises(ValueError):
+        TargetBuilder(frame()).target('margin')
@@ -0,0 +1,76 @@
+import numpy
+import pandas as pd
+
+from filmmargin.filmmargin import output_columns, upsert_margins, get_refresh_week
+
+def margins(game_ids, teams, seed=0):
+    rng = numpy.random.default_rng(seed)
+    n = len(game_ids)
+    df = pd.DataFrame({
+        'game_id' : game_ids,
+        'season' : 2020,
+        'week' : [int(game_id.split('_')[1]) for game_id in game_ids],
+        'team' : teams,
+        'opponent' : ['OPP'] * n,
+        'pf' : rng.integers(0, 40, n).astype(float),
+        'pa' : rng.integers(0, 40, n).astype(float),
+    })
+    df['margin'] = df['pf'] - df['pa']
+    for col in ['film_margin', 'film_margin_predictive', 'film_margin_old_model']:
+        df[col] = rng.normal(0, 10, n)
+    return df[output_columns]
+
+def test_upsert_updates_matches_and_appends_the_rest():
+    existing = margins(['2020_01_A', '2020_01_A', '2020_02_B', '2020_02_B'], ['KC', 'LV', 'KC', 'LV'])
+    new = margins(['2020_02_B', '2020_02_B', '2020_03_C'], ['LV', 'KC', 'KC'], seed=1)
+    ## KC's week 2 row only moves by rounding ##
+    new.loc[1, output_columns[5:]] = existing.loc[2, output_columns[5:]].to_numpy() + 1e-5
+    before = existing.copy()
+    combined, changed, added = upsert_margins(existing, new)
+    assert (changed, added) == (1, 1)
+    ## existing rows keep their place, and rows from new win ##
+    assert list(zip(combined['game_id'], combined['team'])) == [
+        ('2020_01_A', 'KC'), ('2020_01_A', 'LV'), ('2020_02_B', 'KC'),
+        ('2020_02_B', 'LV'), ('2020_03_C', 'KC')
+    ]
+    pd.testing.assert_frame_equal(combined.iloc[:2], existing.iloc[:2])
+    for row, new_row in [(2, 1), (3, 0), (4, 2)]:
+        assert combined.iloc[row].tolist() == new.iloc[new_row].tolist()
+    ## the existing frame isn't changed ##
+    pd.testing.assert_frame_equal(existing, before)
+
+def test_upsert_of_the_same_rows_changes_nothing():
+    existing = margins(['2020_01_A', '2020_01_A', '2020_02_B'], ['KC', 'LV', 'KC'])
+    existing.loc[0, 'film_margin'] = numpy.nan
+    combined, changed, added = upsert_margins(existing, existing.iloc[::-1].copy())
+    assert (changed, added) == (0, 0)
+    pd.testing.assert_frame_equal(combined, existing)
+
+def test_refresh_week_steps_back_by_lookback():
+    existing = margins(['2020_01_A', '2020_02_B', '2020_03_C', '2020_03_C'], ['KC'] * 4)
+    assert get_refresh_week(existing) == (2020, 3)
+    assert get_refresh_week(existing, lookback_weeks=2) == (2020, 2)
+    assert get_refresh_week(existing, lookback_weeks=10) == (2020, 1)
+
+def test_upsert_of_rows_missing_a_game_id():
+    ## games not in the games file yet have no game_id, for both teams ##
+    existing = margins(['2020_01_A', '2020_01_A'], ['KC', 'LV'])
+    new = margins(['2020_02_B', '2020_02_B', '2020_02_C', '2020_02_C'], ['KC', 'LV', 'NE', 'NYJ'], seed=1)
+    new.loc[:, 'game_id'] = numpy.nan
+    combined, changed, added = upsert_margins(existing, new)
+    assert (changed, added) == (0, 4)
+    assert combined['game_id'].isna().sum() == 4
+    ## once the game is known, its rows are updated rather than added again ##
+    resolved = new.copy()
+    resolved.loc[:, 'game_id'] = ['2020_02_B', '2020_02_B', '2020_02_C', '2020_02_C']
+    combined, changed, added = upsert_margins(combined, resolved)
+    assert (changed, added) == (4, 0)
+    assert combined['game_id'].tolist()[2:] == resolved['game_id'].tolist()
+
+def test_upsert_keeps_the_last_of_repeated_rows(caplog):
+    existing = margins(['2020_01_A'], ['KC'])
+    new = margins(['2020_01_A', '2020_01_A'], ['KC', 'KC'], seed=1)
+    combined, changed, added = upsert_margins(existing, new)
+    assert (changed, added) == (1, 0)
+    assert combined.iloc[0].tolist() == new.iloc[1].tolist()
+    assert 'repeat a team and week' in caplog.text
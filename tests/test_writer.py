@@ -0,0 +1,62 @@
+import numpy
+import pandas as pd
+import pytest
+
+from filmmargin.Writer import MarginWriter, read_margins
+
+def margins(n=25):
+    rng = numpy.random.default_rng(0)
+    return pd.DataFrame({
+        'game_id' : ['2020_{0:02d}_A_B'.format(i) for i in range(0, n)],
+        'season' : 2020,
+        'team' : rng.choice(['KC', 'LV'], n),
+        'margin' : rng.integers(-20, 20, n).astype(float),
+        'film_margin' : rng.normal(0, 10, n)
+    })
+
+@pytest.mark.parametrize('name', ['margins.parquet', 'margins.arrow'])
+def test_columnar_round_trip(tmp_path, name):
+    df = margins()
+    path = tmp_path / name
+    assert MarginWriter(path, chunk_size=7).write(df) == len(df)
+    pd.testing.assert_frame_equal(read_margins(path), df, check_dtype=False)
+
+def test_csv_round_trip_rounds_floats(tmp_path):
+    df = margins()
+    path = tmp_path / 'margins.csv'
+    assert MarginWriter(path, chunk_size=7).write(df) == len(df)
+    ## one header, no index ##
+    assert path.read_text().count('game_id') == 1
+    expected = df.copy()
+    expected['film_margin'] = expected['film_margin'].round(4)
+    pd.testing.assert_frame_equal(read_margins(path), expected, check_dtype=False)
+
+def test_empty_frame_keeps_its_columns(tmp_path):
+    df = margins().iloc[:0]
+    for name in ['margins.csv', 'margins.parquet']:
+        path = tmp_path / name
+        assert MarginWriter(path).write(df) == 0
+        assert list(read_margins(path).columns) == list(df.columns)
+
+@pytest.mark.parametrize('name', ['margins.csv', 'margins.parquet', 'margins.arrow'])
+def test_failed_write_leaves_the_file_as_it_was(tmp_path, name):
+    path = tmp_path / name
+    writer = MarginWriter(path, chunk_size=5)
+    writer.write(margins(10))
+    before = read_margins(path)
+    def chunks():
+        yield margins(5)
+        raise RuntimeError('lost the connection')
+    with pytest.raises(RuntimeError):
+        writer.write_chunks(chunks())
+    pd.testing.assert_frame_equal(read_margins(path), before)
+    assert [p.name for p in tmp_path.iterdir()] == [name]
+
+def test_read_margins_drops_an_old_index_column(tmp_path):
+    path = tmp_path / 'margins.csv'
+    margins().to_csv(path)
+    assert list(read_margins(path).columns) == list(margins().columns)
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        MarginWriter('margins.csv', format='xlsx')
@@ -1,5 +1,125 @@
+import argparse
+import logging
 import sys
-import filmmargin
 
-if sys.argv[1] == 'run':
-    filmmargin.update_margins()
\ No newline at end of file
+## each command imports only the part of the package it runs, so a cold
+## start doesn't pay for dependencies it never touches ##
+parser = argparse.ArgumentParser(
+    prog='python workflow.py',
+    description='Updates and scores nfelo film margins'
+)
+commands = parser.add_subparsers(dest='command', required=True)
+## run ##
+run = commands.add_parser('run', help='update the film margins file')
+run.add_argument(
+    '--incremental', action='store_true',
+    help='only reload and upsert the latest weeks of the existing file'
+)
+run.add_argument('--lookback-weeks', type=int, default=1)
+run.add_argument('--format', choices=['csv', 'parquet', 'arrow'], default='csv')
+run.add_argument('--output', default=None)
+run.add_argument(
+    '--rollup', action='store_true',
+    help='also write the team season and team week rollups'
+)
+## update-model ##
+model = commands.add_parser('update-model', help='refit the models in config.json')
+model.add_argument(
+    '--bootstrap', type=int, default=0,
+    help='bootstrap replicates for coef intervals (default none)'
+)
+model.add_argument('--seed', type=int, default=None)
+## develop ##
+develop = commands.add_parser('develop', help='measure each field by leaving it out')
+develop.add_argument('--rounds', type=int, default=1000)
+develop.add_argument('--workers', type=int, default=1)
+develop.add_argument('--seed', type=int, default=None)
+develop.add_argument('--output', default=None, help='csv to write the results to')
+develop.add_argument(
+    '--dependents', nargs='+', default=['margin', 'seasonal_margin'],
+    help='targets to measure against, ie margin_season_others margin_next_3'
+)
+develop.add_argument(
+    '--regularization', nargs='+', default=[],
+    choices=['ridge', 'lasso', 'elastic_net'],
+    help='also score every field over a path of penalties with these methods'
+)
+develop.add_argument('--l1-ratio', type=float, default=0.5, help='elastic_net l1 share')
+develop.add_argument('--path-output', default=None, help='csv to write the paths to')
+develop.add_argument(
+    '--checkpoint', default=None,
+    help='directory to stream results to, which resumes an interrupted run'
+)
+## backtest ##
+backtest = commands.add_parser('backtest', help='walk forward through every week')
+backtest.add_argument(
+    '--forgetting', type=float, default=1.0,
+    help='weight kept by past weeks each week (default 1, no forgetting)'
+)
+backtest.add_argument('--weekly', default=None, help='csv to write the weekly results to')
+backtest.add_argument(
+    '--dependents', nargs='+', default=['margin', 'margin_next_3'],
+    help='targets to score, ie margin_next_1 (seasonal targets leak later games)'
+)
+## serve ##
+serve = commands.add_parser('serve', help='serve film margins over http from memory')
+serve.add_argument('--host', default='127.0.0.1')
+serve.add_argument('--port', type=int, default=8000)
+serve.add_argument(
+    '--cache-size', type=int, default=4096,
+    help='responses kept for repeat queries (default 4096)'
+)
+serve.add_argument('--config', default=None, help='defaults to config.json')
+## score ##
+score = commands.add_parser('score', help='score a csv or parquet of grades')
+score.add_argument('grades')
+score.add_argument('output', nargs='?', default='-', help='defaults to csv on stdout')
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+    ## progress and stage timings are logged by the package ##
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    if args.command == 'run':
+        from filmmargin.filmmargin import update_margins
+        update_margins(
+            incremental=args.incremental,
+            lookback_weeks=args.lookback_weeks,
+            output_format=args.format,
+            output_path=args.output,
+            rollup=args.rollup
+        )
+    elif args.command == 'update-model':
+        from filmmargin.development import update_model
+        update_model(bootstrap_replicates=args.bootstrap, seed=args.seed)
+    elif args.command == 'develop':
+        from filmmargin.development import run_development_regressions
+        results = run_development_regressions(
+            total_rounds=args.rounds, workers=args.workers, seed=args.seed,
+            dependents=args.dependents, regularization=args.regularization,
+            l1_ratio=args.l1_ratio, checkpoint=args.checkpoint
+        )
+        if len(args.regularization) > 0:
+            results, path = results
+            if args.path_output is not None:
+                path.to_csv(args.path_output, index=False)
+        if args.output is None:
+            results.to_csv(sys.stdout, index=False)
+        else:
+            results.to_csv(args.output, index=False)
+    elif args.command == 'backtest':
+        from filmmargin.development import run_backtest
+        weekly, seasonal = run_backtest(
+            dependents=args.dependents, forgetting=args.forgetting
+        )
+        seasonal.to_csv(sys.stdout, index=False)
+        if args.weekly is not None:
+            weekly.to_csv(args.weekly, index=False)
+    elif args.command == 'serve':
+        from filmmargin.serving import serve_margins
+        serve_margins(
+            host=args.host, port=args.port, cache_size=args.cache_size,
+            config_path=args.config
+        )
+    elif args.command == 'score':
+        from filmmargin.scoring import score_grades
+        score_grades(args.grades, output=args.output)